@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Procesamiento desatendido: vigila una carpeta de entrada y procesa cada estudio que llega.
+
+Cada .zip o carpeta DICOM que aparece (completo) en la carpeta de entrada se mueve a la cola y
+pasa por dos etapas con límites de concurrencia independientes:
+  1. segmentación: preprocessing/fastsurfer_pipeline.sh (FastSurfer + sclimbic, pesada)
+  2. postproceso:  main_local.py --skip_fs (tablas, figuras y reportes, liviana)
+
+Cada postproceso levanta su propio Xvfb en un display libre para las capturas de freeview
+(processing/cortical_parcelation_plot.py), así que varios pueden correr a la vez.
+
+La cola vive en disco (un .json por estudio dentro de la carpeta de su estado), así que si el
+proceso se corta los estudios que estaban en curso se retoman desde su última etapa completa al
+volver a iniciarlo.
+
+    <cola>/pendiente/      esperando segmentación
+    <cola>/segmentando/    en FastSurfer
+    <cola>/segmentado/     esperando postproceso
+    <cola>/postprocesando/ en main_local.py
+    <cola>/hecho/  <cola>/fallido/
+    <cola>/trabajo/<id>/   el estudio (movido desde la entrada) y sus resultados
+    <cola>/logs/<id>_<etapa>.log
+    <cola>/logs/<id>_manifiesto.json  rutas y tiempos de la segmentación (preprocessing/manifiesto.py)
+
+Ejemplos:
+    python cola_estudios.py --entrada /datos/entrada --cola /datos/cola --fastsurfer 1 --postproceso 3
+    python cola_estudios.py --cola /datos/cola --estado
+    python cola_estudios.py --cola /datos/cola --reintentar_fallidos
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import signal
+import zipfile
+import argparse
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from preprocessing.eventos import bus_desde_entorno
+from preprocessing.manifiesto import VARIABLE_MANIFIESTO, leer_manifiesto
+from processing.recursos import configurar_recursos
+
+
+DIR_PIPELINE = os.path.dirname(os.path.abspath(__file__))
+
+ESTADOS = ["pendiente", "segmentando", "segmentado", "postprocesando", "hecho", "fallido"]
+ORDEN_ESTADOS = {estado: i for i, estado in enumerate(ESTADOS)}
+# Estado en curso -> estado al que vuelve si el proceso se cortó
+EN_CURSO = {"segmentando": "pendiente", "postprocesando": "segmentado"}
+# Etapa -> (estado de espera, estado en curso, estado al terminar)
+ETAPAS = {
+    "segmentacion": ("pendiente", "segmentando", "segmentado"),
+    "postproceso": ("segmentado", "postprocesando", "hecho"),
+}
+
+# Nombres que indican una copia todavía en curso
+SUFIJOS_PARCIALES = (".part", ".tmp", ".crdownload", ".filepart", ".partial")
+# Si existe dentro de una carpeta de entrada, la carpeta se considera completa sin esperar
+MARCA_LISTO = "LISTO"
+# Segundos entre SIGTERM y SIGKILL al cortar el grupo de procesos de una etapa
+ESPERA_TERMINAR = 10
+
+
+def _log(mensaje):
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {mensaje}", flush=True)
+
+
+# ============================================================
+# Cola en disco
+# ============================================================
+def preparar_cola(cola):
+    for carpeta in ESTADOS + ["trabajo", "logs"]:
+        os.makedirs(os.path.join(cola, carpeta), exist_ok=True)
+
+
+def _ruta_json(cola, estado, id_trabajo):
+    return os.path.join(cola, estado, id_trabajo + ".json")
+
+
+def guardar_trabajo(cola, estado, trabajo):
+    """Escritura atómica del .json del trabajo en la carpeta de su estado."""
+    ruta = _ruta_json(cola, estado, trabajo["id"])
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(trabajo, f, ensure_ascii=False, indent=1)
+    os.replace(temporal, ruta)
+
+
+def mover_trabajo(cola, trabajo, hacia, **cambios):
+    """
+    Pasa el trabajo a otro estado: primero escribe el nuevo .json y después borra el anterior.
+    Si el proceso se corta entre ambos pasos, recuperar_cola() se queda con el estado más avanzado.
+    """
+    desde = trabajo["estado"]
+    trabajo.update(cambios)
+    trabajo["estado"] = hacia
+    trabajo.setdefault("historial", []).append({"estado": hacia, "fecha": time.time()})
+    guardar_trabajo(cola, hacia, trabajo)
+    if desde != hacia:
+        try:
+            os.remove(_ruta_json(cola, desde, trabajo["id"]))
+        except FileNotFoundError:
+            pass
+    return trabajo
+
+
+def listar_trabajos(cola, estado):
+    """Trabajos de un estado, del más antiguo al más nuevo."""
+    trabajos = []
+    carpeta = os.path.join(cola, estado)
+    for nombre in os.listdir(carpeta):
+        if not nombre.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(carpeta, nombre), "r", encoding="utf-8") as f:
+                trabajos.append(json.load(f))
+        except (OSError, ValueError):
+            _log(f"Advertencia: no se pudo leer {os.path.join(carpeta, nombre)}; se ignora.")
+    return sorted(trabajos, key=lambda t: (t.get("creado", 0), t["id"]))
+
+
+def _grupo_vivo(proceso):
+    """
+    True si todavía corre algún proceso del grupo de la etapa registrada en el .json ('proceso':
+    pid del líder y comando). Si el líder sigue vivo se compara su comando (PID reutilizado).
+    """
+    try:
+        os.killpg(proceso["pid"], 0)
+    except (ProcessLookupError, PermissionError):
+        return False
+    try:
+        with open(f"/proc/{proceso['pid']}/cmdline", "rb") as f:
+            return f.read().split(b"\0")[:-1] == [os.fsencode(c) for c in proceso["comando"]]
+    except OSError:
+        return True  # el líder terminó pero quedan procesos del grupo
+
+
+def terminar_grupo(pid, espera=ESPERA_TERMINAR):
+    """SIGTERM al grupo de procesos de una etapa y, si sigue vivo tras 'espera' segundos, SIGKILL."""
+    for senal in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(pid, senal)
+        except ProcessLookupError:
+            return
+        limite = time.time() + espera
+        while time.time() < limite:
+            try:
+                os.killpg(pid, 0)
+            except ProcessLookupError:
+                return
+            time.sleep(0.2)
+
+
+def _asegurar_entrada(trabajo):
+    """Completa el movimiento entrada -> cola si el proceso se cortó justo después de encolar."""
+    if not os.path.exists(trabajo["entrada"]) and os.path.exists(trabajo["origen"]):
+        os.makedirs(os.path.dirname(trabajo["entrada"]), exist_ok=True)
+        shutil.move(trabajo["origen"], trabajo["entrada"])
+
+
+def recuperar_cola(cola):
+    """
+    Al iniciar: elimina duplicados de un mismo trabajo (queda el estado más avanzado) y devuelve
+    a su estado de espera los trabajos que estaban en curso cuando se cortó el proceso, cortando
+    antes su etapa si quedó corriendo (dos FastSurfer sobre el mismo SUBJECTS_DIR).
+    """
+    ubicacion = {}
+    for estado in ESTADOS:
+        for trabajo in listar_trabajos(cola, estado):
+            anterior = ubicacion.get(trabajo["id"])
+            if anterior is None or ORDEN_ESTADOS[estado] > ORDEN_ESTADOS[anterior["estado"]]:
+                if anterior is not None:
+                    os.remove(_ruta_json(cola, anterior["estado"], trabajo["id"]))
+                trabajo["estado"] = estado
+                ubicacion[trabajo["id"]] = trabajo
+            else:
+                os.remove(_ruta_json(cola, estado, trabajo["id"]))
+
+    for trabajo in ubicacion.values():
+        if trabajo["estado"] == "pendiente":
+            _asegurar_entrada(trabajo)
+        if trabajo["estado"] in EN_CURSO:
+            proceso = trabajo.pop("proceso", None)
+            if proceso and _grupo_vivo(proceso):
+                _log(f"{trabajo['id']}: su etapa sigue corriendo (pid {proceso['pid']}); se corta.")
+                terminar_grupo(proceso["pid"])
+            _log(f"Reanudando {trabajo['id']}: estaba en '{trabajo['estado']}' al cortarse el proceso.")
+            mover_trabajo(cola, trabajo, EN_CURSO[trabajo["estado"]])
+
+
+def reintentar_fallidos(cola):
+    """Vuelve a encolar los fallidos desde la etapa en la que fallaron (con los intentos en cero)."""
+    for trabajo in listar_trabajos(cola, "fallido"):
+        etapa = trabajo.get("etapa_fallida", "segmentacion")
+        trabajo["intentos"] = {}
+        mover_trabajo(cola, trabajo, ETAPAS[etapa][0], error=None)
+        _log(f"{trabajo['id']} vuelve a '{ETAPAS[etapa][0]}'.")
+
+
+def imprimir_estado(cola):
+    for estado in ESTADOS:
+        trabajos = listar_trabajos(cola, estado)
+        print(f"{estado:15s} {len(trabajos)}")
+        if estado in ("segmentando", "postprocesando", "fallido"):
+            for t in trabajos:
+                detalle = f" -> {t['error']}" if estado == "fallido" and t.get("error") else ""
+                print(f"    - {t['id']}{detalle}")
+
+
+# ============================================================
+# Carpeta de entrada
+# ============================================================
+def _ultima_modificacion(ruta):
+    if os.path.isfile(ruta):
+        return os.path.getmtime(ruta)
+    ultima = os.path.getmtime(ruta)
+    for root, dirs, files in os.walk(ruta):
+        for nombre in dirs + files:
+            try:
+                ultima = max(ultima, os.path.getmtime(os.path.join(root, nombre)))
+            except OSError:
+                pass
+    return ultima
+
+
+def entrada_completa(ruta, estable):
+    """
+    Un .zip está completo si no cambió en 'estable' segundos y es un zip válido; una carpeta, si tiene
+    el archivo LISTO o ninguno de sus archivos cambió en 'estable' segundos.
+    """
+    nombre = os.path.basename(ruta)
+    if nombre.startswith(".") or nombre.lower().endswith(SUFIJOS_PARCIALES):
+        return False
+    if os.path.isdir(ruta):
+        if os.path.exists(os.path.join(ruta, MARCA_LISTO)):
+            return True
+        return time.time() - _ultima_modificacion(ruta) >= estable
+    if nombre.lower().endswith(".zip"):
+        return time.time() - os.path.getmtime(ruta) >= estable and zipfile.is_zipfile(ruta)
+    return False
+
+
+def _id_usado(cola, id_trabajo):
+    return (os.path.exists(os.path.join(cola, "trabajo", id_trabajo))
+            or any(os.path.exists(_ruta_json(cola, estado, id_trabajo)) for estado in ESTADOS))
+
+
+def _nuevo_id(cola, nombre):
+    """
+    <fecha>_<nombre sin .zip>, con _2, _3... si ya hay un trabajo con ese id (X.zip y la carpeta X/
+    encolados en el mismo segundo compartirían id, .json y carpeta de trabajo).
+    """
+    base = re.sub(r"[^\w.-]+", "_", os.path.splitext(nombre)[0] if nombre.lower().endswith(".zip") else nombre)
+    id_trabajo = f"{time.strftime('%Y%m%d-%H%M%S')}_{base}"
+    candidato, n = id_trabajo, 1
+    while _id_usado(cola, candidato):
+        n += 1
+        candidato = f"{id_trabajo}_{n}"
+    return candidato
+
+
+def encolar_nuevos(entrada, cola, estable):
+    """Mueve a la cola cada estudio completo de la carpeta de entrada y crea su trabajo 'pendiente'."""
+    nuevos = []
+    for nombre in sorted(os.listdir(entrada)):
+        origen = os.path.join(entrada, nombre)
+        try:
+            if not entrada_completa(origen, estable):
+                continue
+        except OSError:
+            continue  # desapareció mientras se revisaba
+        id_trabajo = _nuevo_id(cola, nombre)
+        destino = os.path.join(cola, "trabajo", id_trabajo, nombre.replace(" ", "_"))
+        trabajo = {
+            "id": id_trabajo,
+            "origen": origen,
+            "entrada": destino,
+            "creado": time.time(),
+            "estado": "pendiente",
+            "intentos": {},
+            "dicom_dir": None,
+            "error": None,
+        }
+        # Primero el .json (si se corta acá, recuperar_cola termina de mover la entrada)
+        guardar_trabajo(cola, "pendiente", trabajo)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        shutil.move(origen, destino)
+        _log(f"Encolado {id_trabajo} ({nombre}).")
+        nuevos.append(trabajo)
+    return nuevos
+
+
+def esperar_eventos(entrada, segundos):
+    """Espera hasta 'segundos' o hasta que cambie algo en la entrada (inotifywait si está instalado)."""
+    if shutil.which("inotifywait"):
+        subprocess.run(["inotifywait", "-qq", "-t", str(max(1, int(segundos))),
+                        "-e", "close_write,moved_to,create", entrada],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        time.sleep(segundos)
+
+
+# ============================================================
+# Etapas
+# ============================================================
+def comando_etapa(etapa, trabajo, args_postproceso):
+    # El postproceso siempre con --resume: un reintento sólo repite las etapas que fallaron
+    if etapa == "segmentacion":
+        return ["bash", os.path.join(DIR_PIPELINE, "preprocessing", "fastsurfer_pipeline.sh"), trabajo["entrada"]]
+    return [sys.executable, os.path.join(DIR_PIPELINE, "main_local.py"),
+            "--skip_fs", "--dicom_dir", trabajo["dicom_dir"], "--resume"] + list(args_postproceso)
+
+
+def ejecutar_etapa(comando, ruta_log, entorno=None, al_iniciar=None):
+    """
+    Corre la etapa en un proceso aparte (un fallo o un cuelgue no afecta al daemon). Devuelve el código.
+    El proceso encabeza su propio grupo (start_new_session) para poder cortar la etapa entera
+    (FastSurfer, sclimbic, Xvfb...) con terminar_grupo(); al_iniciar(proceso) recibe el Popen.
+    """
+    with open(ruta_log, "a", encoding="utf-8") as log:
+        log.write(f"\n===== {time.strftime('%Y-%m-%d %H:%M:%S')} $ {' '.join(comando)}\n")
+        log.flush()
+        env = dict(os.environ, **entorno) if entorno else None
+        proceso = subprocess.Popen(comando, stdout=log, stderr=subprocess.STDOUT, cwd=DIR_PIPELINE, env=env,
+                                   start_new_session=True)
+        if al_iniciar is not None:
+            al_iniciar(proceso)
+        return proceso.wait()
+
+
+def ruta_manifiesto(cola, trabajo):
+    return os.path.join(cola, "logs", f"{trabajo['id']}_manifiesto.json")
+
+
+def dicom_dir_desde_manifiesto(ruta):
+    """Carpeta DICOM del manifiesto de fastsurfer_pipeline.sh (None si no terminó bien)."""
+    manifiesto = leer_manifiesto(ruta)
+    if manifiesto and manifiesto.get("estado") == "completado":
+        return manifiesto.get("dicom_dir")
+    return None
+
+
+def dicom_dir_desde_log(ruta_log):
+    """Último 'Directorio de DICOM: ...' en el log de la etapa (trabajos segmentados antes del manifiesto)."""
+    dicom_dir = None
+    with open(ruta_log, "r", encoding="utf-8", errors="ignore") as f:
+        for linea in f:
+            if "Directorio de DICOM" in linea:
+                dicom_dir = linea.split(": ", 1)[1].strip()
+    return dicom_dir
+
+
+# ============================================================
+# Daemon
+# ============================================================
+def ejecutar_daemon(entrada, cola, n_fastsurfer=1, n_postproceso=2, intervalo=10, estable=30,
+                    reintentos=1, args_postproceso=()):
+    """
+    Bucle principal: encola lo nuevo, despacha trabajos a cada pool según su límite y registra
+    los resultados. SIGTERM/Ctrl+C: no toma trabajos nuevos y espera a los que están corriendo
+    (una segunda señal corta enseguida sus grupos de procesos; esos trabajos se retoman al reiniciar).
+    """
+    # Las etapas corren con cwd en el pipeline: rutas absolutas
+    entrada, cola = os.path.abspath(entrada), os.path.abspath(cola)
+    # Si faltan recursos del postproceso se avisa al arrancar, no después de segmentar
+    configurar_recursos()
+    preparar_cola(cola)
+    recuperar_cola(cola)
+    pools = {
+        "segmentacion": ThreadPoolExecutor(max_workers=n_fastsurfer),
+        "postproceso": ThreadPoolExecutor(max_workers=n_postproceso),
+    }
+    limites = {"segmentacion": n_fastsurfer, "postproceso": n_postproceso}
+    # Eventos por estudio y etapa hacia EVENTOS_PIPELINE (las etapas heredan la variable)
+    bus = bus_desde_entorno()
+    en_curso = {}  # futuro -> (etapa, trabajo, ruta_log)
+    procesos = {}  # id de trabajo -> Popen de su etapa en curso
+    detener = {"pedido": False}
+
+    def _al_iniciar(trabajo, comando):
+        # El pid queda en el .json: si el daemon muere sin cortar la etapa, recuperar_cola la corta
+        def registrar(proceso):
+            procesos[trabajo["id"]] = proceso
+            trabajo["proceso"] = {"pid": proceso.pid, "comando": comando}
+            guardar_trabajo(cola, trabajo["estado"], trabajo)
+        return registrar
+
+    def _senal(signum, frame):
+        if detener["pedido"]:
+            raise KeyboardInterrupt
+        detener["pedido"] = True
+        _log("Deteniendo: se espera a los trabajos en curso (otra señal para cortar ya).")
+
+    signal.signal(signal.SIGTERM, _senal)
+    signal.signal(signal.SIGINT, _senal)
+    _log(f"Vigilando {entrada} | cola {cola} | FastSurfer x{n_fastsurfer} | postproceso x{n_postproceso}")
+
+    try:
+        while not detener["pedido"] or en_curso:
+            if not detener["pedido"]:
+                encolar_nuevos(entrada, cola, estable)
+
+                # Despachar hasta completar el límite de cada pool
+                for etapa, (espera, corriendo, _) in ETAPAS.items():
+                    libres = limites[etapa] - sum(1 for e, _, _ in en_curso.values() if e == etapa)
+                    for trabajo in listar_trabajos(cola, espera)[:max(0, libres)]:
+                        trabajo["intentos"][etapa] = trabajo["intentos"].get(etapa, 0) + 1
+                        mover_trabajo(cola, trabajo, corriendo)
+                        ruta_log = os.path.join(cola, "logs", f"{trabajo['id']}_{etapa}.log")
+                        comando = comando_etapa(etapa, trabajo, args_postproceso)
+                        entorno = ({VARIABLE_MANIFIESTO: ruta_manifiesto(cola, trabajo)}
+                                   if etapa == "segmentacion" else None)
+                        futuro = pools[etapa].submit(ejecutar_etapa, comando, ruta_log, entorno,
+                                                     _al_iniciar(trabajo, comando))
+                        en_curso[futuro] = (etapa, trabajo, ruta_log)
+                        bus.inicio(etapa, sujeto=trabajo["id"], intento=trabajo["intentos"][etapa])
+                        _log(f"{trabajo['id']}: inicia {etapa} (intento {trabajo['intentos'][etapa]}).")
+
+            # Registrar los que terminaron
+            for futuro in [f for f in en_curso if f.done()]:
+                etapa, trabajo, ruta_log = en_curso.pop(futuro)
+                procesos.pop(trabajo["id"], None)
+                trabajo.pop("proceso", None)
+                _, _, siguiente = ETAPAS[etapa]
+                try:
+                    codigo = futuro.result()
+                    error = None if codigo == 0 else f"{etapa} terminó con código {codigo} (ver {ruta_log})"
+                except Exception as e:
+                    error = f"{etapa}: {type(e).__name__}: {e}"
+
+                cambios = {}
+                if error is None and etapa == "segmentacion":
+                    cambios["dicom_dir"] = (dicom_dir_desde_manifiesto(ruta_manifiesto(cola, trabajo))
+                                            or dicom_dir_desde_log(ruta_log))
+                    if not cambios["dicom_dir"]:
+                        error = f"El manifiesto {ruta_manifiesto(cola, trabajo)} no informa la carpeta DICOM"
+
+                bus.fin(etapa, "ok" if error is None else "error", error=error, sujeto=trabajo["id"])
+                if error is None:
+                    mover_trabajo(cola, trabajo, siguiente, error=None, **cambios)
+                    _log(f"{trabajo['id']}: {etapa} completada.")
+                elif trabajo["intentos"][etapa] <= reintentos:
+                    mover_trabajo(cola, trabajo, ETAPAS[etapa][0], error=error)
+                    _log(f"{trabajo['id']}: {error}; se reintenta.")
+                else:
+                    mover_trabajo(cola, trabajo, "fallido", error=error, etapa_fallida=etapa)
+                    _log(f"{trabajo['id']}: FALLÓ ({error}).")
+
+            if en_curso:
+                wait(list(en_curso), timeout=intervalo, return_when=FIRST_COMPLETED)
+            elif not detener["pedido"]:
+                esperar_eventos(entrada, intervalo)
+    except KeyboardInterrupt:
+        _log("Corte inmediato: los trabajos en curso se retoman al reiniciar.")
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        # Corte inmediato: sin esto las etapas seguirían corriendo y, al reiniciar, se lanzaría
+        # otra igual sobre el mismo trabajo
+        for proceso in list(procesos.values()):
+            if proceso.poll() is None:
+                terminar_grupo(proceso.pid)
+        bus.cerrar()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Vigila una carpeta de entrada y procesa cada estudio (FastSurfer + morfometría) con una cola en disco.",
+        epilog="Ejemplo: python cola_estudios.py --entrada /datos/entrada --cola /datos/cola --fastsurfer 1 --postproceso 3",
+    )
+    parser.add_argument("--cola", required=True, help="Carpeta de la cola (estado, estudios y logs).")
+    parser.add_argument("--entrada", help="Carpeta vigilada donde llegan los .zip o carpetas DICOM.")
+    parser.add_argument("--fastsurfer", type=int, default=1, help="Segmentaciones (FastSurfer) simultáneas.")
+    parser.add_argument("--postproceso", type=int, default=2, help="Postprocesos (main_local.py) simultáneos (cada uno con su propio Xvfb).")
+    parser.add_argument("--intervalo", type=float, default=10, help="Segundos entre revisiones de la entrada.")
+    parser.add_argument("--estable", type=float, default=30,
+                        help="Segundos sin cambios para considerar completa una entrada (salvo archivo LISTO).")
+    parser.add_argument("--reintentos", type=int, default=1, help="Reintentos por etapa antes de marcar fallido.")
+    parser.add_argument("--reporte_incremental", action="store_true",
+                        help="Pasar --reporte_incremental a main_local.py.")
+    parser.add_argument("--estado", action="store_true", help="Mostrar el estado de la cola y salir.")
+    parser.add_argument("--reintentar_fallidos", action="store_true",
+                        help="Volver a encolar los trabajos fallidos y salir.")
+    args = parser.parse_args()
+
+    preparar_cola(args.cola)
+    if args.estado:
+        imprimir_estado(args.cola)
+        return
+    if args.reintentar_fallidos:
+        reintentar_fallidos(args.cola)
+        return
+    if not args.entrada or not os.path.isdir(args.entrada):
+        parser.error("--entrada debe ser un directorio existente.")
+
+    args_postproceso = ["--reporte_incremental"] if args.reporte_incremental else []
+    ejecutar_daemon(args.entrada, args.cola, n_fastsurfer=args.fastsurfer, n_postproceso=args.postproceso,
+                    intervalo=args.intervalo, estable=args.estable, reintentos=args.reintentos,
+                    args_postproceso=args_postproceso)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,16 @@
 # extract_patient_name.py
 import sys
-import os
-import pydicom
+
+from processing.dicom_utils import encabezado_paciente
 
 def extract_name(dicom_dir):
-    for root, _, files in os.walk(dicom_dir):
-        for file in files:
-            if file.lower().endswith(".dcm"):
-                try:
-                    path = os.path.join(root, file)
-                    ds = pydicom.dcmread(path, stop_before_pixels=True)
-                    name = ds.get("PatientName", None)
-                    if name:
-                        if isinstance(name, pydicom.valuerep.PersonName):
-                            name = str(name).replace("^", "_")
-                        return str(name).replace(" ", "_")
-                except Exception:
-                    continue
+    # Se lee del índice de encabezados del estudio (se crea la primera vez si no existe)
+    try:
+        name = encabezado_paciente(dicom_dir).get("PatientName", None)
+    except Exception:
+        return ""
+    if name:
+        return str(name).replace("^", "_").replace(" ", "_")
     return ""
 
 
@@ -25,4 +19,4 @@ if __name__ == "__main__":
         sys.exit(1)
     name = extract_name(sys.argv[1])
     if name:
-        print(name.strip().replace(" ", "_"))
\ No newline at end of file
+        print(name.strip().replace(" ", "_"))
@@ -3,10 +3,12 @@
 # coding: utf-8
 
 import os
+import sys
 import argparse
-import subprocess
 import pandas as pd
 from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn, TimeElapsedColumn
+from preprocessing.eventos import DestinoJSONL, bus_desde_entorno
+from preprocessing.manifiesto import ejecutar_preproceso
 from processing.dicom_utils import leer_dicom_y_extraer_info
 from processing.generate_stats_tables import generate_stats_tables
 from processing.volumetric_analysis import (
@@ -42,9 +44,192 @@ from processing.grafico_temporal import generar_graficos_volumen_edad
 from processing.reporte_general import generate_morphometric_report_general
 from processing.reporte_epilepsia import generate_morphometric_report_epilepsia
 from processing.reporte_pediatrico import generate_morphometric_report_pediatrico
+from processing.reporte_pdf import registro_imagenes
+from processing.etapas import ejecutar_etapas, etapas_incompletas, ruta_estado
+from processing.entradas_reportes import ENTRADAS_REPORTES
+from processing.recursos import configurar_recursos, recursos
 import re 
 
 
+def evento_preproceso_a_bus(bus):
+    """Pasa los pasos registrados en el manifiesto del preprocesamiento al bus de eventos."""
+    def _reenviar(evento):
+        if evento["tipo"] == "paso":
+            estado = "ok" if evento["codigo"] == 0 else f"error (código {evento['codigo']})"
+            bus.progreso("preprocesamiento", mensaje=f"{evento['nombre']}: {estado} en {evento['segundos'] / 60:.1f} min",
+                         paso=evento["nombre"], codigo=evento["codigo"], segundos=evento["segundos"])
+    return _reenviar
+
+
+def destino_progreso(progress, tarea):
+    """Destino de eventos que muestra la etapa en curso en la barra de progreso."""
+    def _actualizar(evento):
+        if evento["tipo"] == "inicio":
+            progress.update(tarea, description=evento.get("descripcion") or evento["etapa"])
+        elif evento["tipo"] == "fin":
+            progress.advance(tarea)
+    return _actualizar
+
+
+def _datos_paciente(c):
+    paciente_info = leer_dicom_y_extraer_info(c["dicom_dir"])
+    print(f"Edad: {paciente_info['edad']}, Género: {paciente_info['género']}")
+    edad = int(paciente_info["edad"].split()[0])
+    genero = paciente_info["género"]
+    base_control_path = seleccionar_base_control(edad, genero)
+    print(f"Base de control seleccionada: {base_control_path}")
+    return {"edad": edad, "genero": genero, "base_control_path": base_control_path}
+
+
+def _volumetria(c):
+    df_final, resultados_asimetria = procesar_volumenes(c["stats_folder"], c["base_control_path"])
+    output_excel = os.path.join(c["stats_folder"], "volumetria.xlsx")
+    print("Exportando resultados a Excel...")
+    exportar_volumetria_excel(df_final, resultados_asimetria, output_excel)
+
+
+def _espesores(c):
+    procesar_espesores(c["stats_folder"], c["edad"], c["genero"])
+    graficar_espesores(c["stats_folder"])
+
+
+def _areas(c):
+    procesar_areas(c["stats_folder"], c["edad"], c["genero"])
+    graficar_areas(c["stats_folder"])
+
+
+def _plegamiento(c):
+    procesar_foldind(c["stats_folder"], c["edad"], c["genero"])
+    graficar_foldind(c["stats_folder"])
+
+
+def _especificos(c):
+    base_control_path_especificos = seleccionar_base_control_especificos(c["edad"], c["genero"])
+    out_esp = os.path.join(c["stats_folder"], "Especificos.xlsx")
+    comparar_morfometria_y_exportar(c["stats_folder"], base_control_path_especificos, out_esp)
+
+
+def _perfil_volumetrico(c):
+    base_control_path_txt = seleccionar_base_control_txt(c["edad"], c["genero"])
+    print(f"Base de datos control seleccionada para gráficos del perfil volumétrico: {base_control_path_txt}")
+    generar_heatmap_pentagono(c["stats_folder"], base_control_path_txt)
+
+
+def _graficos_temporales(c):
+    directorio_poblacion = recursos.directorio("normativa_temporales")
+    generar_graficos_volumen_edad(c["genero"], c["edad"],
+        path_sujeto=os.path.join(c["stats_folder"], "Especificos.xlsx"),
+        path_poblacion_dir=directorio_poblacion,
+        path_salida=os.path.join(c["stats_folder"], "graficos_temporales")
+    )
+
+
+def _reporte(generar):
+    def _generar(c):
+        generar(c["dicom_dir"], c["subjects_dir"], c["base_control_path"], incremental=c["reporte_incremental"])
+    return _generar
+
+
+def etapas_postproceso():
+    """
+    Etapas del análisis morfométrico en orden (ver processing/etapas.py). 'depende' lista las
+    etapas cuyos archivos se usan; si una falla, sólo se omiten las que dependen de ella.
+    'genera' son las tablas y figuras que escribe cada etapa (como en ENTRADAS_REPORTES; una
+    entrada terminada en "/" es una carpeta): cada reporte depende sólo de las etapas que generan
+    sus entradas, así una figura que falla omite únicamente los reportes que la usan.
+    """
+    def etapa(nombre, descripcion, funcion, depende=(), siempre=False, genera=()):
+        return {"nombre": nombre, "descripcion": descripcion, "funcion": funcion,
+                "depende": list(depende), "siempre": siempre, "genera": list(genera)}
+
+    figuras = [
+        # 1. FastSurfer
+        etapa("tablas_fastsurfer", "Generando tablas de FastSurfer...",
+              lambda c: generate_stats_tables(c["dicom_dir"])),
+        etapa("parcelacion_cortical", "Generando visualización de parcelación cortical...",
+              lambda c: generate_parcelation_plot(c["dicom_dir"], c["subjects_dir"]),
+              genera=["mri/parcelacion_cortical.png", "mri/sclimbic_3d.png"]),
+        # 2. FSL
+        etapa("mascaras", "Generando máscaras macroestructurales...",
+              lambda c: generate_brain_masks(c["subjects_dir"])),
+        etapa("capturas_macroestructuras", "Generando capturas de macroestructuras...",
+              lambda c: generate_macrostructure_plots(c["dicom_dir"], c["subjects_dir"]), ["mascaras"],
+              genera=["mri/mask/control_de_calidad.png"]),
+        etapa("capturas_especificas", "Generando capturas de estructuras especificas...",
+              lambda c: generate_macrostructure_plots_especificos(c["dicom_dir"], c["subjects_dir"]), ["mascaras"],
+              genera=["mri/mask/macroestructuras_especificos.png"]),
+        etapa("capturas_epilepsia", "Generando capturas de estructuras limbicas para reporte de epilepsia...",
+              lambda c: generate_macrostructure_plots_epilepsia(c["dicom_dir"], c["subjects_dir"]), ["mascaras"],
+              genera=["mri/mask/macroestructuras_epilepsia.png"]),
+        etapa("mallas_corticales", "Generando visualización de mallas corticales...",
+              lambda c: generate_mesh_visualization(c["dicom_dir"], c["subjects_dir"]),
+              genera=["mri/mask/mesh.png"]),
+        etapa("lobulos_3d", "Generando reconstrucción 3D de lobulos corticales...",
+              lambda c: generate_lobes_visualization(c["subjects_dir"]), ["mascaras"],
+              genera=["mri/mask/lobulos_vistas_combinadas.png"]),
+        # 3. Procesos Generales y Análisis Morfométrico
+        etapa("datos_paciente", "Leyendo datos del paciente y seleccionando base de control...",
+              _datos_paciente, siempre=True),
+        etapa("volumetria", "Procesando volúmenes y calculando asimetrías...",
+              _volumetria, ["tablas_fastsurfer", "datos_paciente"],
+              genera=["stats/volumetria.xlsx"]),
+        etapa("espesores", "Procesando espesores corticales...",
+              _espesores,
+              ["tablas_fastsurfer", "datos_paciente"],
+              genera=["stats/aparc_stats_thickness_Z_score_robusto.xlsx",
+                      "stats/aparc_stats_thickness_Z_score_robusto_plots.png"]),
+        etapa("areas", "Procesando áreas corticales...",
+              _areas,
+              ["tablas_fastsurfer", "datos_paciente"],
+              genera=["stats/aparc_stats_area_Z_score_robusto.xlsx",
+                      "stats/aparc_stats_area_Z_score_robusto_plots.png"]),
+        etapa("plegamiento", "Procesando índices de plegamiento...",
+              _plegamiento,
+              ["tablas_fastsurfer", "datos_paciente"],
+              genera=["stats/aparc_stats_foldind_Z_score_robusto.xlsx",
+                      "stats/aparc_stats_foldind_Z_score_robusto_plots.png"]),
+        etapa("especificos", "Procesando estructuras volumenes y espesores de estructuras especificas",
+              _especificos, ["datos_paciente"], genera=["stats/Especificos.xlsx"]),
+        etapa("superficie", "Procesando datos de superficie y espesor cortical para visualización...",
+              lambda c: procesar_superficie_y_grosor(c["subjects_dir"])),
+        etapa("visualizacion_espesores", "Generando visualización de superficie y espesores...",
+              lambda c: visualizar_espesores(c["subjects_dir"]), ["superficie"],
+              genera=["surf/sag_thickness.png", "surf/cor_thickness.png", "surf/ax_thickness.png"]),
+        etapa("perfil_volumetrico", "Generando gráficos del perfil volumétrico...",
+              _perfil_volumetrico, ["tablas_fastsurfer", "datos_paciente"],
+              genera=["stats/comparac_control_pentagono.png", "stats/comparac_control_heatmap.png"]),
+        etapa("poligono_general", "Generando gráficos de polígono-comparación con grupo control...",
+              lambda c: poligono_general(c["stats_folder"]), ["volumetria", "especificos"],
+              genera=["stats/pentagono_volumenes_general.png"]),
+        etapa("poligono_espesores", "Generando gráficos de polígono-espesores corticales...",
+              lambda c: pentagono_espesores(c["stats_folder"], c["edad"], c["genero"]), ["tablas_fastsurfer", "datos_paciente"],
+              genera=["stats/pentagono_espesores_lobulos.png"]),
+        etapa("poligono_epilepsia", "Generando gráficos de polígono-epilepsia...",
+              lambda c: poligono_epilepsia(c["stats_folder"]), ["especificos"],
+              genera=["stats/pentagono_epilepsia.png"]),
+        etapa("poligono_sustgris", "Generando gráficos de polígono-sustancia gris...",
+              lambda c: poligono_sustgris(c["stats_folder"]), ["especificos"],
+              genera=["stats/pentagono_sustgris.png"]),
+        etapa("graficos_temporales", "Generando gráficos temporales",
+              _graficos_temporales, ["especificos"], genera=["stats/graficos_temporales/"]),
+    ]
+    # 4. Reportes: cada uno depende de las etapas que generan sus entradas (y de datos_paciente)
+    def previas(reporte):
+        entradas = ENTRADAS_REPORTES[reporte]
+        return [e["nombre"] for e in figuras
+                if any(entrada.startswith(generado) for generado in e["genera"] for entrada in entradas)] + ["datos_paciente"]
+
+    reportes = [
+        etapa("reporte_completo", "Generando reporte morfométrico completo en PDF...",
+              _reporte(generate_morphometric_report), previas("completo")),
+        etapa("reporte_general", "Generando reporte morfométrico general en PDF...",
+              _reporte(generate_morphometric_report_general), previas("general")),
+        etapa("reporte_epilepsia", "Generando reporte morfométrico epilepsia en PDF...",
+              _reporte(generate_morphometric_report_epilepsia), previas("epilepsia")),
+        etapa("reporte_pediatrico", "Generando reporte morfométrico pediátrico en PDF...",
+              _reporte(generate_morphometric_report_pediatrico), previas("pediatrico")),
+    ]
+    return figuras + reportes
 
 
 def main():
@@ -78,7 +263,7 @@ def main():
 
     parser = argparse.ArgumentParser(
         description=banner,
-        epilog="Ejemplo: python main.py --skip_fs --dicom_dir /ruta/a/dicom",
+        epilog="Ejemplo: python main.py --skip_fs --dicom_dir /ruta/a/dicom [--resume]",
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
 
@@ -94,6 +279,40 @@ def main():
         help="Ruta al directorio que contiene los archivos DICOM del estudio.",
     )
 
+    parser.add_argument(
+        "--reporte_incremental",
+        action="store_true",
+        help="Escribir cada página de los reportes PDF a disco al terminarla y unirlas con ghostscript (memoria de una página).",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Retomar el análisis: correr sólo las etapas que fallaron o quedaron pendientes en la corrida anterior.",
+    )
+
+    parser.add_argument(
+        "--recursos",
+        type=str,
+        default=None,
+        help="Carpeta raíz de los recursos (bases normativas, fuentes, plantillas). Por defecto, RECURSOS_PIPELINE "
+             "o recursos/ junto al pipeline.",
+    )
+
+    parser.add_argument(
+        "--precargar_recursos",
+        action="store_true",
+        help="Cargar en memoria los recursos al inicio (los grandes se mapean una sola vez con mmap).",
+    )
+
+    parser.add_argument(
+        "--eventos",
+        type=str,
+        default=None,
+        help="Destinos extra de eventos de progreso, separados por coma: jsonl:/ruta, unix:/ruta.sock, http://... "
+             "(también por la variable EVENTOS_PIPELINE).",
+    )
+
     parser.add_argument(
         "input_path",
         type=str,
@@ -103,177 +322,67 @@ def main():
 
     args = parser.parse_args()
 
+    # Antes de procesar: si falta una base normativa, una fuente o una plantilla se corta acá
+    configurar_recursos(args.recursos, precargar=args.precargar_recursos)
+
+    sujeto = os.path.basename(os.path.normpath(args.dicom_dir or args.input_path or "")) or None
+    bus = bus_desde_entorno(sujeto, extra=args.eventos, consola=True)
+
     if args.skip_fs:
         if not args.dicom_dir:
             raise RuntimeError("Debe proporcionar --dicom_dir al usar --skip_fs.")
         dicom_dir = args.dicom_dir
         subjects_dir = os.path.join(dicom_dir, "FastSurfer")
     else:
-        input_path = args.input_path
-        script_path = "preprocessing/fastsurfer_pipeline.sh"
-        process = subprocess.Popen(
-            ["bash", script_path, input_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,  # Desactiva el buffering
-        )
-
-        # Leer la salida en tiempo real
-        lines = []
-        for line in process.stdout:
-            print(line, end="")
-            lines.append(line.strip())
-
-        # Esperar a que el proceso termine
-        process.wait()
-
-        if process.returncode != 0:
-            raise RuntimeError("El script fastsurfer_pipeline.sh falló.")
-
-        # Buscar el directorio de DICOM en el log de salida
-        dicom_dir = next(
-            (line.split(": ")[1] for line in lines if "Directorio de DICOM" in line),
-            None,
-        )
-        if not dicom_dir:
-            raise RuntimeError("No se encontró 'Directorio de DICOM' en el log de salida.")
-
-        # Buscar el subjects_dir en el log de salida
-        for i, line in enumerate(lines):
-            if "Resultados disponibles en" in line:
-                subjects_dir = lines[i + 1].strip()  # La ruta está en la siguiente línea
-                break
-        else:
-            raise RuntimeError("No se encontró 'Resultados disponibles en' en el log de salida.")
+        # El script registra rutas, tiempos y códigos en un manifiesto JSON (ver preprocessing/manifiesto.py)
+        with bus.etapa("preprocesamiento", "Ejecutando preprocesamiento (ingesta DICOM + FastSurfer)..."):
+            manifiesto = ejecutar_preproceso(args.input_path, al_evento=evento_preproceso_a_bus(bus))
+        if manifiesto["estado"] != "completado":
+            raise RuntimeError(f"El script fastsurfer_pipeline.sh falló (código {manifiesto['codigo']}).")
+        dicom_dir = manifiesto.get("dicom_dir")
+        subjects_dir = manifiesto.get("subjects_dir")
+        if not dicom_dir or not subjects_dir:
+            raise RuntimeError("El manifiesto del preprocesamiento no informa 'dicom_dir' / 'subjects_dir'.")
     
-    with Progress(SpinnerColumn(), BarColumn(), SpinnerColumn(),TimeElapsedColumn(), TextColumn("[cyan]Ejecutando análisis morfométrico...[/]")) as progress:
-        tarea = progress.add_task("Ejecutando análisis morfométrico...", total=None)  # Spinner global
+    # Eventos de cada etapa: consola + EVENTOS_PIPELINE (jsonl/unix/http) + eventos.jsonl del estudio
+    bus.agregar(DestinoJSONL(os.path.join(dicom_dir, "logs_fastsurfer", "eventos.jsonl")))
+
+    etapas = etapas_postproceso()
+    contexto = {
+        "dicom_dir": dicom_dir,
+        "subjects_dir": subjects_dir,
+        "stats_folder": os.path.join(subjects_dir, "stats"),
+        "reporte_incremental": args.reporte_incremental,
+    }
+    print(f"\nRuta DICOM recibida: {dicom_dir}")
+    print(f"Ruta FastSurfer esperada: {subjects_dir}")
+
+    with Progress(SpinnerColumn(), BarColumn(), SpinnerColumn(),TimeElapsedColumn(), TextColumn("[cyan]{task.description}[/] ({task.completed:.0f}/{task.total:.0f} etapas)")) as progress:
+        tarea = progress.add_task("Ejecutando análisis morfométrico...", total=len(etapas))
+        seguimiento = destino_progreso(progress, tarea)
+        bus.agregar(seguimiento)
 
         try:
-            # 1. FastSurfer
-            print("\nGenerando tablas de FastSurfer...")
-            generate_stats_tables(dicom_dir)
-        
-            print("\nGenerando visualización de parcelación cortical...")
-            generate_parcelation_plot(dicom_dir, subjects_dir)
-        
-            # 2. FSL
-            print("\nGenerando máscaras macroestructurales...")
-            generate_brain_masks(subjects_dir)
-
-            print("\nGenerando capturas de macroestructuras...")
-            generate_macrostructure_plots(dicom_dir, subjects_dir)
-
-            print("\nGenerando capturas de estructuras especificas...")
-            generate_macrostructure_plots_especificos(dicom_dir, subjects_dir)
-
-            print("\nGenerando capturas de estructuras limbicas para reporte de epilepsia...")
-            generate_macrostructure_plots_epilepsia(dicom_dir, subjects_dir)
-
-            print("\nGenerando visualización de mallas corticales...")
-            generate_mesh_visualization(dicom_dir, subjects_dir)
-
-            print("\nGenerando reconstrucción 3D de lobulos corticales...")
-            generate_lobes_visualization(subjects_dir)
-
-            # 3. Procesos Generales y Análisis Morfométrico
-            print("\nLeyendo datos del paciente...")
-            paciente_info = leer_dicom_y_extraer_info(dicom_dir)
-            print(f"Edad: {paciente_info['edad']}, Género: {paciente_info['género']}")
-        
-            print("\nSeleccionando base de control...")
-            edad = int(paciente_info["edad"].split()[0])
-            genero = paciente_info["género"]
-            base_control_path = seleccionar_base_control(edad, genero)
-            print(f"Base de control seleccionada: {base_control_path}")
-        
-            stats_folder = os.path.join(subjects_dir, "stats")
-        
-            print("\nProcesando volúmenes y calculando asimetrías...")
-            df_final, resultados_asimetria = procesar_volumenes(stats_folder, base_control_path)
-        
-            output_excel = os.path.join(stats_folder, "volumetria.xlsx")
-            print("\nExportando resultados a Excel...")
-            exportar_volumetria_excel(df_final, resultados_asimetria, output_excel)
-        
-            print("\nProcesando espesores corticales...")
-            procesar_espesores(stats_folder, edad, genero)
-            graficar_espesores(stats_folder)
-        
-            print("\nProcesando áreas corticales...")
-            procesar_areas(stats_folder, edad, genero)
-            graficar_areas(stats_folder)
-        
-            print("\nProcesando índices de plegamiento...")
-            procesar_foldind(stats_folder, edad, genero)
-            graficar_foldind(stats_folder)
-
-            print("\nProcesando estructuras volumenes y espesores de estructuras especificas")
-
-            base_control_path_especificos=seleccionar_base_control_especificos(edad,genero)
-            out_esp=os.path.join(stats_folder,"Especificos.xlsx")
-            comparar_morfometria_y_exportar(stats_folder,base_control_path_especificos ,out_esp)
-
-            print("\nProcesando datos de superficie y espesor cortical para visualización...")
-            procesar_superficie_y_grosor(subjects_dir)
-        
-            print("\nGenerando visualización de superficie y espesores...")
-            visualizar_espesores(subjects_dir)
-        
-            base_control_path_txt = seleccionar_base_control_txt(edad, genero)
-            print(f"\nBase de datos control seleccionada para gráficos del perfil volumétrico: {base_control_path_txt}")
-            print("\nGenerando gráficos del perfil volumétrico...")
-            generar_heatmap_pentagono(stats_folder, base_control_path_txt)
-
-            print("\nGenerando gráficos de polígono-comparación con grupo control...")
-            poligono_general(stats_folder)
-            print("\nGenerando gráficos de polígono-espesores corticales...")
-            pentagono_espesores(stats_folder,edad,genero)
-            print("\nGenerando gráficos de polígono-epilepsia...")
-            poligono_epilepsia(stats_folder)
-            print("\nGenerando gráficos de polígono-sustancia gris...")
-            poligono_sustgris(stats_folder)
-
-            print("\nGenerando gráficos temporales")
-            directorio_poblacion = "/home/usuario/Bibliografia/pipeline_v2/recursos/morfo_cerebral/Temporales"
-            archivo_sujeto = os.path.join(stats_folder,"Especificos.xlsx")
-            carpeta_salida = os.path.join(stats_folder,"graficos_temporales")
-            
-            generar_graficos_volumen_edad(genero,edad,
-                path_sujeto=archivo_sujeto,
-                path_poblacion_dir=directorio_poblacion,
-                path_salida=carpeta_salida
-            )
-
-
-            # 4. Generación de Reporte Final
-            print(f"\nRuta DICOM recibida: {dicom_dir}")
-            print(f"Ruta FastSurfer esperada: {subjects_dir}")
-        
-            print("\nGenerando reporte morfométrico completo en PDF...")
-            generate_morphometric_report(dicom_dir, subjects_dir, base_control_path)
-
-            print("\nGenerando reporte morfométrico general en PDF...")
-            generate_morphometric_report_general(dicom_dir, subjects_dir, base_control_path)
-
-            print("\nGenerando reporte morfométrico epilepsia en PDF...")
-            generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control_path)
-
-            print("\nGenerando reporte morfométrico epilepsia en PDF...")
-            generate_morphometric_report_pediatrico(dicom_dir, subjects_dir, base_control_path)
-
-
-        except Exception as e:
-            print(f"\nSe produjo un error durante el procesamiento: {e}")
-        
-
-
+            # Cada etapa aislada: un error no corta las siguientes (sólo las que dependen de ella)
+            estado = ejecutar_etapas(etapas, contexto, ruta_estado(dicom_dir), reanudar=args.resume, bus=bus)
         finally:
+            # Las imágenes decodificadas se comparten entre los cuatro reportes; se liberan al final
+            registro_imagenes.limpiar()
+            bus.destinos.remove(seguimiento)
             progress.remove_task(tarea)  # Detener spinner cuando termina el script
 
-        print("\n✔ Análisis completado con éxito.")
-        print(banner)
+    bus.cerrar()
+    incompletas = etapas_incompletas(estado)
+    if incompletas:
+        print(f"\n✖ Análisis incompleto: {len(incompletas)} de {len(etapas)} etapas sin completar.")
+        for nombre, estado_etapa in incompletas.items():
+            print(f"   - {nombre}: {estado_etapa} ({estado['etapas'][nombre].get('error') or ''})")
+        print(f"Estado guardado en {ruta_estado(dicom_dir)}; para repetir sólo estas etapas: "
+              f"python main_local.py --skip_fs --dicom_dir {dicom_dir} --resume")
+        sys.exit(1)
+
+    print("\n✔ Análisis completado con éxito.")
+    print(banner)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Eventos de progreso del pipeline (inicio, progreso, fin y aviso de cada etapa, con tiempos).
+
+Cada etapa emite eventos en un bus; el bus los reparte en un hilo aparte a los destinos
+configurados, así un destino lento (HTTP, socket) no frena el procesamiento:
+
+    consola              una línea por evento en la terminal
+    jsonl:/ruta.jsonl    un JSON por línea (sirve para medir tiempos por etapa y por sujeto)
+    unix:/ruta.sock      JSON por línea a un socket Unix (ver --escuchar más abajo)
+    http://host:puerto/  POST de cada evento como JSON
+
+Los destinos se indican separados por coma, por argumento o en la variable EVENTOS_PIPELINE
+(la heredan los procesos hijos, p. ej. el planificador de FastSurfer):
+
+    bus = bus_desde_entorno("paciente_01", extra="jsonl:/tmp/eventos.jsonl", consola=True)
+    with bus.etapa("tablas", "Generando tablas de FastSurfer..."):
+        ...
+    bus.cerrar()
+
+Para seguir varios sujetos de un nodo sin mirar logs:
+    EVENTOS_PIPELINE=unix:/tmp/morfo.sock python cola_estudios.py ...
+    python preprocessing/eventos.py --escuchar /tmp/morfo.sock
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+import urllib.request
+from contextlib import contextmanager
+
+
+VARIABLE_EVENTOS = "EVENTOS_PIPELINE"
+TIPOS = ("inicio", "progreso", "fin", "aviso")
+
+
+# ============================================================
+# Destinos
+# ============================================================
+class DestinoConsola:
+    def __init__(self, flujo=None):
+        self.flujo = flujo or sys.stdout
+
+    def __call__(self, evento):
+        sujeto = f"{evento['sujeto']} | " if evento.get("sujeto") else ""
+        if evento["tipo"] == "inicio":
+            texto = evento.get("descripcion") or f"{evento['etapa']}..."
+        elif evento["tipo"] == "progreso":
+            avance = f"{evento['actual']}/{evento['total']}" if evento.get("total") else (evento.get("actual") or "")
+            texto = f"{evento['etapa']}: {avance} {evento.get('mensaje') or ''}".replace("  ", " ").rstrip()
+        elif evento["tipo"] == "fin":
+            texto = f"{evento['etapa']}: {evento['estado']} ({evento['segundos']:.1f} s)"
+            if evento.get("error"):
+                texto += f" - {evento['error']}"
+        else:
+            texto = f"Aviso en {evento['etapa']}: {evento.get('mensaje') or ''}"
+        print(f"\n{sujeto}{texto}" if evento["tipo"] == "inicio" else f"{sujeto}{texto}", file=self.flujo, flush=True)
+
+
+class DestinoJSONL:
+    def __init__(self, ruta):
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        self.archivo = open(ruta, "a", encoding="utf-8")
+
+    def __call__(self, evento):
+        self.archivo.write(json.dumps(evento, ensure_ascii=False) + "\n")
+        self.archivo.flush()
+
+    def cerrar(self):
+        self.archivo.close()
+
+
+class DestinoUnix:
+    """Envía cada evento como una línea JSON; si el monitor no está escuchando, se descarta."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.conexion = None
+
+    def __call__(self, evento):
+        linea = (json.dumps(evento, ensure_ascii=False) + "\n").encode("utf-8")
+        for _ in range(2):  # un reintento por si el monitor se reinició
+            try:
+                if self.conexion is None:
+                    self.conexion = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    self.conexion.settimeout(2)
+                    self.conexion.connect(self.ruta)
+                self.conexion.sendall(linea)
+                return
+            except OSError:
+                self.cerrar()
+
+    def cerrar(self):
+        if self.conexion is not None:
+            self.conexion.close()
+            self.conexion = None
+
+
+class DestinoHTTP:
+    def __init__(self, url, timeout=2):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, evento):
+        pedido = urllib.request.Request(self.url, data=json.dumps(evento, ensure_ascii=False).encode("utf-8"),
+                                        headers={"Content-Type": "application/json"}, method="POST")
+        urllib.request.urlopen(pedido, timeout=self.timeout).close()
+
+
+def crear_destinos(especificacion):
+    """'consola,jsonl:/ruta,unix:/ruta.sock,http://...' -> lista de destinos."""
+    destinos = []
+    for parte in (especificacion or "").split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        if parte == "consola":
+            destinos.append(DestinoConsola())
+        elif parte.startswith("jsonl:"):
+            destinos.append(DestinoJSONL(parte[len("jsonl:"):]))
+        elif parte.startswith("unix:"):
+            destinos.append(DestinoUnix(parte[len("unix:"):]))
+        elif parte.startswith(("http://", "https://")):
+            destinos.append(DestinoHTTP(parte))
+        else:
+            raise ValueError(f"Destino de eventos desconocido: {parte}")
+    return destinos
+
+
+# ============================================================
+# Bus
+# ============================================================
+class BusEventos:
+    """
+    Emite eventos {"tiempo", "tipo", "sujeto", "etapa", "pid", ...} y los entrega a cada destino
+    (un callable que recibe el evento) desde un hilo propio. Un destino que falla no corta el
+    pipeline: se informa una vez por stderr y se sigue con los demás.
+    """
+
+    def __init__(self, sujeto=None, destinos=()):
+        self.sujeto = sujeto
+        self.destinos = list(destinos)
+        self._inicios = {}
+        self._fallidos = set()
+        self._cola = queue.Queue()
+        self._hilo = threading.Thread(target=self._repartir, name="bus-eventos", daemon=True)
+        self._hilo.start()
+
+    def agregar(self, destino):
+        self.destinos.append(destino)
+
+    def _repartir(self):
+        while True:
+            evento = self._cola.get()
+            if evento is None:
+                break
+            for destino in list(self.destinos):
+                try:
+                    destino(evento)
+                except Exception as e:
+                    if id(destino) not in self._fallidos:
+                        self._fallidos.add(id(destino))
+                        print(f"[eventos] {type(destino).__name__} falló: {e}", file=sys.stderr)
+
+    def emitir(self, tipo, etapa, **datos):
+        evento = {"tiempo": time.time(), "tipo": tipo, "sujeto": self.sujeto, "etapa": etapa, "pid": os.getpid()}
+        evento.update(datos)
+        self._cola.put(evento)
+        return evento
+
+    def inicio(self, etapa, descripcion=None, **datos):
+        # 'sujeto' en datos permite que un mismo bus siga varios sujetos (p. ej. la cola de estudios)
+        self._inicios[(datos.get("sujeto", self.sujeto), etapa)] = time.time()
+        return self.emitir("inicio", etapa, descripcion=descripcion, **datos)
+
+    def progreso(self, etapa, actual=None, total=None, mensaje=None, **datos):
+        return self.emitir("progreso", etapa, actual=actual, total=total, mensaje=mensaje, **datos)
+
+    def fin(self, etapa, estado="ok", error=None, **datos):
+        inicio = self._inicios.pop((datos.get("sujeto", self.sujeto), etapa), None)
+        segundos = round(time.time() - inicio, 3) if inicio else 0.0
+        return self.emitir("fin", etapa, estado=estado, segundos=segundos, error=error, **datos)
+
+    def aviso(self, etapa, mensaje, **datos):
+        return self.emitir("aviso", etapa, mensaje=mensaje, **datos)
+
+    @contextmanager
+    def etapa(self, nombre, descripcion=None, **datos):
+        """Emite inicio y fin (estado 'ok' o 'error') alrededor del bloque; las excepciones siguen de largo."""
+        self.inicio(nombre, descripcion, **datos)
+        try:
+            yield self
+        except BaseException as e:
+            self.fin(nombre, "error", error=f"{type(e).__name__}: {e}")
+            raise
+        self.fin(nombre, "ok")
+
+    def cerrar(self):
+        """Entrega los eventos pendientes y cierra los destinos."""
+        self._cola.put(None)
+        self._hilo.join()
+        for destino in self.destinos:
+            cerrar = getattr(destino, "cerrar", None)
+            if cerrar:
+                cerrar()
+
+
+def bus_desde_entorno(sujeto=None, extra=None, consola=False):
+    """Bus con los destinos de EVENTOS_PIPELINE más los de 'extra'; con consola=True la consola va siempre (una vez)."""
+    partes = [p.strip() for p in f"{os.environ.get(VARIABLE_EVENTOS, '')},{extra or ''}".split(",") if p.strip()]
+    if consola and "consola" not in partes:
+        partes.insert(0, "consola")
+    return BusEventos(sujeto, crear_destinos(",".join(partes)))
+
+
+# ============================================================
+# Monitor
+# ============================================================
+def escuchar(ruta_socket, ruta_jsonl=None):
+    """Recibe eventos de varios procesos por un socket Unix y muestra una línea por evento."""
+    if os.path.exists(ruta_socket):
+        os.remove(ruta_socket)
+    servidor = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    servidor.bind(ruta_socket)
+    servidor.listen()
+    destinos = [DestinoConsola()] + ([DestinoJSONL(ruta_jsonl)] if ruta_jsonl else [])
+    candado = threading.Lock()
+
+    def _atender(conexion):
+        with conexion, conexion.makefile("r", encoding="utf-8") as lector:
+            for linea in lector:
+                try:
+                    evento = json.loads(linea)
+                except ValueError:
+                    continue
+                with candado:
+                    for destino in destinos:
+                        destino(evento)
+
+    print(f"Escuchando eventos en {ruta_socket} (Ctrl+C para salir)...")
+    try:
+        while True:
+            conexion, _ = servidor.accept()
+            threading.Thread(target=_atender, args=(conexion,), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.close()
+        os.remove(ruta_socket)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monitor de eventos del pipeline.")
+    parser.add_argument("--escuchar", required=True, help="Socket Unix donde recibir eventos.")
+    parser.add_argument("--jsonl", default=None, help="Guardar además todos los eventos en este archivo.")
+    args = parser.parse_args()
+    escuchar(args.escuchar, args.jsonl)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,10 +33,10 @@ echo "                                                                  "
 show_help() {
     echo "Este script procesa imágenes anatómicas T1 para obtener la segmentación y, posteriormente, la información morfológica en el espacio canónico del paciente."
     echo "Realiza las siguientes tareas:"
-    echo "  1. Descomprime un archivo .zip (si corresponde)."
+    echo "  1. Si recibe un .zip, lee los encabezados sin descomprimir y extrae sólo la serie T1."
     echo "  2. Renombra archivos y carpetas para evitar espacios."
-    echo "  3. Busca automáticamente el directorio con archivos DICOM."
-    echo "  4. Convierte los archivos DICOM a formato NIfTI."
+    echo "  3. Agrupa los DICOM por serie (sólo encabezados) y elige la serie T1."
+    echo "  4. Convierte la serie T1 a formato NIfTI (reutiliza la conversión si ya existe)."
     echo "  5. Procesa las imágenes usando FreeSurfer (recon-all)."
     echo "  6. Realiza otra segmentación con una red neuronal convolucional en mri_synthseg."
     echo ""
@@ -73,6 +73,22 @@ if [ "$#" -ne 1 ]; then
 fi
 
 INPUT="$1"
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
+# Manifiesto JSON con rutas, tiempos y códigos de cada paso (lo leen main_local.py y
+# cola_estudios.py; ver manifiesto.py). Si no se indica MANIFIESTO_PREPROCESO se usa un
+# temporal y al final queda la copia en $LOG_DIR.
+MANIFIESTO="${MANIFIESTO_PREPROCESO:-$(mktemp --suffix=.json)}"
+manifiesto() { python3 "$SCRIPT_DIR/manifiesto.py" "$MANIFIESTO" "$@"; }
+ahora() { date +%s.%N; }
+terminar() {
+    local codigo=$?
+    manifiesto cerrar "$codigo" ${LOG_DIR:+--copia_en "$LOG_DIR"}
+    [ -z "$MANIFIESTO_PREPROCESO" ] && rm -f "$MANIFIESTO"
+    return "$codigo"
+}
+trap terminar EXIT
+manifiesto iniciar --entrada "$INPUT"
 
 # Determinar si la entrada es un archivo .zip o un directorio
 if [[ "$INPUT" == *.zip ]]; then
@@ -81,64 +97,36 @@ if [[ "$INPUT" == *.zip ]]; then
         exit 1
     fi
 
+    # No se descomprime todo el archivo: los encabezados se leen desde el .zip y sólo
+    # se extrae la serie T1 (junto al .zip, con la misma estructura de carpetas)
     ZIP_DIR=$(dirname "$INPUT")
-    echo "Descomprimiendo $INPUT en $ZIP_DIR..."
-    unzip -o "$INPUT" -d "$ZIP_DIR" || { echo "Error al descomprimir $INPUT."; exit 1; }
-
-    # Obtener el nombre original de la carpeta raíz
-    ROOT_DIR=$(unzip -Z -1 "$INPUT" | head -1 | sed 's|/.*||')
-    ROOT_DIR="$ZIP_DIR/$ROOT_DIR"
-
-    # Renombrar la carpeta raíz si contiene espacios
-    if [[ "$ROOT_DIR" == *" "* ]]; then
-        RENAMED_ROOT_DIR="${ROOT_DIR// /_}"
-        mv "$ROOT_DIR" "$RENAMED_ROOT_DIR"
-        ROOT_DIR="$RENAMED_ROOT_DIR"
-        echo "La carpeta raíz fue renombrada a: $ROOT_DIR"
-    fi
+    echo "Leyendo series DICOM dentro de $INPUT (sólo se extraerá la serie T1 en $ZIP_DIR)..."
+    FUENTE="$INPUT"
 else
     if [ ! -d "$INPUT" ]; then
         echo "Error: el directorio $INPUT no existe."
         exit 1
     fi
     ROOT_DIR="$INPUT"
+    echo "Buscando series DICOM en $ROOT_DIR..."
+    FUENTE="$ROOT_DIR"
 fi
 
-# Verificar si el directorio raíz existe
-if [ ! -d "$ROOT_DIR" ]; then
-    echo "Error: No se encontró el directorio raíz en $ROOT_DIR."
-    exit 1
-fi
-
-# Renombrar subcarpetas y archivos dentro de la carpeta raíz
-echo "Renombrando archivos y carpetas en $ROOT_DIR..."
-python3 << EOF
-import os
-for root, dirs, files in os.walk("$ROOT_DIR", topdown=False):
-    for name in dirs + files:
-        old_path = os.path.join(root, name)
-        new_name = name.replace(' ', '_')
-        new_path = os.path.join(root, new_name)
-        if old_path != new_path:
-            os.rename(old_path, new_path)
-EOF
-
-# Paso 2: Buscar subcarpeta con archivos DICOM
-DICOM_DIR=$(find "$ROOT_DIR" -type f -name "*.dcm" -exec dirname {} \; | head -1)
-if [ -z "$DICOM_DIR" ]; then
-    echo "Error: No se encontró un directorio con archivos DICOM en $ROOT_DIR."
+# Paso 2: Renombrar archivos/carpetas con espacios, elegir la serie T1 leyendo sólo encabezados DICOM
+# y convertirla a NIfTI (dcm2niix sólo corre si la serie no tiene ya una conversión registrada)
+T_INICIO=$(ahora)
+INGESTA=$(python3 "$SCRIPT_DIR/ingesta_dicom.py" "$FUENTE" --sin_espacios --convertir) || {
+    manifiesto paso ingesta 1 "$T_INICIO" "$(ahora)"
+    echo "Error: No se pudo obtener la serie T1 en NIfTI a partir de $FUENTE."
     exit 1
-fi
+}
+eval "$INGESTA"
+manifiesto paso ingesta 0 "$T_INICIO" "$(ahora)"
 
 echo "Directorio de DICOM: $DICOM_DIR"
+echo "Serie T1: ${SERIE_DESCRIPCION:-sin descripción} ($SERIE_UID)"
 
-# Paso 3: Convertir DICOM a NIfTI
-echo "Convirtiendo DICOM a NIfTI..."
-dcm2niix -z n -f "%d" -o "$DICOM_DIR" "$DICOM_DIR" || { echo "Error al convertir DICOM a NIfTI."; exit 1; }
-
-# Buscar el archivo NIfTI generado
-NII_FILE=$(find "$DICOM_DIR" -maxdepth 1 -type f -name "*.nii")
-if [ -z "$NII_FILE" ]; then
+if [ -z "$NII_FILE" ] || [ ! -f "$NII_FILE" ]; then
     echo "Error: No se generó un archivo NIfTI en $DICOM_DIR."
     exit 1
 fi
@@ -149,6 +137,8 @@ echo "Archivo NIfTI generado: $NII_FILE"
 SUBJECTS_DIR="$DICOM_DIR"
 export SUBJECTS_DIR
 SUBJECT_NAME="FastSurfer"
+manifiesto campos dicom_dir="$DICOM_DIR" nifti="$NII_FILE" serie_uid="$SERIE_UID" \
+    subjects_dir="$SUBJECTS_DIR/$SUBJECT_NAME"
 
 LOG_DIR="$SUBJECTS_DIR/logs_fastsurfer"
 mkdir -p "$LOG_DIR"
@@ -162,25 +152,19 @@ source /home/usuario/miniconda3/etc/profile.d/conda.sh
 
 conda activate fastsurfer
 
-# Paso 5: Ejecutar FreeSurfer recon-all
-if [ -f "$NII_FILE" ]; then
-    echo "Ejecutando recon-all en modo paralelo..."
-    echo "Usando archivo NIfTI: $NII_FILE"
-    N_CORES=6  # Ajusta este valor según el número de núcleos disponibles
-
-    "$FASTSURFER_HOME/run_fastsurfer.sh" --sid "$SUBJECT_NAME" --t1 "$NII_FILE" --sd "$SUBJECTS_DIR" --device cpu --fs_license "$FREESURFER_HOME/license.txt" --threads "$N_CORES" --vox_size 1.0 --allow_root
-else
-    echo "Error: El archivo NIfTI no existe o no se encuentra en $NII_FILE."
-    exit 1
-fi
-
-
-
-# Paso 7: Ejecutar mri_sclimbic_seg para segmentar fornix y tubérculos mamilares
-echo "Ejecutando mri_sclimbic_seg para $SUBJECT_NAME..."
-mri_sclimbic_seg --s "$SUBJECT_NAME" --write_volumes --write_qa_stats
-if [ $? -ne 0 ]; then
-    echo "Error en mri_sclimbic_seg. Revisa $COMBINED_LOG para más detalles."
+# Paso 5 y 7: FastSurfer por fases (segmentación, superficies) y mri_sclimbic_seg para fornix y
+# tubérculos mamilares. El planificador corre sclimbic en paralelo con la fase de superficies y
+# reparte los núcleos/memoria disponibles (SLURM_CPUS_PER_TASK o afinidad de CPU), descontando lo
+# que reservaron otros planificadores del nodo (PRESUPUESTO_FASTSURFER).
+echo "Ejecutando FastSurfer por fases y mri_sclimbic_seg..."
+echo "Usando archivo NIfTI: $NII_FILE"
+T_INICIO=$(ahora)
+python3 "$SCRIPT_DIR/planificador_fastsurfer.py" --sd "$SUBJECTS_DIR" --sid "$SUBJECT_NAME" --t1 "$NII_FILE" \
+    --device cpu --resumen "$LOG_DIR/planificador.json"
+CODIGO=$?
+manifiesto paso fastsurfer "$CODIGO" "$T_INICIO" "$(ahora)" --detalle "$LOG_DIR/planificador.json"
+if [ $CODIGO -ne 0 ]; then
+    echo "Error en FastSurfer o mri_sclimbic_seg. Revisa los logs en $LOG_DIR para más detalles."
     exit 1
 fi
 
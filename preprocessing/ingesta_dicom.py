@@ -0,0 +1,632 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Ingesta del estudio DICOM: descubre las series y elige la T1 a convertir.
+
+Recorre el estudio una sola vez (opcionalmente reemplazando espacios en nombres de archivos y
+carpetas), lee sólo los encabezados de cada archivo (stop_before_pixels) en un pool de hilos,
+agrupa los archivos por SeriesInstanceUID y elige la serie T1 según los encabezados
+(descripción/protocolo, tipo de imagen, TR/TE/TI, adquisición 3D, cantidad de cortes).
+
+Si la entrada es un .zip, los encabezados se leen directamente de los miembros del archivo
+(sin descomprimir a disco) y sólo se extraen los archivos de la serie elegida.
+
+En la carpeta de la serie elegida (DICOM_DIR) se guarda el índice de encabezados del estudio
+(indice_dicom.json: datos del paciente y series), que leen dicom_utils, extract_patient_name y
+los reportes en lugar de volver a recorrer y abrir los DICOM.
+
+Para dcm2niix se arma un directorio con enlaces simbólicos a los archivos de la serie elegida
+(dcm2niix recibe directorios, no listas de archivos), y un .txt con la lista explícita.
+La conversión queda registrada en registro_nifti.json (SeriesInstanceUID + firma del conjunto de
+archivos): si se vuelve a correr sobre el mismo estudio no se reconvierte, y resolver_nifti_t1()
+devuelve el NIfTI de la T1 sin buscar '*.nii' en la carpeta.
+
+Uso desde fastsurfer_pipeline.sh (stdout = variables para eval, mensajes por stderr):
+    INGESTA=$(python3 ingesta_dicom.py "$ROOT_DIR" --sin_espacios --convertir) || exit 1
+    eval "$INGESTA"   # DICOM_DIR, SERIE_DIR, SERIE_UID, SERIE_DESCRIPCION, NII_FILE
+
+Ejemplos:
+    python ingesta_dicom.py /datos/estudio --listar
+    python ingesta_dicom.py /datos/estudio.zip --sin_espacios --preparar
+    python ingesta_dicom.py /datos/estudio --preparar --serie 1.2.840.113619...
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import shlex
+import shutil
+import hashlib
+import tempfile
+import subprocess
+import zipfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import pydicom
+from pydicom.errors import InvalidDicomError
+from pydicom.multival import MultiValue
+
+
+# Extensiones que seguro no son DICOM (se evita abrirlas)
+EXTENSIONES_NO_DICOM = {
+    ".nii", ".gz", ".mgz", ".json", ".txt", ".csv", ".xml", ".zip", ".pdf",
+    ".jpg", ".jpeg", ".png", ".bmp", ".html", ".htm", ".exe", ".dll", ".ini", ".inf", ".log",
+}
+
+# Carpetas que crea el pipeline dentro del estudio (no se recorren en re-ejecuciones)
+DIR_SERIE = "serie_t1"
+DIRECTORIOS_IGNORADOS = {DIR_SERIE, "FastSurfer", "logs_fastsurfer"}
+
+# Registro de conversiones dcm2niix (en DICOM_DIR)
+REGISTRO_NIFTI = "registro_nifti.json"
+
+# Índice de encabezados del estudio (en DICOM_DIR)
+INDICE_DICOM = "indice_dicom.json"
+VERSION_INDICE = 1
+
+# Datos del paciente/estudio que guarda el índice: atributo DICOM -> clave del encabezado leído
+CAMPOS_PACIENTE = {
+    "PatientName": "paciente",
+    "PatientID": "paciente_id",
+    "PatientAge": "edad",
+    "PatientSex": "sexo",
+    "StudyDate": "fecha_estudio",
+    "AccessionNumber": "accession",
+    "InstitutionName": "institucion",
+}
+
+# Atributos que se leen de cada archivo (el resto del encabezado no se parsea)
+ATRIBUTOS = [
+    "SOPClassUID", "Modality", "StudyInstanceUID", "SeriesInstanceUID", "SeriesNumber",
+    "SeriesDescription", "ProtocolName", "SequenceName", "ScanningSequence", "ImageType",
+    "MRAcquisitionType", "RepetitionTime", "EchoTime", "InversionTime", "SliceThickness",
+    "PixelSpacing", "Rows", "Columns", "NumberOfFrames", "InstanceNumber",
+] + list(CAMPOS_PACIENTE)
+
+# Descripción / protocolo que identifican una T1 volumétrica ...
+PATRON_T1 = re.compile(r"t1|mprage|mp-rage|mp_rage|spgr|bravo|tfl3d|tfe|vibe", re.IGNORECASE)
+# ... y los que la descartan (otras secuencias, localizadores, reformateos). Los términos cortos
+# se buscan como palabra suelta para no descartar p. ej. "t1_mpr_sag" o "spgr".
+PATRON_NO_T1 = re.compile(
+    r"flair|dwi|dti|diff|adc|perf|bold|fmri|angio|localizer|scout|survey|calibration|reformat|"
+    r"(?<![a-z0-9])(t2|pd|swi|tof|asl|loc|mip|sub)(?![a-z])",
+    re.IGNORECASE,
+)
+
+# SOP Class de Secondary Capture / reportes (nunca son la T1)
+SOP_NO_IMAGEN = ("1.2.840.10008.5.1.4.1.1.7", "1.2.840.10008.5.1.4.1.1.88")
+
+
+def _texto(valor):
+    if valor is None:
+        return ""
+    if isinstance(valor, (list, tuple, MultiValue)):
+        return "\\".join(str(v) for v in valor)
+    return str(valor).strip()
+
+
+def _numero(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+# ============================================================
+# Recorrido del estudio
+# ============================================================
+def _sin_espacios(nombre):
+    return nombre.replace(" ", "_")
+
+
+def recorrer_estudio(raiz, sin_espacios=False):
+    """
+    Lista los archivos candidatos del estudio en un único recorrido.
+    Con sin_espacios=True además renombra archivos y carpetas reemplazando ' ' por '_'
+    (lo que antes hacía el os.walk embebido en fastsurfer_pipeline.sh) y devuelve las rutas ya renombradas.
+    No entra en las carpetas que genera el propio pipeline (DIRECTORIOS_IGNORADOS).
+    """
+    archivos = []
+    for root, dirs, files in os.walk(os.path.abspath(raiz)):
+        if sin_espacios:
+            # Renombrar antes de descender: os.walk sigue por los nombres nuevos
+            for i, name in enumerate(dirs):
+                final = _sin_espacios(name)
+                if final != name:
+                    os.rename(os.path.join(root, name), os.path.join(root, final))
+                    dirs[i] = final
+        dirs[:] = [d for d in dirs if d not in DIRECTORIOS_IGNORADOS]
+
+        for name in files:
+            final = _sin_espacios(name) if sin_espacios else name
+            if final != name:
+                os.rename(os.path.join(root, name), os.path.join(root, final))
+            if final.upper() == "DICOMDIR" or os.path.splitext(final)[1].lower() in EXTENSIONES_NO_DICOM:
+                continue
+            archivos.append(os.path.join(root, final))
+    archivos.sort()
+    return archivos
+
+
+# ============================================================
+# Lectura de encabezados
+# ============================================================
+def leer_encabezado(ruta, fuente=None):
+    """
+    Lee sólo los atributos de ATRIBUTOS (sin datos de píxel). Devuelve un dict con los valores
+    ya convertidos a texto/número, o None si el archivo no es DICOM.
+    'fuente' permite leer de un objeto tipo archivo (p. ej. un miembro de un .zip); 'ruta' queda
+    como identificador del archivo.
+    """
+    try:
+        ds = pydicom.dcmread(fuente if fuente is not None else ruta,
+                             stop_before_pixels=True, specific_tags=ATRIBUTOS)
+    except (InvalidDicomError, OSError, ValueError, EOFError, zipfile.BadZipFile):
+        return None
+    if "SOPClassUID" not in ds and "SeriesInstanceUID" not in ds:
+        return None
+
+    return {
+        "ruta": ruta,
+        "sop_class": _texto(ds.get("SOPClassUID")),
+        "modalidad": _texto(ds.get("Modality")),
+        "study_uid": _texto(ds.get("StudyInstanceUID")),
+        "serie_uid": _texto(ds.get("SeriesInstanceUID")),
+        "serie_numero": _texto(ds.get("SeriesNumber")),
+        "descripcion": _texto(ds.get("SeriesDescription")),
+        "protocolo": _texto(ds.get("ProtocolName")),
+        "secuencia": _texto(ds.get("SequenceName")),
+        "scanning_sequence": _texto(ds.get("ScanningSequence")),
+        "image_type": _texto(ds.get("ImageType")).upper(),
+        "adquisicion": _texto(ds.get("MRAcquisitionType")).upper(),
+        "tr": _numero(ds.get("RepetitionTime")),
+        "te": _numero(ds.get("EchoTime")),
+        "ti": _numero(ds.get("InversionTime")),
+        "espesor": _numero(ds.get("SliceThickness")),
+        "pixel": _numero(ds.get("PixelSpacing", [None])[0]) if ds.get("PixelSpacing") else None,
+        "filas": _numero(ds.get("Rows")),
+        "columnas": _numero(ds.get("Columns")),
+        "frames": _numero(ds.get("NumberOfFrames")) or 1,
+        "instancia": _numero(ds.get("InstanceNumber")),
+        **{clave: _texto(ds.get(atributo)) for atributo, clave in CAMPOS_PACIENTE.items()},
+    }
+
+
+def agrupar_series(encabezados):
+    """Agrupa encabezados por SeriesInstanceUID. Cada serie conserva los atributos del primer archivo."""
+    series = {}
+    for enc in encabezados:
+        if enc is None:
+            continue
+        uid = enc["serie_uid"] or f"sin_uid:{os.path.dirname(enc['ruta'])}:{enc['serie_numero']}"
+        serie = series.get(uid)
+        if serie is None:
+            serie = {k: v for k, v in enc.items() if k not in ("ruta", "instancia")}
+            serie["serie_uid"] = uid
+            serie["archivos"] = []
+            serie["cortes"] = 0
+            series[uid] = serie
+        serie["archivos"].append(enc["ruta"])
+        serie["cortes"] += int(enc["frames"])
+    return series
+
+
+def escanear_estudio(raiz, workers=None, sin_espacios=False):
+    """
+    Recorre el estudio una vez y lee los encabezados en paralelo (la lectura es de E/S: hilos).
+    Devuelve {SeriesInstanceUID: serie}.
+    """
+    archivos = recorrer_estudio(raiz, sin_espacios=sin_espacios)
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        encabezados = list(pool.map(leer_encabezado, archivos, chunksize=64))
+    series = agrupar_series(encabezados)
+    print(f"Archivos revisados: {len(archivos)} | DICOM: {sum(e is not None for e in encabezados)} "
+          f"| series: {len(series)}", file=sys.stderr)
+    return series
+
+
+# ============================================================
+# Estudios comprimidos (.zip): lectura de encabezados sin extraer
+# ============================================================
+def _ruta_en_zip(nombre, sin_espacios=False):
+    """Ruta relativa segura de un miembro del zip (sin '/' inicial ni '..'), opcionalmente sin espacios."""
+    partes = [p for p in nombre.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    if sin_espacios:
+        partes = [_sin_espacios(p) for p in partes]
+    return os.path.join(*partes) if partes else ""
+
+
+def _miembros_candidatos(zf):
+    miembros = []
+    for info in zf.infolist():
+        if info.is_dir():
+            continue
+        partes = info.filename.replace("\\", "/").split("/")
+        nombre = partes[-1]
+        if nombre.upper() == "DICOMDIR" or os.path.splitext(nombre)[1].lower() in EXTENSIONES_NO_DICOM:
+            continue
+        if any(p in DIRECTORIOS_IGNORADOS for p in partes[:-1]):
+            continue
+        miembros.append(info.filename)
+    return sorted(miembros)
+
+
+def _encabezado_miembro(zf, nombre):
+    with zf.open(nombre) as f:
+        # pydicom puede retroceder en el flujo: ZipExtFile lo admite (sólo descomprime el inicio)
+        return leer_encabezado(nombre, fuente=f)
+
+
+def escanear_zip(ruta_zip, workers=None):
+    """
+    Como escanear_estudio pero leyendo los encabezados directamente de los miembros del .zip
+    (sólo se descomprime el comienzo de cada archivo). Las rutas de la serie son nombres de miembros.
+    """
+    with zipfile.ZipFile(ruta_zip) as zf:
+        miembros = _miembros_candidatos(zf)
+        workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            encabezados = list(pool.map(lambda m: _encabezado_miembro(zf, m), miembros, chunksize=64))
+    series = agrupar_series(encabezados)
+    print(f"Miembros revisados en {os.path.basename(ruta_zip)}: {len(miembros)} | "
+          f"DICOM: {sum(e is not None for e in encabezados)} | series: {len(series)}", file=sys.stderr)
+    return series
+
+
+def extraer_serie(ruta_zip, serie, destino, sin_espacios=False):
+    """
+    Extrae del .zip sólo los archivos de la serie, bajo 'destino' y conservando la estructura de
+    carpetas del archivo. Si un archivo ya existe con el mismo tamaño no se vuelve a escribir.
+    Actualiza serie['archivos'] con las rutas extraídas y la devuelve.
+    """
+    extraidos = []
+    escritos = 0
+    with zipfile.ZipFile(ruta_zip) as zf:
+        for nombre in serie["archivos"]:
+            info = zf.getinfo(nombre)
+            salida = os.path.join(os.path.abspath(destino), _ruta_en_zip(nombre, sin_espacios))
+            if not (os.path.isfile(salida) and os.path.getsize(salida) == info.file_size):
+                os.makedirs(os.path.dirname(salida), exist_ok=True)
+                with zf.open(info) as origen, open(salida, "wb") as f:
+                    shutil.copyfileobj(origen, f, 1 << 20)
+                escritos += 1
+            extraidos.append(salida)
+    print(f"Extraídos {escritos} de {len(extraidos)} archivos de la serie en {destino}", file=sys.stderr)
+    serie["archivos"] = extraidos
+    return serie
+
+
+# ============================================================
+# Selección de la serie T1
+# ============================================================
+def puntaje_t1(serie):
+    """
+    Puntaje heurístico de que la serie sea una T1 volumétrica apta para FastSurfer.
+    Negativo = descartada (no MR, localizador, derivada, otra secuencia, pocos cortes).
+    """
+    if serie["modalidad"] and serie["modalidad"] != "MR":
+        return -100.0
+    if serie["sop_class"].startswith(SOP_NO_IMAGEN):
+        return -100.0
+    if any(t in serie["image_type"] for t in ("LOCALIZER", "SCOUT")):
+        return -50.0
+    if serie["cortes"] < 60:
+        return -20.0
+
+    texto = " ".join([serie["descripcion"], serie["protocolo"], serie["secuencia"]])
+    puntaje = 0.0
+    if PATRON_T1.search(texto):
+        puntaje += 10
+    if PATRON_NO_T1.search(texto):
+        puntaje -= 15
+    if "DERIVED" in serie["image_type"] or "SECONDARY" in serie["image_type"]:
+        puntaje -= 8
+    if serie["adquisicion"] == "3D":
+        puntaje += 4
+
+    # Contraste T1: TR y TE cortos (gradiente ~5-30 ms, MPRAGE ~1500-2500 ms con TI)
+    tr, te, ti = serie["tr"], serie["te"], serie["ti"]
+    if tr is not None and te is not None:
+        if te <= 10 and tr <= 2600:
+            puntaje += 5
+        elif te > 30 or tr > 4000:
+            puntaje -= 10
+    if ti is not None and 600 <= ti <= 1300:
+        puntaje += 3
+    if "IR" in serie["scanning_sequence"] and (ti is None or ti > 1500):
+        puntaje -= 5  # FLAIR / STIR
+
+    # Resolución: preferir cortes finos y voxel ~1 mm
+    if serie["espesor"] is not None and serie["espesor"] <= 1.5:
+        puntaje += 3
+    if serie["pixel"] is not None and serie["pixel"] <= 1.2:
+        puntaje += 1
+    puntaje += min(serie["cortes"], 400) / 100.0
+    return puntaje
+
+
+def seleccionar_t1(series, uid=None):
+    """
+    Devuelve la serie T1 (la de mayor puntaje, o la indicada por 'uid').
+    Si ninguna tiene puntaje positivo se usa la serie MR con más cortes, avisando.
+    """
+    if not series:
+        raise FileNotFoundError("No se encontraron archivos DICOM en el estudio.")
+    if uid:
+        if uid not in series:
+            raise KeyError(f"La serie {uid} no está en el estudio.")
+        return series[uid]
+
+    puntajes = sorted(((puntaje_t1(s), s["cortes"], u) for u, s in series.items()), reverse=True)
+    mejor, _, uid = puntajes[0]
+    if mejor <= 0:
+        mr = [s for s in series.values() if s["modalidad"] in ("MR", "")]
+        if not mr:
+            raise FileNotFoundError("El estudio no contiene series de RM.")
+        elegida = max(mr, key=lambda s: s["cortes"])
+        print(f"Advertencia: ninguna serie parece T1 por sus encabezados; se usa la de más cortes "
+              f"({elegida['descripcion'] or elegida['serie_uid']}).", file=sys.stderr)
+        return elegida
+    return series[uid]
+
+
+def preparar_serie(serie, destino):
+    """
+    Arma 'destino' con enlaces simbólicos a los archivos de la serie (entrada de dcm2niix) y
+    escribe 'destino'.txt con la lista explícita de archivos. Devuelve el directorio.
+    """
+    destino = os.path.abspath(destino)
+    if os.path.isdir(destino):
+        for nombre in os.listdir(destino):
+            os.unlink(os.path.join(destino, nombre))
+    os.makedirs(destino, exist_ok=True)
+    for i, ruta in enumerate(serie["archivos"]):
+        os.symlink(os.path.abspath(ruta), os.path.join(destino, f"{i:05d}_{os.path.basename(ruta)}"))
+    with open(destino + ".txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(os.path.abspath(r) for r in serie["archivos"]) + "\n")
+    return destino
+
+
+def directorio_serie(serie):
+    """Carpeta común a los archivos de la serie (será el DICOM_DIR / SUBJECTS_DIR del estudio)."""
+    return os.path.commonpath([os.path.dirname(os.path.abspath(r)) for r in serie["archivos"]])
+
+
+# ============================================================
+# Índice de encabezados (indice_dicom.json)
+# ============================================================
+def guardar_indice(series, serie_t1, dicom_dir, origen):
+    """
+    Escribe <dicom_dir>/indice_dicom.json con los datos del paciente (atributos DICOM de la serie T1,
+    sin los vacíos) y el resumen de cada serie. Las rutas de archivos en disco se guardan relativas
+    a dicom_dir; las de series que quedaron dentro de un .zip, como nombre de miembro.
+    Devuelve el índice (también si no se pudo escribir).
+    """
+    dicom_dir = os.path.abspath(dicom_dir)
+    resumen = {}
+    for uid, serie in series.items():
+        en_zip = not all(os.path.isabs(r) for r in serie["archivos"])
+        resumen[uid] = {
+            "numero": serie["serie_numero"],
+            "descripcion": serie["descripcion"],
+            "protocolo": serie["protocolo"],
+            "modalidad": serie["modalidad"],
+            "image_type": serie["image_type"],
+            "adquisicion": serie["adquisicion"],
+            "tr": serie["tr"], "te": serie["te"], "ti": serie["ti"],
+            "cortes": serie["cortes"],
+            "puntaje_t1": round(puntaje_t1(serie), 2),
+            "en_zip": en_zip,
+            "archivos": serie["archivos"] if en_zip else [os.path.relpath(r, dicom_dir) for r in serie["archivos"]],
+        }
+
+    indice = {
+        "version": VERSION_INDICE,
+        "origen": os.path.abspath(origen),
+        "serie_t1": serie_t1["serie_uid"],
+        "paciente": {a: serie_t1[c] for a, c in CAMPOS_PACIENTE.items() if serie_t1.get(c)},
+        "series": resumen,
+    }
+
+    ruta = os.path.join(dicom_dir, INDICE_DICOM)
+    try:
+        temporal = ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(indice, f, ensure_ascii=False, indent=1)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        print(f"Advertencia: no se pudo guardar {ruta} ({e}).", file=sys.stderr)
+    return indice
+
+
+def indexar_estudio(dicom_dir, workers=None):
+    """Construye (y guarda) el índice de un estudio ya en disco, sin renombrar nada."""
+    series = escanear_estudio(dicom_dir, workers=workers)
+    return guardar_indice(series, seleccionar_t1(series), dicom_dir, origen=dicom_dir)
+
+
+# ============================================================
+# Conversión a NIfTI con registro (dcm2niix sólo si hace falta)
+# ============================================================
+def firma_archivos(archivos):
+    """Firma del conjunto de archivos de la serie: nombres (relativos a su carpeta común) y tamaños."""
+    base = os.path.commonpath([os.path.dirname(os.path.abspath(r)) for r in archivos])
+    h = hashlib.sha256()
+    for ruta in sorted(os.path.abspath(r) for r in archivos):
+        h.update(f"{os.path.relpath(ruta, base)}\0{os.path.getsize(ruta)}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def leer_registro(dicom_dir):
+    """Registro de conversiones de dicom_dir: {'t1': uid, 'series': {uid: {firma, nifti, json}}}."""
+    ruta = os.path.join(dicom_dir, REGISTRO_NIFTI)
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            registro = json.load(f)
+        if isinstance(registro.get("series"), dict):
+            return registro
+    except (OSError, ValueError):
+        pass
+    return {"t1": None, "series": {}}
+
+
+def _guardar_registro(dicom_dir, registro):
+    ruta = os.path.join(dicom_dir, REGISTRO_NIFTI)
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(registro, f, ensure_ascii=False, indent=1)
+    os.replace(temporal, ruta)
+
+
+def nifti_registrado(dicom_dir, uid=None, firma=None):
+    """
+    Ruta del NIfTI registrado para la serie 'uid' (por defecto la T1), o None si no hay conversión
+    válida: sin entrada, archivo inexistente/vacío o firma distinta a la indicada.
+    """
+    registro = leer_registro(dicom_dir)
+    uid = uid or registro.get("t1")
+    entrada = registro["series"].get(uid) if uid else None
+    if not entrada:
+        return None
+    if firma is not None and entrada.get("firma") != firma:
+        return None
+    ruta = os.path.join(dicom_dir, entrada["nifti"])
+    return ruta if os.path.isfile(ruta) and os.path.getsize(ruta) > 0 else None
+
+
+def convertir_serie(serie, dicom_dir, serie_dir, forzar=False):
+    """
+    Convierte la serie con dcm2niix (-z n -f "%d") salvo que el registro ya tenga un NIfTI válido
+    para la misma SeriesInstanceUID y firma de archivos. Deja el .nii (y su .json) en dicom_dir,
+    marca la serie como T1 del estudio en el registro y devuelve la ruta del .nii.
+    """
+    uid = serie["serie_uid"]
+    firma = firma_archivos(serie["archivos"])
+    existente = None if forzar else nifti_registrado(dicom_dir, uid, firma)
+    registro = leer_registro(dicom_dir)
+
+    if existente:
+        print(f"NIfTI ya convertido para la serie (se reutiliza): {existente}", file=sys.stderr)
+        if registro.get("t1") != uid:
+            registro["t1"] = uid
+            _guardar_registro(dicom_dir, registro)
+        return existente
+
+    # Salida a una carpeta temporal para saber exactamente qué generó esta conversión
+    temporal = tempfile.mkdtemp(prefix=".dcm2niix_", dir=dicom_dir)
+    try:
+        resultado = subprocess.run(["dcm2niix", "-z", "n", "-f", "%d", "-o", temporal, serie_dir],
+                                   stdout=sys.stderr, stderr=sys.stderr)
+        generados = glob.glob(os.path.join(temporal, "*.nii"))
+        if resultado.returncode != 0 or not generados:
+            raise RuntimeError(f"dcm2niix falló (código {resultado.returncode}) o no generó un .nii.")
+        # Si la serie produjo varios volúmenes (p. ej. ecos), se usa el más grande
+        nii = max(generados, key=os.path.getsize)
+        base = os.path.splitext(os.path.basename(nii))[0]
+        destino = os.path.join(dicom_dir, base + ".nii")
+        os.replace(nii, destino)
+        sidecar = os.path.join(temporal, base + ".json")
+        if os.path.isfile(sidecar):
+            os.replace(sidecar, os.path.join(dicom_dir, base + ".json"))
+            sidecar = base + ".json"
+        else:
+            sidecar = None
+    finally:
+        shutil.rmtree(temporal, ignore_errors=True)
+
+    registro["t1"] = uid
+    registro["series"][uid] = {"firma": firma, "nifti": base + ".nii", "json": sidecar}
+    _guardar_registro(dicom_dir, registro)
+    return destino
+
+
+def resolver_nifti_t1(dicom_dir):
+    """
+    El NIfTI de la T1 del estudio: el registrado por la conversión. Para estudios convertidos antes
+    del registro se usa el único '*.nii' de la carpeta (o el más grande, avisando si hay varios).
+    """
+    registrado = nifti_registrado(dicom_dir)
+    if registrado:
+        return registrado
+    candidatos = sorted(glob.glob(os.path.join(dicom_dir, "*.nii")))
+    if not candidatos:
+        raise FileNotFoundError(f"No se encontró el NIfTI de la T1 en {dicom_dir}.")
+    if len(candidatos) > 1:
+        print(f"Advertencia: {len(candidatos)} archivos .nii sin registro en {dicom_dir}; se usa el más grande.",
+              file=sys.stderr)
+    return max(candidatos, key=os.path.getsize)
+
+
+def _listar(series):
+    for uid, s in sorted(series.items(), key=lambda kv: -puntaje_t1(kv[1])):
+        print(f"{puntaje_t1(s):7.1f}  {s['cortes']:5d}  {s['serie_numero']:>4}  "
+              f"{s['descripcion'] or s['protocolo'] or '-':40.40}  TR={s['tr']} TE={s['te']} TI={s['ti']}  {uid}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Descubre las series DICOM de un estudio y elige la T1.")
+    parser.add_argument("raiz", help="Directorio del estudio o archivo .zip.")
+    parser.add_argument("--destino", default=None,
+                        help="Con un .zip: carpeta donde extraer la serie elegida (por defecto, la del .zip).")
+    parser.add_argument("--sin_espacios", action="store_true",
+                        help="Reemplazar espacios por '_' en nombres de archivos y carpetas.")
+    parser.add_argument("--serie", default=None, help="Forzar la SeriesInstanceUID a convertir.")
+    parser.add_argument("--workers", type=int, default=None, help="Hilos de lectura de encabezados.")
+    parser.add_argument("--listar", action="store_true", help="Sólo listar las series con su puntaje T1.")
+    parser.add_argument("--preparar", action="store_true",
+                        help="Crear <DICOM_DIR>/serie_t1 con enlaces a la serie elegida (entrada de dcm2niix).")
+    parser.add_argument("--convertir", action="store_true",
+                        help="Además convertir la serie con dcm2niix (se saltea si ya hay una conversión registrada).")
+    parser.add_argument("--forzar", action="store_true", help="Reconvertir aunque exista una conversión registrada.")
+    args = parser.parse_args()
+
+    es_zip = os.path.isfile(args.raiz) and zipfile.is_zipfile(args.raiz)
+    if not es_zip and not os.path.isdir(args.raiz):
+        print(f"Error: {args.raiz} no es un directorio ni un archivo .zip.", file=sys.stderr)
+        sys.exit(1)
+
+    if es_zip:
+        series = escanear_zip(args.raiz, workers=args.workers)
+    else:
+        series = escanear_estudio(args.raiz, workers=args.workers, sin_espacios=args.sin_espacios)
+    if args.listar:
+        _listar(series)
+        return
+
+    try:
+        serie = seleccionar_t1(series, uid=args.serie)
+    except (FileNotFoundError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if es_zip:
+        destino = args.destino or os.path.dirname(os.path.abspath(args.raiz))
+        extraer_serie(args.raiz, serie, destino, sin_espacios=args.sin_espacios)
+
+    dicom_dir = directorio_serie(serie)
+    preparar = args.preparar or args.convertir
+    serie_dir = preparar_serie(serie, os.path.join(dicom_dir, DIR_SERIE)) if preparar else ""
+    guardar_indice(series, serie, dicom_dir, origen=args.raiz)
+    print(f"Serie T1: {serie['descripcion'] or '-'} ({serie['cortes']} cortes, {serie['serie_uid']})", file=sys.stderr)
+
+    nii_file = ""
+    if args.convertir:
+        try:
+            nii_file = convertir_serie(serie, dicom_dir, serie_dir, forzar=args.forzar)
+        except (OSError, RuntimeError) as e:
+            print(f"Error al convertir DICOM a NIfTI: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    # Variables para 'eval' en bash
+    for nombre, valor in (("DICOM_DIR", dicom_dir), ("SERIE_DIR", serie_dir), ("SERIE_UID", serie["serie_uid"]),
+                          ("SERIE_DESCRIPCION", serie["descripcion"]), ("NII_FILE", nii_file)):
+        print(f"{nombre}={shlex.quote(valor)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Manifiesto del preprocesamiento: lo que fastsurfer_pipeline.sh entrega a main_local.py.
+
+En lugar de buscar rutas en la salida de texto del script, cada paso registra en un JSON la
+carpeta DICOM, el NIfTI, el SUBJECTS_DIR, los tiempos y el código de salida:
+
+    {"version": 1, "entrada": ..., "estado": "en_curso" | "completado" | "fallido", "codigo": 0,
+     "inicio": ..., "fin": ..., "dicom_dir": ..., "nifti": ..., "serie_uid": ...,
+     "subjects_dir": ".../FastSurfer",
+     "pasos": [{"nombre": "ingesta", "codigo": 0, "inicio": ..., "fin": ..., "segundos": ...}, ...]}
+
+La ruta se elige antes de correr el script (variable MANIFIESTO_PREPROCESO); al terminar se
+deja además una copia en <dicom_dir>/logs_fastsurfer/manifiesto_preproceso.json.
+
+Desde el script (ver fastsurfer_pipeline.sh):
+    python manifiesto.py "$MANIFIESTO" iniciar --entrada "$INPUT"
+    python manifiesto.py "$MANIFIESTO" campos dicom_dir="$DICOM_DIR" nifti="$NII_FILE"
+    python manifiesto.py "$MANIFIESTO" paso ingesta 0 "$T0" "$T1"
+    python manifiesto.py "$MANIFIESTO" cerrar 0
+
+Desde Python:
+    manifiesto = ejecutar_preproceso("/ruta/estudio.zip")                       # bloqueante
+    futuro = preproceso_en_segundo_plano("/ruta/estudio.zip", al_evento=print)  # asíncrono
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+MANIFIESTO = "manifiesto_preproceso.json"
+VERSION_MANIFIESTO = 1
+VARIABLE_MANIFIESTO = "MANIFIESTO_PREPROCESO"
+SCRIPT_PIPELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fastsurfer_pipeline.sh")
+
+
+# ============================================================
+# Lectura / escritura
+# ============================================================
+def leer_manifiesto(ruta):
+    """Manifiesto como dict, o None si todavía no existe o está a medio escribir."""
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _guardar(ruta, manifiesto):
+    # Escritura atómica: quien lo lee en paralelo nunca ve un JSON a medias
+    os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+    tmp = f"{ruta}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, ruta)
+
+
+def iniciar(ruta, entrada):
+    manifiesto = {
+        "version": VERSION_MANIFIESTO,
+        "entrada": os.path.abspath(entrada) if entrada else None,
+        "estado": "en_curso",
+        "codigo": None,
+        "inicio": time.time(),
+        "fin": None,
+        "pasos": [],
+    }
+    _guardar(ruta, manifiesto)
+    return manifiesto
+
+
+def actualizar_campos(ruta, **campos):
+    manifiesto = leer_manifiesto(ruta) or iniciar(ruta, None)
+    manifiesto.update(campos)
+    _guardar(ruta, manifiesto)
+    return manifiesto
+
+
+def registrar_paso(ruta, nombre, codigo, inicio, fin, detalle=None):
+    """Agrega un paso con su código y tiempos; 'detalle' es un JSON con información del paso (p. ej. el resumen del planificador)."""
+    manifiesto = leer_manifiesto(ruta) or iniciar(ruta, None)
+    paso = {"nombre": nombre, "codigo": int(codigo), "inicio": float(inicio), "fin": float(fin),
+            "segundos": round(float(fin) - float(inicio), 1)}
+    if detalle and os.path.isfile(detalle):
+        paso["detalle"] = leer_manifiesto(detalle)
+    manifiesto["pasos"].append(paso)
+    _guardar(ruta, manifiesto)
+    return manifiesto
+
+
+def cerrar(ruta, codigo, copia_en=None):
+    """Marca el fin del preprocesamiento; con 'copia_en' deja una copia del manifiesto en esa carpeta."""
+    manifiesto = leer_manifiesto(ruta) or iniciar(ruta, None)
+    codigo = int(codigo)
+    manifiesto.update(codigo=codigo, fin=time.time(), estado="completado" if codigo == 0 else "fallido")
+    _guardar(ruta, manifiesto)
+    if copia_en and os.path.isdir(copia_en):
+        copia = os.path.join(copia_en, MANIFIESTO)
+        if os.path.abspath(copia) != os.path.abspath(ruta):
+            _guardar(copia, manifiesto)
+    return manifiesto
+
+
+# ============================================================
+# Ejecución desde Python
+# ============================================================
+def _eventos_nuevos(anterior, actual):
+    """Eventos (dicts con 'tipo') entre dos lecturas del manifiesto."""
+    eventos = []
+    if actual is None:
+        return eventos
+    if anterior is None:
+        eventos.append({"tipo": "inicio", "entrada": actual.get("entrada"), "tiempo": actual.get("inicio")})
+        anterior = {"pasos": []}
+    for paso in actual.get("pasos", [])[len(anterior.get("pasos", [])):]:
+        eventos.append(dict(paso, tipo="paso"))
+    for campo in ("dicom_dir", "nifti", "subjects_dir"):
+        if actual.get(campo) and actual.get(campo) != anterior.get(campo):
+            eventos.append({"tipo": "campo", "campo": campo, "valor": actual[campo]})
+    if actual.get("estado") != "en_curso" and anterior.get("estado") != actual.get("estado"):
+        eventos.append({"tipo": "fin", "estado": actual["estado"], "codigo": actual.get("codigo"),
+                        "tiempo": actual.get("fin")})
+    return eventos
+
+
+def ejecutar_preproceso(entrada, ruta_manifiesto=None, al_evento=None, intervalo=2.0, log=None):
+    """
+    Corre fastsurfer_pipeline.sh sobre 'entrada' y devuelve su manifiesto. El entorno de
+    FreeSurfer/conda lo arma el script, por eso corre en un proceso bash aparte; la salida va
+    directo a la consola (o a 'log', un archivo abierto) sin pasar por Python.
+
+    'al_evento' recibe cada evento (inicio, paso, campo, fin) a medida que el script los registra.
+    Si el script termina sin cerrar el manifiesto, se cierra con su código de salida.
+    """
+    temporal = ruta_manifiesto is None
+    if temporal:
+        fd, ruta_manifiesto = tempfile.mkstemp(prefix="manifiesto_", suffix=".json")
+        os.close(fd)
+        os.remove(ruta_manifiesto)
+    entorno = dict(os.environ, **{VARIABLE_MANIFIESTO: os.path.abspath(ruta_manifiesto)})
+    proceso = subprocess.Popen(["bash", SCRIPT_PIPELINE, entrada], env=entorno,
+                               stdout=log, stderr=subprocess.STDOUT if log else None)
+
+    anterior = None
+    while True:
+        terminado = proceso.poll() is not None
+        actual = leer_manifiesto(ruta_manifiesto)
+        if al_evento:
+            for evento in _eventos_nuevos(anterior, actual):
+                al_evento(evento)
+        anterior = actual or anterior
+        if terminado:
+            break
+        time.sleep(intervalo)
+
+    manifiesto = leer_manifiesto(ruta_manifiesto)
+    if manifiesto is None or manifiesto.get("estado") == "en_curso":
+        # Sin manifiesto no hay rutas que entregar: se considera fallido aunque el código sea 0
+        codigo = proceso.returncode if manifiesto is not None else (proceso.returncode or 1)
+        manifiesto = cerrar(ruta_manifiesto, codigo)
+        if al_evento:
+            for evento in _eventos_nuevos(anterior, manifiesto):
+                al_evento(evento)
+    if temporal:
+        os.remove(ruta_manifiesto)
+    return manifiesto
+
+
+def preproceso_en_segundo_plano(entrada, ruta_manifiesto=None, al_evento=None, log=None):
+    """Igual que ejecutar_preproceso pero sin bloquear: devuelve un Future con el manifiesto."""
+    ejecutor = ThreadPoolExecutor(max_workers=1)
+    futuro = ejecutor.submit(ejecutar_preproceso, entrada, ruta_manifiesto, al_evento, 2.0, log)
+    ejecutor.shutdown(wait=False)
+    return futuro
+
+
+# ============================================================
+# CLI (usado por fastsurfer_pipeline.sh)
+# ============================================================
+def main():
+    parser = argparse.ArgumentParser(description="Registra pasos del preprocesamiento en el manifiesto JSON.")
+    parser.add_argument("ruta", help="Ruta del manifiesto.")
+    sub = parser.add_subparsers(dest="accion", required=True)
+
+    p = sub.add_parser("iniciar")
+    p.add_argument("--entrada", default=None)
+
+    p = sub.add_parser("campos")
+    p.add_argument("valores", nargs="+", help="clave=valor")
+
+    p = sub.add_parser("paso")
+    p.add_argument("nombre")
+    p.add_argument("codigo", type=int)
+    p.add_argument("inicio", type=float)
+    p.add_argument("fin", type=float)
+    p.add_argument("--detalle", default=None, help="JSON con el detalle del paso.")
+
+    p = sub.add_parser("cerrar")
+    p.add_argument("codigo", type=int)
+    p.add_argument("--copia_en", default=None, help="Carpeta donde dejar una copia del manifiesto.")
+
+    args = parser.parse_args()
+    if args.accion == "iniciar":
+        iniciar(args.ruta, args.entrada)
+    elif args.accion == "campos":
+        campos = dict(v.split("=", 1) for v in args.valores if "=" in v)
+        actualizar_campos(args.ruta, **{k: (v or None) for k, v in campos.items()})
+    elif args.accion == "paso":
+        registrar_paso(args.ruta, args.nombre, args.codigo, args.inicio, args.fin, args.detalle)
+    elif args.accion == "cerrar":
+        cerrar(args.ruta, args.codigo, args.copia_en)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except OSError as e:
+        # El manifiesto nunca debe cortar el pipeline
+        print(f"[manifiesto] No se pudo escribir: {e}", file=sys.stderr)
@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Planificador de FastSurfer por fases, según núcleos, memoria y GPU disponibles.
+
+Cada sujeto se divide en trabajos separados:
+  1. seg      run_fastsurfer.sh --seg_only   (red neuronal; usa la GPU si --device cuda)
+  2. surf     run_fastsurfer.sh --surf_only  (recon-surf; largo y mayormente de 1-2 hilos)
+  3. sclimbic mri_sclimbic_seg               (en paralelo con surf, cuando nu.mgz ya es definitivo)
+
+El planificador lanza cada trabajo en cuanto terminaron sus dependencias y entra en los recursos
+libres, así en un nodo con varios sujetos se superponen las fases de superficie de unos con la
+segmentación de otros, y sclimbic no espera a que termine recon-surf.
+
+Con un solo sujeto, seg y surf toman los núcleos libres al arrancar (seg corre sola; surf deja
+lugar a sclimbic), en lugar de los valores fijos de RECURSOS_FASE.
+
+Los recursos en uso se reservan en un archivo compartido por todos los planificadores del nodo
+(PRESUPUESTO_FASTSURFER, por defecto /tmp/planificador_fastsurfer.json, con bloqueo fcntl), así
+varias invocaciones a la vez (p. ej. la cola de estudios con --fastsurfer 2) no creen tener el
+nodo entero cada una.
+
+Un sujeto (lo que usa fastsurfer_pipeline.sh):
+    python planificador_fastsurfer.py --sd "$SUBJECTS_DIR" --sid FastSurfer --t1 "$NII_FILE"
+Varios sujetos en un nodo (una línea por sujeto: "<subjects_dir> <t1.nii> [sid]"):
+    python planificador_fastsurfer.py --lista sujetos.txt --nucleos 32 --memoria 120 --gpus 1 --device cuda
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import argparse
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+from eventos import bus_desde_entorno
+
+
+# Recursos por fase (núcleos, memoria en GB, GPUs). Valores conservadores para CPU;
+# con --device cuda la segmentación ocupa una GPU y menos memoria de sistema.
+RECURSOS_FASE = {
+    "seg": {"nucleos": 4, "memoria_gb": 10.0, "gpus": 0},
+    "seg_gpu": {"nucleos": 2, "memoria_gb": 6.0, "gpus": 1},
+    "surf": {"nucleos": 2, "memoria_gb": 4.0, "gpus": 0},
+    "sclimbic": {"nucleos": 1, "memoria_gb": 4.0, "gpus": 0},
+}
+
+# Archivos del sujeto que tienen que existir para lanzar sclimbic (--s lee mri/nu.mgz). recon-surf
+# escribe nu.mgz, registra a talairach (largo) y después lo reescribe en el lugar con
+# mri_add_xform_to_header; recién entonces genera T1.mgz a partir de nu.mgz. Por eso no alcanza
+# con que nu.mgz exista o esté quieto un rato: se espera a T1.mgz, que marca que nu.mgz ya es el
+# definitivo. Todos deben además no cambiar durante ESPERA_ESTABLE s (T1.mgz recién escrito).
+REQUISITOS_SCLIMBIC = [os.path.join("mri", "transforms", "talairach.xfm"),
+                       os.path.join("mri", "nu.mgz"),
+                       os.path.join("mri", "T1.mgz")]
+ESPERA_ESTABLE = 10.0
+
+# Reservas de recursos compartidas entre planificadores del mismo nodo
+VARIABLE_PRESUPUESTO = "PRESUPUESTO_FASTSURFER"
+PRESUPUESTO_POR_DEFECTO = os.path.join(tempfile.gettempdir(), "planificador_fastsurfer.json")
+RECURSOS = ("nucleos", "memoria_gb", "gpus")
+
+
+def _log(mensaje):
+    print(f"[planificador {time.strftime('%H:%M:%S')}] {mensaje}", flush=True)
+
+
+# ============================================================
+# Recursos del nodo
+# ============================================================
+def nucleos_disponibles():
+    """Núcleos asignados al proceso (SLURM_CPUS_PER_TASK, afinidad de CPU o cpu_count)."""
+    try:
+        return max(1, int(os.environ["SLURM_CPUS_PER_TASK"]))
+    except (KeyError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def memoria_disponible_gb():
+    """MemAvailable de /proc/meminfo en GB (o 8 GB si no se puede leer)."""
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for linea in f:
+                if linea.startswith("MemAvailable:"):
+                    return int(linea.split()[1]) / (1024 ** 2)
+    except OSError:
+        pass
+    return 8.0
+
+
+# ============================================================
+# Trabajos de un sujeto
+# ============================================================
+def trabajos_sujeto(subjects_dir, t1, sid="FastSurfer", device="cpu", hilos_seg=None, hilos_surf=None,
+                    fastsurfer_home=None, licencia=None, vox_size="1.0", escalar=False):
+    """
+    Trabajos (seg, surf, sclimbic) de un sujeto como dicts:
+      nombre, comando, entorno, nucleos, memoria_gb, gpus, depende (nombres), requiere (archivos), log,
+      escalable (con escalar=True, seg y surf sin hilos indicados toman los núcleos libres al arrancar).
+    """
+    fastsurfer_home = fastsurfer_home or os.environ.get("FASTSURFER_HOME", "/home/usuario/FastSurfer")
+    licencia = licencia or os.path.join(os.environ.get("FREESURFER_HOME", ""), "license.txt")
+    run_fastsurfer = os.path.join(fastsurfer_home, "run_fastsurfer.sh")
+    subjects_dir = os.path.abspath(subjects_dir)
+    log_dir = os.path.join(subjects_dir, "logs_fastsurfer")
+    entorno = {"SUBJECTS_DIR": subjects_dir}
+    prefijo = f"{os.path.basename(subjects_dir)}/{sid}"
+
+    rec_seg = dict(RECURSOS_FASE["seg_gpu" if device.startswith("cuda") else "seg"])
+    rec_surf = dict(RECURSOS_FASE["surf"])
+    if hilos_seg:
+        rec_seg["nucleos"] = hilos_seg
+    if hilos_surf:
+        rec_surf["nucleos"] = hilos_surf
+    comunes = ["--sid", sid, "--sd", subjects_dir, "--fs_license", licencia, "--allow_root"]
+
+    return [
+        dict(nombre=f"{prefijo}:seg", entorno=entorno, depende=[], requiere=[], escalable=escalar and not hilos_seg,
+             log=os.path.join(log_dir, f"{sid}_seg.log"),
+             comando=[run_fastsurfer, "--seg_only", "--t1", os.path.abspath(t1), "--device", device,
+                      "--vox_size", str(vox_size), "--threads", str(rec_seg["nucleos"])] + comunes,
+             **rec_seg),
+        dict(nombre=f"{prefijo}:surf", entorno=entorno, depende=[f"{prefijo}:seg"], requiere=[],
+             escalable=escalar and not hilos_surf,
+             log=os.path.join(log_dir, f"{sid}_surf.log"),
+             comando=[run_fastsurfer, "--surf_only", "--threads", str(rec_surf["nucleos"])] + comunes
+                     + (["--parallel"] if rec_surf["nucleos"] > 1 else []),
+             **rec_surf),
+        dict(nombre=f"{prefijo}:sclimbic", entorno=entorno, depende=[f"{prefijo}:seg"], escalable=False,
+             requiere=[os.path.join(subjects_dir, sid, r) for r in REQUISITOS_SCLIMBIC],
+             log=os.path.join(log_dir, f"{sid}_sclimbic.log"),
+             comando=["mri_sclimbic_seg", "--s", sid, "--write_volumes", "--write_qa_stats"],
+             **RECURSOS_FASE["sclimbic"]),
+    ]
+
+
+# ============================================================
+# Reservas compartidas
+# ============================================================
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def reservas(ruta, locales):
+    """
+    Reservas en uso {clave: {"pid", "nucleos", "memoria_gb", "gpus"}} con el archivo bloqueado.
+    Los cambios se guardan al salir. Se descartan las de procesos que ya no existen (un planificador
+    cortado sin liberar). Sin 'ruta' se usa el dict 'locales' (sólo este proceso).
+    """
+    if not ruta:
+        yield locales
+        return
+    with open(f"{ruta}.lock", "a") as candado:
+        fcntl.flock(candado, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(ruta, "r", encoding="utf-8") as f:
+                    actuales = json.load(f)
+            except (OSError, ValueError):
+                actuales = {}
+            actuales = {k: v for k, v in actuales.items() if _vivo(v["pid"])}
+            yield actuales
+            tmp = f"{ruta}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(actuales, f, indent=1)
+            os.replace(tmp, ruta)
+        finally:
+            fcntl.flock(candado, fcntl.LOCK_UN)
+
+
+def _libres(total, en_uso):
+    return {r: total[r] - sum(v[r] for v in en_uso.values()) for r in RECURSOS}
+
+
+# ============================================================
+# Planificador
+# ============================================================
+def _entra(trabajo, libres):
+    return all(trabajo[r] <= libres[r] for r in RECURSOS)
+
+
+def _con_hilos(comando, hilos):
+    """El comando de run_fastsurfer.sh con otro --threads (y --parallel en surf si hay más de 1)."""
+    comando = list(comando)
+    comando[comando.index("--threads") + 1] = str(hilos)
+    if "--surf_only" in comando and hilos > 1 and "--parallel" not in comando:
+        comando.append("--parallel")
+    return comando
+
+
+def _estable(ruta, vistos, espera):
+    """True si el archivo existe y su tamaño y fecha no cambian desde hace 'espera' segundos."""
+    try:
+        st = os.stat(ruta)
+    except OSError:
+        vistos.pop(ruta, None)
+        return False
+    firma = (st.st_size, st.st_mtime_ns)
+    if vistos.get(ruta, (None,))[0] != firma:
+        vistos[ruta] = (firma, time.time())
+    return time.time() - vistos[ruta][1] >= espera
+
+
+def ejecutar_planificado(trabajos, nucleos=None, memoria_gb=None, gpus=0, intervalo=2.0, bus=None,
+                         presupuesto=None, espera_estable=ESPERA_ESTABLE):
+    """
+    Ejecuta los trabajos respetando dependencias y recursos. Un trabajo arranca cuando:
+      - todas sus dependencias terminaron bien (si alguna falló, se cancela),
+      - existen los archivos de 'requiere' y no cambiaron durante 'espera_estable' segundos (si no
+        aparecen y ya no queda nada corriendo del mismo sujeto que pueda generarlos, falla),
+      - entra en los núcleos / memoria / GPUs libres (un trabajo más grande que el nodo se ajusta
+        al total y corre solo). Con 'presupuesto' (archivo de reservas) cuentan también los
+        recursos que reservaron otros planificadores del nodo.
+    Un trabajo 'escalable' arranca con los núcleos libres menos los que necesitan los demás
+    trabajos ya listos para correr (p. ej. surf deja uno para sclimbic).
+    Los trabajos se consideran en el orden dado (sujetos en orden de llegada). Con 'bus'
+    (eventos.BusEventos) cada trabajo emite inicio/fin con sus recursos y tiempos.
+    Devuelve {nombre: {"codigo", "inicio", "fin", "segundos", "estado", "log"}}.
+    """
+    total = {
+        "nucleos": nucleos or nucleos_disponibles(),
+        "memoria_gb": memoria_gb or memoria_disponible_gb(),
+        "gpus": gpus,
+    }
+    for t in trabajos:
+        for r in total:
+            t[r] = min(t[r], total[r])
+    locales = {}
+    _log(f"Recursos: {total['nucleos']} núcleos, {total['memoria_gb']:.0f} GB, {total['gpus']} GPU(s); "
+         f"{len(trabajos)} trabajos" + (f"; reservas compartidas en {presupuesto}." if presupuesto else "."))
+
+    pendientes = list(trabajos)
+    corriendo = {}  # nombre -> (Popen, trabajo, archivo de log)
+    resultados = {}
+    vistos = {}  # archivos de 'requiere' -> (tamaño y fecha, desde cuándo)
+
+    def _clave(trabajo):
+        return f"{os.getpid()}:{trabajo['nombre']}"
+
+    def _terminar(trabajo, codigo, estado, inicio=None, fin=None):
+        fin = fin or time.time()
+        resultados[trabajo["nombre"]] = {
+            "codigo": codigo, "estado": estado, "inicio": inicio, "fin": fin,
+            "segundos": round(fin - inicio, 1) if inicio else 0.0, "log": trabajo["log"],
+        }
+
+    def _listo(trabajo):
+        return all(resultados.get(d, {}).get("estado") == "ok" for d in trabajo["depende"])
+
+    try:
+        while pendientes or corriendo:
+            # 1) Recoger los que terminaron y liberar recursos
+            terminados = []
+            for nombre, (proceso, trabajo, log, inicio) in list(corriendo.items()):
+                codigo = proceso.poll()
+                if codigo is None:
+                    continue
+                log.close()
+                del corriendo[nombre]
+                terminados.append(trabajo)
+                estado = "ok" if codigo == 0 else "error"
+                _terminar(trabajo, codigo, estado, inicio)
+                _log(f"{nombre}: {estado} (código {codigo}, {resultados[nombre]['segundos'] / 60:.1f} min)")
+                if bus:
+                    bus.fin(nombre, estado, codigo=codigo, error=None if codigo == 0 else f"ver {trabajo['log']}")
+                if codigo != 0:
+                    _log(f"  ver {trabajo['log']}")
+            if terminados:
+                with reservas(presupuesto, locales) as en_uso:
+                    for trabajo in terminados:
+                        en_uso.pop(_clave(trabajo), None)
+
+            # 2) Lanzar lo que esté listo y entre en los recursos libres
+            candidatos = []
+            for trabajo in list(pendientes):
+                deps = [resultados.get(d) for d in trabajo["depende"]]
+                if any(d is not None and d["estado"] != "ok" for d in deps):
+                    pendientes.remove(trabajo)
+                    _terminar(trabajo, None, "cancelado")
+                    _log(f"{trabajo['nombre']}: cancelado (falló una dependencia).")
+                    if bus:
+                        bus.aviso(trabajo["nombre"], "cancelado: falló una dependencia")
+                    continue
+                if any(d is None for d in deps):
+                    continue
+                faltan = [p for p in trabajo["requiere"] if not os.path.exists(p)]
+                if faltan:
+                    # Falla si ya no queda nada del sujeto corriendo o listo para correr que lo genere
+                    sujeto = trabajo["nombre"].rsplit(":", 1)[0]
+                    activos = list(corriendo) + [t["nombre"] for t in pendientes if t is not trabajo and _listo(t)]
+                    if not any(n.rsplit(":", 1)[0] == sujeto for n in activos):
+                        pendientes.remove(trabajo)
+                        _terminar(trabajo, None, "error")
+                        _log(f"{trabajo['nombre']}: error, no existe {faltan[0]}.")
+                        if bus:
+                            bus.aviso(trabajo["nombre"], f"no existe {faltan[0]}")
+                    continue
+                # Todos los archivos se miran en cada vuelta para ir midiendo su estabilidad
+                if not all([_estable(p, vistos, espera_estable) for p in trabajo["requiere"]]):
+                    continue
+                candidatos.append(trabajo)
+
+            if candidatos:
+                with reservas(presupuesto, locales) as en_uso:
+                    libres = _libres(total, en_uso)
+                    for trabajo in candidatos:
+                        if trabajo.get("escalable"):
+                            # Núcleos libres menos los de los otros trabajos que ya podrían correr
+                            otros = sum(t["nucleos"] for t in pendientes if t is not trabajo and _listo(t))
+                            minimo = trabajo.setdefault("nucleos_minimo", trabajo["nucleos"])
+                            hilos = min(total["nucleos"], max(minimo, libres["nucleos"] - otros))
+                            trabajo["nucleos"] = hilos
+                            trabajo["comando"] = _con_hilos(trabajo["comando"], hilos)
+                        if not _entra(trabajo, libres):
+                            continue
+
+                        os.makedirs(os.path.dirname(trabajo["log"]), exist_ok=True)
+                        log = open(trabajo["log"], "a", encoding="utf-8")
+                        entorno = dict(os.environ, **trabajo["entorno"])
+                        proceso = subprocess.Popen(trabajo["comando"], stdout=log, stderr=subprocess.STDOUT, env=entorno)
+                        corriendo[trabajo["nombre"]] = (proceso, trabajo, log, time.time())
+                        pendientes.remove(trabajo)
+                        en_uso[_clave(trabajo)] = dict({r: trabajo[r] for r in RECURSOS}, pid=os.getpid())
+                        for r in RECURSOS:
+                            libres[r] -= trabajo[r]
+                        if bus:
+                            bus.inicio(trabajo["nombre"], f"FastSurfer {trabajo['nombre']}", nucleos=trabajo["nucleos"],
+                                       memoria_gb=trabajo["memoria_gb"], gpus=trabajo["gpus"])
+                        _log(f"{trabajo['nombre']}: inicia ({trabajo['nucleos']} núcleos, {trabajo['memoria_gb']:.0f} GB"
+                             f"{', GPU' if trabajo['gpus'] else ''}) -> {trabajo['log']}")
+
+            if pendientes or corriendo:
+                time.sleep(intervalo)
+    finally:
+        # Si el planificador se corta, no deja reservados recursos a nombre de sus trabajos
+        if presupuesto and corriendo:
+            with reservas(presupuesto, locales) as en_uso:
+                for trabajo in [t for _, t, _, _ in corriendo.values()]:
+                    en_uso.pop(_clave(trabajo), None)
+
+    return resultados
+
+
+def leer_lista_sujetos(ruta_lista):
+    """Líneas "<subjects_dir> <t1.nii> [sid]" (ignora vacías y comentarios '#')."""
+    sujetos = []
+    with open(ruta_lista, "r", encoding="utf-8") as f:
+        for linea in f:
+            if not linea.strip() or linea.lstrip().startswith("#"):
+                continue
+            partes = linea.split()
+            sujetos.append((partes[0], partes[1], partes[2] if len(partes) > 2 else "FastSurfer"))
+    return sujetos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ejecuta FastSurfer por fases (seg / surf / sclimbic) según recursos.")
+    parser.add_argument("--sd", help="SUBJECTS_DIR del sujeto.")
+    parser.add_argument("--t1", help="NIfTI T1 del sujeto.")
+    parser.add_argument("--sid", default="FastSurfer", help="Nombre del sujeto (por defecto FastSurfer).")
+    parser.add_argument("--lista", help="Archivo con varios sujetos: '<subjects_dir> <t1.nii> [sid]' por línea.")
+    parser.add_argument("--device", default="cpu", help="Dispositivo para la segmentación (cpu, cuda).")
+    parser.add_argument("--nucleos", type=int, default=None, help="Núcleos a usar (por defecto, los asignados).")
+    parser.add_argument("--memoria", type=float, default=None, help="Memoria a usar en GB (por defecto, la disponible).")
+    parser.add_argument("--gpus", type=int, default=None, help="GPUs (por defecto 1 con --device cuda, si no 0).")
+    parser.add_argument("--hilos_seg", type=int, default=None, help="Hilos de la fase de segmentación.")
+    parser.add_argument("--hilos_surf", type=int, default=None, help="Hilos de la fase de superficies.")
+    parser.add_argument("--resumen", default=None, help="Guardar el resultado de cada trabajo (JSON).")
+    parser.add_argument("--presupuesto", default=os.environ.get(VARIABLE_PRESUPUESTO, PRESUPUESTO_POR_DEFECTO),
+                        help="Archivo de reservas compartido por los planificadores del nodo "
+                             f"(por defecto {VARIABLE_PRESUPUESTO} o {PRESUPUESTO_POR_DEFECTO}; 'no' para no compartir).")
+    args = parser.parse_args()
+
+    if args.lista:
+        sujetos = leer_lista_sujetos(args.lista)
+    elif args.sd and args.t1:
+        sujetos = [(args.sd, args.t1, args.sid)]
+    else:
+        parser.error("Indicar --sd y --t1, o --lista.")
+
+    trabajos = []
+    for subjects_dir, t1, sid in sujetos:
+        trabajos += trabajos_sujeto(subjects_dir, t1, sid, device=args.device,
+                                    hilos_seg=args.hilos_seg, hilos_surf=args.hilos_surf, escalar=len(sujetos) == 1)
+    gpus = args.gpus if args.gpus is not None else (1 if args.device.startswith("cuda") else 0)
+    # Eventos sólo hacia los destinos de EVENTOS_PIPELINE (la consola ya tiene los mensajes del planificador)
+    bus = bus_desde_entorno(os.path.basename(os.path.abspath(sujetos[0][0])) if len(sujetos) == 1 else None)
+    presupuesto = None if args.presupuesto in ("", "no") else args.presupuesto
+    resultados = ejecutar_planificado(trabajos, nucleos=args.nucleos, memoria_gb=args.memoria, gpus=gpus, bus=bus,
+                                      presupuesto=presupuesto)
+    bus.cerrar()
+
+    if args.resumen:
+        with open(args.resumen, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=1)
+    fallidos = [n for n, r in resultados.items() if r["estado"] != "ok"]
+    if fallidos:
+        _log(f"Trabajos con error o cancelados: {', '.join(fallidos)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ import math
 import pandas as pd
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, NamedStyle, PatternFill, Alignment
+from processing.recursos import recursos
 
 # Diccionario de traducciones
 traducciones = {
@@ -92,7 +93,7 @@ def seleccionar_base_control_area(edad, genero):
     """
     Selecciona la base de datos control de areas según edad y género.
     """
-    base_dir = "/home/usuario/Bibliografia/pipeline_v2/recursos/morfo_cerebral/area_superficie_cortical"
+    base_dir = recursos.directorio("normativa_area")
     
     if edad <= 18:
         grupo = "18_29"
@@ -171,8 +172,8 @@ def procesar_areas(stats_folder, edad, genero):
     # Leer archivos del paciente y del grupo control
     df_paciente_lh = pd.read_csv(file_path_paciente_lh, sep='\t', index_col='lh.aparc.DKTatlas.mapped.area')
     df_paciente_rh = pd.read_csv(file_path_paciente_rh, sep='\t', index_col='rh.aparc.DKTatlas.mapped.area')
-    df_control_lh = pd.read_excel(file_path_estadisticos_control_lh, index_col='Measure:area', engine='openpyxl')
-    df_control_rh = pd.read_excel(file_path_estadisticos_control_rh, index_col='Measure:area', engine='openpyxl')
+    df_control_lh = pd.read_excel(recursos.origen(file_path_estadisticos_control_lh), index_col='Measure:area', engine='openpyxl')
+    df_control_rh = pd.read_excel(recursos.origen(file_path_estadisticos_control_rh), index_col='Measure:area', engine='openpyxl')
 
     # Comparar areas del paciente con el grupo control
     resultados_lh = comparar_areas(df_paciente_lh, df_control_lh)
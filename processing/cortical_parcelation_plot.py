@@ -1,12 +1,44 @@
 import subprocess
 import time
+import select
 import cv2
 import numpy as np
 import os
 from pathlib import Path
 import sys
-
-def capture_xvfb(display=":99", output_path=None, crop_coords=(310, None, 495, 703)):
+from processing.dicom_utils import ruta_nifti_t1
+from processing.recursos import recursos
+
+def iniciar_xvfb(pantalla="1720x900x24", espera=60):
+    """
+    Lanza un Xvfb propio en el primer display libre (-displayfd) y devuelve (proceso, ":N").
+    Cada postproceso tiene así su servidor X: varios pueden correr a la vez sin pisarse el
+    display, el lock ni las capturas.
+    """
+    lectura, escritura = os.pipe()
+    proceso = subprocess.Popen(["Xvfb", "-displayfd", str(escritura), "-screen", "0", pantalla],
+                               pass_fds=(escritura,))
+    os.close(escritura)
+    numero = b""
+    limite = time.time() + espera
+    try:
+        # Xvfb escribe el número de display cuando ya acepta conexiones
+        while not numero.endswith(b"\n") and time.time() < limite:
+            listos, _, _ = select.select([lectura], [], [], 1)
+            if listos:
+                parte = os.read(lectura, 16)
+                if not parte:
+                    break
+                numero += parte
+    finally:
+        os.close(lectura)
+    if not numero.strip().isdigit():
+        proceso.terminate()
+        proceso.wait()
+        raise RuntimeError("No se pudo iniciar Xvfb (sin display libre o Xvfb no instalado).")
+    return proceso, f":{numero.strip().decode()}"
+
+def capture_xvfb(display, output_path=None, crop_coords=(310, None, 495, 703)):
     screenshot_cmd = f"xwd -root -display {display} | convert xwd:- png:-"
     capture_process = subprocess.Popen(screenshot_cmd, shell=True, stdout=subprocess.PIPE)
     img_array = np.asarray(bytearray(capture_process.stdout.read()), dtype=np.uint8)
@@ -25,83 +57,72 @@ def capture_xvfb(display=":99", output_path=None, crop_coords=(310, None, 495, 7
 def generate_parcelation_plot(dicom_dir, subjects_dir):
     # Paths
     DIRECTORIO_APARC_ASEG = Path(subjects_dir) / "mri"
-    DIRECTORIO_T1 = Path(dicom_dir)
-    nii_files = list(DIRECTORIO_T1.glob('*.nii'))
-
-    if not nii_files:
-        raise FileNotFoundError("No se encontró ningún archivo .nii en el directorio DICOM.")
-    
-    IMAGEN_T1 = nii_files[0]
-    custom_lut_file = '/home/usuario/Bibliografia/pipeline_v2/recursos/aparc.DKTatlas+asegColorLUT.txt'
+    # NIfTI de la T1 según el registro de conversiones del estudio
+    IMAGEN_T1 = ruta_nifti_t1(dicom_dir)
+    custom_lut_file = recursos.ruta("lut_dkt")
 
     # Archivos de salida
     output_screenshot_1 = DIRECTORIO_APARC_ASEG / 'parcelacion_cortical.png'
     output_screenshot_2 = DIRECTORIO_APARC_ASEG / 'sclimbic_3d.png'
 
-    # Eliminar lock si existe
-    lock_file = '/tmp/.X99-lock'
-    if os.path.exists(lock_file):
-        os.remove(lock_file)
+    # Xvfb propio en un display libre (no se toca el :99 del contenedor ni el de otro postproceso)
+    xvfb_process, display = iniciar_xvfb()
 
-    # Lanzar Xvfb
-    xvfb_process = subprocess.Popen(["Xvfb", ":99", "-screen", "0", "1720x900x24"])
-    time.sleep(20)
-
-    env = dict(os.environ, DISPLAY=":99", GTK_IM_MODULE="none")
+    env = dict(os.environ, DISPLAY=display, GTK_IM_MODULE="none")
     openbox_process = subprocess.Popen(["openbox"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     time.sleep(20)
 
-    # --------------------------
-    # Primera ejecución: aparc.DKTatlas+aseg.mgz
-    # --------------------------
-    freeview_cmd_1 = [
-        "freeview",
-        "-v", f"{IMAGEN_T1}:opacity=0.9:smoothed=true",
-        f"{DIRECTORIO_APARC_ASEG}/aparc.DKTatlas+aseg.mgz:colormap=lut:lut={custom_lut_file}",
-        "-layout", "3",
-        "-viewport", "3d",
-        "-ras", "-8.30", "19.06", "62.15"
-    ]
-
-    freeview_proc_1 = subprocess.Popen(freeview_cmd_1, env=env)
-    time.sleep(40)
-    subprocess.run(['wmctrl', '-r', 'freeview', '-b', 'add,maximized_vert,maximized_horz'], env=env)
-    time.sleep(20)
-    subprocess.run(['xdotool', 'key', 'alt+1'], env=env)
-    time.sleep(10)
-
-    capture_xvfb(output_path=output_screenshot_1, crop_coords=(380, None, 495, 703))
-
-    freeview_proc_1.terminate()
-    freeview_proc_1.wait()
-
-    # --------------------------
-    # Segunda ejecución: sclimbic.mgz con isosuperficie
-    # --------------------------
-    freeview_cmd_2 = [
-        "freeview",
-        "-v", f"{IMAGEN_T1}:opacity=0.5:smoothed=true",
-        f"{DIRECTORIO_APARC_ASEG}/sclimbic.mgz:isosurface=on",
-        "-layout", "3",
-        "-viewport", "3d",
-        "-ras", "-8.30", "19.06", "62.15",
-        "--hide-3d-frames"
-    ]
-
-    freeview_proc_2 = subprocess.Popen(freeview_cmd_2, env=env)
-    time.sleep(40)
-    subprocess.run(['wmctrl', '-r', 'freeview', '-b', 'add,maximized_vert,maximized_horz'], env=env)
-    time.sleep(20)
-    subprocess.run(['xdotool', 'key', 'alt+1'], env=env)
-    time.sleep(10)
-
-    capture_xvfb(output_path=output_screenshot_2, crop_coords=(380, 1700, 202, 410))  # Más arriba
-
-    freeview_proc_2.terminate()
-    freeview_proc_2.wait()
-
-    # Cierre de entorno
-    openbox_process.terminate()
-    openbox_process.wait()
-    xvfb_process.terminate()
-    xvfb_process.wait()
\ No newline at end of file
+    try:
+        # --------------------------
+        # Primera ejecución: aparc.DKTatlas+aseg.mgz
+        # --------------------------
+        freeview_cmd_1 = [
+            "freeview",
+            "-v", f"{IMAGEN_T1}:opacity=0.9:smoothed=true",
+            f"{DIRECTORIO_APARC_ASEG}/aparc.DKTatlas+aseg.mgz:colormap=lut:lut={custom_lut_file}",
+            "-layout", "3",
+            "-viewport", "3d",
+            "-ras", "-8.30", "19.06", "62.15"
+        ]
+
+        freeview_proc_1 = subprocess.Popen(freeview_cmd_1, env=env)
+        time.sleep(40)
+        subprocess.run(['wmctrl', '-r', 'freeview', '-b', 'add,maximized_vert,maximized_horz'], env=env)
+        time.sleep(20)
+        subprocess.run(['xdotool', 'key', 'alt+1'], env=env)
+        time.sleep(10)
+
+        capture_xvfb(display, output_path=output_screenshot_1, crop_coords=(380, None, 495, 703))
+
+        freeview_proc_1.terminate()
+        freeview_proc_1.wait()
+
+        # --------------------------
+        # Segunda ejecución: sclimbic.mgz con isosuperficie
+        # --------------------------
+        freeview_cmd_2 = [
+            "freeview",
+            "-v", f"{IMAGEN_T1}:opacity=0.5:smoothed=true",
+            f"{DIRECTORIO_APARC_ASEG}/sclimbic.mgz:isosurface=on",
+            "-layout", "3",
+            "-viewport", "3d",
+            "-ras", "-8.30", "19.06", "62.15",
+            "--hide-3d-frames"
+        ]
+
+        freeview_proc_2 = subprocess.Popen(freeview_cmd_2, env=env)
+        time.sleep(40)
+        subprocess.run(['wmctrl', '-r', 'freeview', '-b', 'add,maximized_vert,maximized_horz'], env=env)
+        time.sleep(20)
+        subprocess.run(['xdotool', 'key', 'alt+1'], env=env)
+        time.sleep(10)
+
+        capture_xvfb(display, output_path=output_screenshot_2, crop_coords=(380, 1700, 202, 410))  # Más arriba
+
+        freeview_proc_2.terminate()
+        freeview_proc_2.wait()
+    finally:
+        # Cierre de entorno (sólo el Xvfb y openbox de este proceso)
+        for proceso in (openbox_process, xvfb_process):
+            proceso.terminate()
+            proceso.wait()
\ No newline at end of file
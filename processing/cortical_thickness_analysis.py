@@ -3,6 +3,7 @@ import math
 import pandas as pd
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, NamedStyle, PatternFill, Alignment
+from processing.recursos import recursos
 
 # Diccionario de traducciones
 traducciones = {
@@ -91,7 +92,7 @@ def seleccionar_base_control_espesores(edad, genero):
     """
     Selecciona la base de datos control de espesores según edad y género.
     """
-    base_dir = "/home/usuario/Bibliografia/pipeline_v2/recursos/morfo_cerebral/espesor_cortical"
+    base_dir = recursos.directorio("normativa_espesor")
     if edad <= 18:
         grupo = "18_29"
     elif edad <= 29:
@@ -162,8 +163,8 @@ def procesar_espesores(stats_folder, edad, genero):
     # Leer archivos del paciente y del grupo control
     df_paciente_lh = pd.read_csv(file_path_paciente_lh, sep='\t', index_col='lh.aparc.DKTatlas.mapped.thickness')
     df_paciente_rh = pd.read_csv(file_path_paciente_rh, sep='\t', index_col='rh.aparc.DKTatlas.mapped.thickness')
-    df_control_lh = pd.read_excel(file_path_estadisticos_control_lh, index_col='Measure:thickness', engine='openpyxl')
-    df_control_rh = pd.read_excel(file_path_estadisticos_control_rh, index_col='Measure:thickness', engine='openpyxl')
+    df_control_lh = pd.read_excel(recursos.origen(file_path_estadisticos_control_lh), index_col='Measure:thickness', engine='openpyxl')
+    df_control_rh = pd.read_excel(recursos.origen(file_path_estadisticos_control_rh), index_col='Measure:thickness', engine='openpyxl')
 
     # Comparar espesores del paciente con el grupo control
     resultados_lh = comparar_espesores(df_paciente_lh, df_control_lh)
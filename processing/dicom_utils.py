@@ -5,21 +5,47 @@
 
 
 import os
-import pydicom
+import json
+from pathlib import Path
+
+from preprocessing.ingesta_dicom import INDICE_DICOM, VERSION_INDICE, indexar_estudio, resolver_nifti_t1
 
 def formatear_edad(edad):
     if edad.endswith("Y"):
         return str(int(edad[:-1])) + " años"
     return str(int(edad)) + " años"
 
-def leer_dicom_y_extraer_info(dicom_dir):
-    for root, dirs, files in os.walk(dicom_dir):
-        for file in files:
-            if file.endswith(".dcm"):
-                dicom_path = os.path.join(root, file)
-                ds = pydicom.dcmread(dicom_path)
-                edad = formatear_edad(ds.get("PatientAge", "00"))
-                genero = ds.get("PatientSex", "Desconocido")
-                return {"edad": edad, "género": genero}
-    raise FileNotFoundError("No se encontró ningún archivo DICOM en el directorio proporcionado.")
+def cargar_indice_dicom(dicom_dir):
+    """
+    Devuelve el índice de encabezados del estudio (indice_dicom.json en dicom_dir, lo escribe
+    preprocessing/ingesta_dicom.py). Si no existe o es de otra versión, se construye una sola vez
+    leyendo sólo encabezados y queda guardado para los siguientes usos.
+    """
+    ruta = os.path.join(dicom_dir, INDICE_DICOM)
+    if os.path.isfile(ruta):
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                indice = json.load(f)
+            if indice.get("version") == VERSION_INDICE:
+                return indice
+        except (OSError, ValueError):
+            pass  # índice dañado: se regenera
+    return indexar_estudio(dicom_dir)
+
+def encabezado_paciente(dicom_dir):
+    """
+    Datos del paciente/estudio como {atributo DICOM: valor} (PatientName, PatientID, PatientAge,
+    PatientSex, StudyDate, AccessionNumber, InstitutionName). Los atributos vacíos no aparecen,
+    así que se usa igual que ds.get(atributo, valor_por_defecto).
+    """
+    return cargar_indice_dicom(dicom_dir)["paciente"]
 
+def ruta_nifti_t1(dicom_dir):
+    """NIfTI de la T1 del estudio según el registro de conversiones (ver ingesta_dicom.resolver_nifti_t1)."""
+    return Path(resolver_nifti_t1(dicom_dir))
+
+def leer_dicom_y_extraer_info(dicom_dir):
+    paciente = encabezado_paciente(dicom_dir)
+    edad = formatear_edad(paciente.get("PatientAge", "00"))
+    genero = paciente.get("PatientSex", "Desconocido")
+    return {"edad": edad, "género": genero}
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Entradas (tablas y figuras) que lee cada reporte PDF. Las usan reissue.py, para omitir los
+estudios a los que les falta algo, y main_local.py, para que cada reporte dependa sólo de las
+etapas que generan sus entradas.
+"""
+
+# Entradas que lee cada reporte (relativas al directorio de FastSurfer, salvo las marcadas con
+# "dicom:", que están en el directorio DICOM)
+ENTRADAS_REPORTES = {
+    "completo": [
+        "stats/volumetria.xlsx",
+        "stats/aparc_stats_thickness_Z_score_robusto.xlsx",
+        "stats/aparc_stats_area_Z_score_robusto.xlsx",
+        "stats/aparc_stats_foldind_Z_score_robusto.xlsx",
+        "stats/cerebellum.CerebNet.stats",
+        "stats/comparac_control_pentagono.png",
+        "stats/comparac_control_heatmap.png",
+        "stats/aparc_stats_thickness_Z_score_robusto_plots.png",
+        "stats/aparc_stats_area_Z_score_robusto_plots.png",
+        "stats/aparc_stats_foldind_Z_score_robusto_plots.png",
+        "surf/sag_thickness.png",
+        "surf/cor_thickness.png",
+        "surf/ax_thickness.png",
+        "mri/mask/control_de_calidad.png",
+        "mri/mask/mesh.png",
+        "mri/parcelacion_cortical.png",
+        "mri/sclimbic_3d.png",
+        "dicom:sclimbic_volumes_all.csv",
+        "dicom:sclimbic_zqa_scores_all.csv",
+        "dicom:sclimbic_confidences_all.csv",
+    ],
+    "general": [
+        "stats/volumetria.xlsx",
+        "stats/Especificos.xlsx",
+        "stats/pentagono_sustgris.png",
+        "stats/pentagono_volumenes_general.png",
+        "stats/pentagono_espesores_lobulos.png",
+        "stats/graficos_temporales/Sustancia_blanca_total_vs_tiempo.png",
+        "stats/graficos_temporales/Sustancia_gris_total_vs_tiempo.png",
+        "stats/graficos_temporales/Ventrículos_Laterales_vs_tiempo.png",
+        "mri/mask/macroestructuras_especificos.png",
+        "mri/mask/lobulos_vistas_combinadas.png",
+    ],
+    "epilepsia": [
+        "stats/volumetria.xlsx",
+        "stats/Especificos.xlsx",
+        "stats/pentagono_epilepsia.png",
+        "stats/graficos_temporales/Sustancia_gris_corteza_derecha_vs_tiempo.png",
+        "stats/graficos_temporales/Sustancia_gris_corteza_izquierda_vs_tiempo.png",
+        "mri/mask/macroestructuras_epilepsia.png",
+        "dicom:sclimbic_volumes_all.csv",
+        "dicom:sclimbic_zqa_scores_all.csv",
+        "dicom:sclimbic_confidences_all.csv",
+    ],
+    "pediatrico": [
+        "stats/volumetria.xlsx",
+        "stats/Especificos.xlsx",
+        "surf/sag_thickness.png",
+        "surf/cor_thickness.png",
+        "surf/ax_thickness.png",
+        "mri/mask/control_de_calidad.png",
+    ],
+}
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Ejecución por etapas del postprocesamiento con estado en disco (para retomar con --resume).
+
+Cada etapa es un dict:
+    {"nombre": ..., "descripcion": ..., "funcion": f(contexto) -> dict | None,
+     "depende": [nombres], "siempre": bool}
+
+'funcion' recibe el contexto compartido (dicom_dir, subjects_dir, ...) y puede devolver valores
+nuevos para las etapas siguientes (p. ej. edad y género). Las etapas con "siempre" son baratas y
+sólo calculan contexto: se corren también al retomar.
+
+Si una etapa falla, las demás siguen; sólo se omiten las que dependen de ella. El estado de cada
+etapa queda en <dicom_dir>/logs_fastsurfer/estado_postproceso.json.
+"""
+
+import os
+import json
+import time
+import traceback
+
+
+ESTADO_POSTPROCESO = "estado_postproceso.json"
+VERSION_ESTADO = 1
+
+
+def ruta_estado(dicom_dir):
+    return os.path.join(dicom_dir, "logs_fastsurfer", ESTADO_POSTPROCESO)
+
+
+def cargar_estado(ruta):
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            estado = json.load(f)
+        if estado.get("version") == VERSION_ESTADO:
+            return estado
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def guardar_estado(ruta, estado):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    tmp = f"{ruta}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, ruta)
+
+
+def ejecutar_etapas(etapas, contexto, ruta, reanudar=False, bus=None):
+    """
+    Corre las etapas en orden y guarda el estado después de cada una. Con reanudar=True se saltean
+    las que ya terminaron bien en una corrida anterior. Devuelve el estado final
+    ({"etapas": {nombre: {"estado": "ok" | "error" | "omitida", ...}}}).
+    """
+    anterior = cargar_estado(ruta) if reanudar else None
+    previas = anterior["etapas"] if anterior else {}
+    estado = {
+        "version": VERSION_ESTADO,
+        "dicom_dir": contexto.get("dicom_dir"),
+        "subjects_dir": contexto.get("subjects_dir"),
+        "inicio": time.time(),
+        "fin": None,
+        "etapas": {e["nombre"]: dict(previas.get(e["nombre"], {}), estado=previas.get(e["nombre"], {}).get("estado", "pendiente"))
+                   for e in etapas},
+    }
+    guardar_estado(ruta, estado)
+
+    for etapa in etapas:
+        nombre = etapa["nombre"]
+        registro = estado["etapas"][nombre]
+        if registro["estado"] == "ok" and not etapa.get("siempre"):
+            if bus:
+                bus.emitir("fin", nombre, estado="ya completada", segundos=0.0)
+            else:
+                print(f"\n{etapa['descripcion']} (ya completada, se omite)")
+            continue
+
+        fallidas = [d for d in etapa.get("depende", []) if estado["etapas"][d]["estado"] != "ok"]
+        if fallidas:
+            registro.update(estado="omitida", error=f"depende de {', '.join(fallidas)}", fin=time.time())
+            if bus:
+                bus.emitir("fin", nombre, estado="omitida", segundos=0.0, error=registro["error"])
+            else:
+                print(f"\n{etapa['descripcion']} omitida: {registro['error']}.")
+            guardar_estado(ruta, estado)
+            continue
+
+        registro.update(estado="en_curso", inicio=time.time(), error=None,
+                        intentos=registro.get("intentos", 0) + 1)
+        guardar_estado(ruta, estado)
+        try:
+            if bus:
+                with bus.etapa(nombre, etapa["descripcion"]):
+                    nuevos = etapa["funcion"](contexto)
+            else:
+                print(f"\n{etapa['descripcion']}")
+                nuevos = etapa["funcion"](contexto)
+            contexto.update(nuevos or {})
+            registro["estado"] = "ok"
+        except Exception as e:
+            registro.update(estado="error", error=f"{type(e).__name__}: {e}")
+            if not bus:
+                print(f"\nError en la etapa '{nombre}': {e}")
+            traceback.print_exc()
+        registro["fin"] = time.time()
+        registro["segundos"] = round(registro["fin"] - registro["inicio"], 1)
+        guardar_estado(ruta, estado)
+
+    estado["fin"] = time.time()
+    guardar_estado(ruta, estado)
+    return estado
+
+
+def etapas_incompletas(estado):
+    """Nombres de las etapas que no terminaron bien, con su estado."""
+    return {nombre: r["estado"] for nombre, r in estado["etapas"].items() if r["estado"] != "ok"}
@@ -3,6 +3,7 @@ import math
 import pandas as pd
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, NamedStyle, PatternFill, Alignment
+from processing.recursos import recursos
 
 # Diccionario de traducciones
 traducciones = {
@@ -90,7 +91,7 @@ def seleccionar_base_control_foldind(edad, genero):
     """
     Selecciona la base de datos control de índices de plegamiento según edad y género.
     """
-    base_dir = "/home/usuario/Bibliografia/pipeline_v2/recursos/morfo_cerebral/indice_plegamiento/"
+    base_dir = recursos.directorio("normativa_plegamiento")
 
     if edad <= 18:
         grupo = "18_29"
@@ -165,8 +166,8 @@ def procesar_foldind(stats_folder, edad, genero):
     # Leer archivos del paciente y del grupo control
     df_paciente_lh = pd.read_csv(file_path_paciente_lh, sep='\t', index_col='lh.aparc.DKTatlas.mapped.foldind').drop(['lh_bankssts_foldind'], errors='ignore')
     df_paciente_rh = pd.read_csv(file_path_paciente_rh, sep='\t', index_col='rh.aparc.DKTatlas.mapped.foldind').drop(['rh_bankssts_foldind'], errors='ignore')
-    df_control_lh = pd.read_excel(file_path_estadisticos_control_lh, index_col='Measure:foldind', engine='openpyxl').drop(['lh_bankssts_foldind'], errors='ignore')
-    df_control_rh = pd.read_excel(file_path_estadisticos_control_rh, index_col='Measure:foldind', engine='openpyxl').drop(['rh_bankssts_foldind'], errors='ignore')
+    df_control_lh = pd.read_excel(recursos.origen(file_path_estadisticos_control_lh), index_col='Measure:foldind', engine='openpyxl').drop(['lh_bankssts_foldind'], errors='ignore')
+    df_control_rh = pd.read_excel(recursos.origen(file_path_estadisticos_control_rh), index_col='Measure:foldind', engine='openpyxl').drop(['rh_bankssts_foldind'], errors='ignore')
 
     # Comparar índices de plegamiento del paciente con el grupo control
     resultados_lh = comparar_foldind(df_paciente_lh, df_control_lh)
@@ -7,6 +7,7 @@ from PIL import Image
 
 import nibabel as nib
 import numpy as np
+from processing.dicom_utils import ruta_nifti_t1
 
 def _mask_world_centre(mask_paths):
     """Calcula el centroide en coordenadas de mundo a partir de máscaras NIfTI."""
@@ -28,17 +29,13 @@ def _mask_world_centre(mask_paths):
 
 def generate_macrostructure_plots_epilepsia(dicom_dir, subjects_dir):
     # Definir las rutas
-    DIRECTORIO_T1 = Path(dicom_dir)
     DIRECTORIO_FREESURFER = Path(subjects_dir)
     DIRECTORIO_MASCARAS = DIRECTORIO_FREESURFER / "mri" / "mask"
 
     DIRECTORIO_MASCARAS.mkdir(parents=True, exist_ok=True)
 
-    # Buscar el archivo .nii en el directorio T1
-    nii_files = list(DIRECTORIO_T1.glob('*.nii'))
-    if not nii_files:
-        raise FileNotFoundError("No se encontró ningún archivo con la extensión .nii en el directorio proporcionado.")
-    IMAGEN_T1 = nii_files[0]
+    # NIfTI de la T1 según el registro de conversiones del estudio
+    IMAGEN_T1 = ruta_nifti_t1(dicom_dir)
 
     # Calcular el rango dinámico robusto de la imagen T1
     rango = subprocess.check_output(["fslstats", str(IMAGEN_T1), "-r"]).decode('utf-8').strip()
@@ -5,10 +5,10 @@ import sys
 from PIL import Image
 import nibabel as nib
 import numpy as np
+from processing.dicom_utils import ruta_nifti_t1
 
 def generate_macrostructure_plots(dicom_dir, subjects_dir):
     # Definir las rutas
-    DIRECTORIO_T1 = Path(dicom_dir)
     DIRECTORIO_FREESURFER = Path(subjects_dir)
     DIRECTORIO_APARC_ASEG = DIRECTORIO_FREESURFER / "mri"
     DIRECTORIO_MESH = DIRECTORIO_FREESURFER / "surf"
@@ -16,11 +16,8 @@ def generate_macrostructure_plots(dicom_dir, subjects_dir):
 
     DIRECTORIO_MASCARAS.mkdir(parents=True, exist_ok=True)
 
-    # Buscar el archivo .nii en el directorio T1
-    nii_files = list(DIRECTORIO_T1.glob('*.nii'))
-    if not nii_files:
-        raise FileNotFoundError("No se encontró ningún archivo con la extensión .nii en el directorio proporcionado.")
-    IMAGEN_T1 = nii_files[0]
+    # NIfTI de la T1 según el registro de conversiones del estudio
+    IMAGEN_T1 = ruta_nifti_t1(dicom_dir)
     # Calcular el rango dinámico robusto de la imagen T1 con Nibabel y Numpy
     print(f"Calculando rango robusto para {IMAGEN_T1}...")
     img = nib.load(str(IMAGEN_T1))
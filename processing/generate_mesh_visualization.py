@@ -1,19 +1,16 @@
 import subprocess
 from pathlib import Path
+from processing.dicom_utils import ruta_nifti_t1
 
 def generate_mesh_visualization(dicom_dir, subjects_dir):
     # Definir rutas automáticamente
-    DIRECTORIO_T1 = Path(dicom_dir)
     DIRECTORIO_FREESURFER = Path(subjects_dir)
     DIRECTORIO_MESH = DIRECTORIO_FREESURFER / "surf"
     DIRECTORIO_OUTPUT = DIRECTORIO_FREESURFER / "mri" / "mask"
     DIRECTORIO_OUTPUT.mkdir(parents=True, exist_ok=True)
 
-    # Buscar el archivo .nii en el directorio T1
-    nii_files = list(DIRECTORIO_T1.glob('*.nii'))
-    if not nii_files:
-        raise FileNotFoundError("No se encontró ningún archivo .nii en el directorio T1.")
-    IMAGEN_T1 = nii_files[0]
+    # NIfTI de la T1 según el registro de conversiones del estudio
+    IMAGEN_T1 = ruta_nifti_t1(dicom_dir)
 
     # Definir rutas de las mallas
     RH_WHITE = DIRECTORIO_MESH / "rh.white"
@@ -9,6 +9,7 @@ import os
 import textwrap
 
 from processing.specific_analysis import _warn  # Import needed for label wrapping
+from processing.recursos import recursos
 
 
 def _read_transposed_series(path: str) -> pd.Series:
@@ -40,7 +41,7 @@ def seleccionar_base_control_espesores(edad, genero):
     """
     Selecciona la base de datos control de espesores según edad y género.
     """
-    base_dir = "/home/usuario/Bibliografia/pipeline_v2/recursos/morfo_cerebral/espesor_cortical"
+    base_dir = recursos.directorio("normativa_espesor")
     if edad <= 18:
         grupo = "18_29"
     elif edad <= 29:
@@ -92,8 +93,8 @@ def extraer_mediana_volumen_df(stats_folder,edad, genero):
     df_paciente_lh = _read_transposed_series(file_path_paciente_lh)  # e.g., 'lh_cuneus_volume'
     df_paciente_rh = _read_transposed_series(file_path_paciente_rh)  # e.g., 'rh_cuneus_volume'
 
-    df_control_lh = pd.read_excel(file_path_estadisticos_control_lh, index_col='Measure:thickness', engine='openpyxl')
-    df_control_rh = pd.read_excel(file_path_estadisticos_control_rh, index_col='Measure:thickness', engine='openpyxl')
+    df_control_lh = pd.read_excel(recursos.origen(file_path_estadisticos_control_lh), index_col='Measure:thickness', engine='openpyxl')
+    df_control_rh = pd.read_excel(recursos.origen(file_path_estadisticos_control_rh), index_col='Measure:thickness', engine='openpyxl')
 
 
 
@@ -5,6 +5,7 @@ from scipy.interpolate import make_interp_spline
 from pathlib import Path
 import warnings
 import re
+from processing.recursos import recursos
 
 # --- Funciones Auxiliares ---
 
@@ -113,7 +114,7 @@ def generar_graficos_volumen_edad(
     path_archivo_poblacion = p_poblacion_dir / nombre_archivo_poblacion
     
     try:
-        df_poblacion = pd.read_excel(path_archivo_poblacion, index_col=0)
+        df_poblacion = pd.read_excel(recursos.origen(path_archivo_poblacion), index_col=0)
     except FileNotFoundError:
         warnings.warn(f"Archivo de población no encontrado en '{path_archivo_poblacion}'. No se generarán gráficos.")
         return
@@ -231,7 +232,7 @@ if __name__ == '__main__':
     # DEBES MODIFICAR ESTAS RUTAS ANTES DE EJECUTAR
     
     # Ruta al directorio que contiene los archivos 'F_vol_vs_tiempo.xlsx' y 'M_vol_vs_tiempo.xlsx'
-    directorio_poblacion = "/home/usuario/Bibliografia/pipeline_v2/recursos/morfo_cerebral/Temporales"       
+    directorio_poblacion = recursos.directorio("normativa_temporales")
     
     # Ruta al archivo .xlsx del paciente/sujeto
     archivo_sujeto = "/home/usuario/Descargas/DIAZ/dicom/Fastsurfer/stats/Especificos.xlsx"
@@ -7,12 +7,13 @@ import os
 
 # Importar variables y funciones de otros módulos
 from processing.volumetric_analysis import traducciones, pares_regiones, traduccion_regiones, seleccionar_base_control, truncar_numero
+from processing.recursos import recursos
 
 def seleccionar_base_control_txt(edad, genero):
     """
     Selecciona automáticamente la base de datos control en formato .txt según la edad y el género.
     """
-    base_dir = "/home/usuario/Bibliografia/pipeline_v2/recursos/morfo_cerebral/volumen/"
+    base_dir = recursos.directorio("normativa_volumen")
 
     if edad <= 18:
         grupo = "18_29"
@@ -37,7 +38,7 @@ def seleccionar_base_control_txt(edad, genero):
 
 def leer_datos(archivo, es_control=True):
     if es_control:
-        return pd.read_csv(archivo, sep='\t')
+        return pd.read_csv(recursos.origen(archivo), sep='\t')
     else:
         return pd.read_csv(archivo, header=None, names=['Measure:volume', 'Volumen'], sep='\t')
 
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Recursos del pipeline (bases normativas, fuentes, LUT, firma y plantillas PDF) resueltos desde
+una sola raíz configurable.
+
+La raíz es, en orden: el argumento de configurar_recursos(), la variable RECURSOS_PIPELINE o la
+carpeta recursos/ junto a processing/ (en el contenedor, /home/usuario/Bibliografia/pipeline_v2/recursos).
+
+    from processing.recursos import configurar_recursos, recursos
+    configurar_recursos(precargar=True)        # al inicio: valida todo y falla enseguida si falta algo
+    recursos.ruta("plantilla_completo")        # ruta de un archivo
+    recursos.directorio("normativa_volumen")   # carpeta de una base normativa
+    pd.read_excel(recursos.origen(ruta))       # contenido precargado (o mapeado en memoria) si lo está
+
+Con precargar=True los archivos chicos se leen una sola vez a memoria y los grandes se mapean una
+sola vez (mmap, páginas compartidas con otros procesos que mapean el mismo archivo); cada origen()
+devuelve un lector propio sobre ese contenido, sin volver a abrir ni copiar el archivo.
+"""
+
+import io
+import os
+import mmap
+import threading
+from pathlib import Path
+
+
+VARIABLE_RECURSOS = "RECURSOS_PIPELINE"
+RAIZ_POR_DEFECTO = Path(__file__).resolve().parent.parent / "recursos"
+UMBRAL_MMAP = 8 * 1024 ** 2  # bytes: desde este tamaño se mapea en lugar de copiar a memoria
+
+# Archivos sueltos: clave -> ruta relativa a la raíz
+ARCHIVOS = {
+    "fuente_opensans_light": "OpenSans-Light.ttf",
+    "fuente_opensans_regular": "OpenSans-Regular.ttf",
+    "fuente_arial_unicode": "Arial-Unicode-Regular.ttf",
+    "plantilla_completo": "reporte_completo.pdf",
+    "plantilla_general": "Copy of PDF Report.pdf",
+    "plantilla_epilepsia": "epilepsia PDF Report.pdf",
+    "plantilla_pediatrico": "Pediatrico.pdf",
+    "lut_dkt": "aparc.DKTatlas+asegColorLUT.txt",
+    "colorbar_espesor": "colorbar_thickness.png",
+    "firma": "firma_suaviz.png",
+}
+
+# Nombre de la fuente en ReportLab -> clave del archivo
+FUENTES = {
+    "OpenSansLight": "fuente_opensans_light",
+    "OpenSansRegular": "fuente_opensans_regular",
+    "ArialUnicode": "fuente_arial_unicode",
+}
+
+# Bases normativas: clave -> (carpeta relativa a la raíz, archivos esperados)
+GRUPOS = ("18_29", "30_44", "45_60")
+GENEROS = ("femenino", "masculino")
+DIRECTORIOS = {
+    "normativa_volumen": ("morfo_cerebral/volumen", [
+        f"grupo_{g}_{s}_aseg_stats_etiv{sufijo}" for g in GRUPOS for s in GENEROS
+        for sufijo in (".txt", "_IC_Bootstrap.xlsx")]),
+    "normativa_especificos": ("morfo_cerebral/especificos", [
+        f"vol_esp_{s}_{g}.xlsx" for g in GRUPOS for s in GENEROS]),
+    "normativa_espesor": ("morfo_cerebral/espesor_cortical", [
+        f"grupo_{g}_{s}_aparc_{h}_stats_thickness_Z_Scores_Robustos.xlsx" for g in GRUPOS for s in GENEROS for h in ("lh", "rh")]),
+    "normativa_area": ("morfo_cerebral/area_superficie_cortical", [
+        f"grupo_{g}_{s}_aparc_{h}_stats_area_Z_Scores_Robustos.xlsx" for g in GRUPOS for s in GENEROS for h in ("lh", "rh")]),
+    "normativa_plegamiento": ("morfo_cerebral/indice_plegamiento", [
+        f"grupo_{g}_{s}_aparc_{h}_stats_foldind_Z_Scores_Robustos.xlsx" for g in GRUPOS for s in GENEROS for h in ("lh", "rh")]),
+    "normativa_temporales": ("morfo_cerebral/Temporales", ["F_vol_vs_tiempo.xlsx", "M_vol_vs_tiempo.xlsx"]),
+}
+
+
+class LectorMapeado(io.RawIOBase):
+    """Archivo de sólo lectura sobre un mmap compartido, con su propia posición y sin copiar el contenido."""
+
+    def __init__(self, mapa):
+        super().__init__()
+        self._vista = memoryview(mapa)
+        self._posicion = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, destino):
+        n = max(0, min(len(destino), len(self._vista) - self._posicion))
+        destino[:n] = self._vista[self._posicion:self._posicion + n]
+        self._posicion += n
+        return n
+
+    def seek(self, desplazamiento, desde=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._posicion, io.SEEK_END: len(self._vista)}[desde]
+        self._posicion = max(0, base + desplazamiento)
+        return self._posicion
+
+    def tell(self):
+        return self._posicion
+
+    def close(self):
+        if not self.closed:
+            self._vista.release()
+        super().close()
+
+
+class PaqueteRecursos:
+    """Resuelve, valida y (opcionalmente) precarga los recursos desde una raíz."""
+
+    def __init__(self, raiz=None):
+        self.raiz = Path(os.path.abspath(raiz or os.environ.get(VARIABLE_RECURSOS) or RAIZ_POR_DEFECTO))
+        self._contenido = {}  # ruta absoluta -> bytes (chicos) o mmap (grandes)
+        self._fuentes_registradas = False
+        self._lock = threading.Lock()
+
+    def cambiar_raiz(self, raiz):
+        # Se cambia la misma instancia: los módulos que ya la importaron ven la nueva raíz
+        with self._lock:
+            self.raiz = Path(os.path.abspath(raiz))
+            self._contenido.clear()
+
+    def ruta(self, clave):
+        return str(self.raiz / ARCHIVOS[clave])
+
+    def directorio(self, clave):
+        return str(self.raiz / DIRECTORIOS[clave][0])
+
+    def esperados(self):
+        """Todas las rutas que el pipeline puede abrir."""
+        rutas = [self.ruta(clave) for clave in ARCHIVOS]
+        for carpeta, archivos in DIRECTORIOS.values():
+            rutas += [str(self.raiz / carpeta / nombre) for nombre in archivos]
+        return rutas
+
+    def validar(self):
+        """Rutas esperadas que no existen (lista vacía si está todo)."""
+        return [ruta for ruta in self.esperados() if not os.path.isfile(ruta)]
+
+    def precargar(self, umbral=UMBRAL_MMAP):
+        """
+        Lee a memoria los recursos chicos y mapea (mmap, una sola vez) los de 'umbral' bytes o más.
+        Devuelve (bytes leídos, bytes mapeados).
+        """
+        leidos = mapeados = 0
+        with self._lock:
+            for ruta in self.esperados():
+                if ruta in self._contenido or not os.path.isfile(ruta):
+                    continue
+                with open(ruta, "rb") as f:
+                    if os.fstat(f.fileno()).st_size >= umbral:
+                        # El mapeo sigue válido al cerrar el archivo
+                        self._contenido[ruta] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        mapeados += len(self._contenido[ruta])
+                    else:
+                        self._contenido[ruta] = f.read()
+                        leidos += len(self._contenido[ruta])
+        return leidos, mapeados
+
+    def origen(self, ruta):
+        """
+        Lo que se le pasa al lector (pd.read_excel, PdfReader, TTFont): un lector en memoria si está
+        precargado (sobre los bytes leídos o sobre el mmap, sin copiarlo) y, si no, la misma ruta
+        (lo abre el lector).
+        """
+        ruta = os.path.abspath(str(ruta))
+        datos = self._contenido.get(ruta)
+        if isinstance(datos, mmap.mmap):
+            return LectorMapeado(datos)
+        if datos is not None:
+            return io.BytesIO(datos)
+        return ruta
+
+    def registrar_fuentes(self):
+        """Registra las fuentes de los reportes en ReportLab una sola vez por proceso."""
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
+        with self._lock:
+            if self._fuentes_registradas:
+                return
+            for nombre, clave in FUENTES.items():
+                pdfmetrics.registerFont(TTFont(nombre, self.origen(self.ruta(clave))))
+            self._fuentes_registradas = True
+
+
+# Instancia compartida por todos los módulos del proceso
+recursos = PaqueteRecursos()
+
+
+def configurar_recursos(raiz=None, precargar=False):
+    """
+    Fija la raíz (si se indica), valida que estén todos los recursos y opcionalmente los precarga.
+    Si falta alguno lanza RuntimeError con la lista, antes de empezar a procesar.
+    """
+    if raiz:
+        recursos.cambiar_raiz(raiz)
+    faltantes = recursos.validar()
+    if faltantes:
+        detalle = "\n".join(f"  - {ruta}" for ruta in faltantes)
+        raise RuntimeError(f"Faltan {len(faltantes)} recursos en {recursos.raiz} "
+                           f"(ver {VARIABLE_RECURSOS}):\n{detalle}")
+    if precargar:
+        leidos, mapeados = recursos.precargar()
+        print(f"Recursos precargados desde {recursos.raiz}: {leidos / 1024 ** 2:.1f} MB en memoria "
+              f"y {mapeados / 1024 ** 2:.1f} MB mapeados.")
+    return recursos
+
+
+if __name__ == "__main__":
+    import sys
+
+    try:
+        configurar_recursos(sys.argv[1] if len(sys.argv) > 1 else None)
+        print(f"Recursos completos en {recursos.raiz}.")
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
@@ -1,7 +1,8 @@
-def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
+def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path, incremental=False, usar_cache=True):
     
     
-    import pydicom
+    from processing.dicom_utils import encabezado_paciente
+    from processing.recursos import recursos
     from reportlab.pdfgen import canvas
     from reportlab.pdfbase.ttfonts import TTFont
     from reportlab.pdfbase import pdfmetrics
@@ -10,6 +11,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
     from reportlab.lib.pagesizes import letter
     from reportlab.lib.units import inch
     import PyPDF2
+    from processing.reporte_pdf import CachePaginas, componer_reporte, componer_reporte_incremental, dibujar_imagen_escalada as _dibujar_imagen_registrada
+    from processing.reporte_tablas import ColumnaTabla, decimales, dibujar_tabla, filas_en_orden
     import io
     from PIL import Image
     import pandas as pd
@@ -44,13 +47,6 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
         mes_texto = meses[mes - 1]
         return f"{dia} - {mes_texto} - {año}"
 
-    def buscar_primer_dicom(dicom_dir):
-        # Buscar archivos DICOM en el directorio dado
-        for root, dirs, files in os.walk(dicom_dir):
-            for file in files:
-                if file.endswith(".dcm"):
-                    return os.path.join(root, file)
-        return None
 
     # Cargar el archivo DICOM
    
@@ -74,31 +70,26 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
         raise FileNotFoundError(f"No se encontró la carpeta 'mri' en la ruta calculada: {path_mri}")
     
 
-    dicom_path = buscar_primer_dicom(dicom_dir)
-    if dicom_path:
-        ds = pydicom.dcmread(dicom_path)
-        # Extraer datos del paciente del archivo DICOM
-        datos_paciente = {
-            "Paciente": formatear_nombre(ds.get("PatientName", "Desconocido")),
-            "Edad": formatear_edad(ds.get("PatientAge", "00")),
-            "Sexo": ds.get("PatientSex", "Desconocido"),
-            "Fecha del estudio": formatear_fecha(ds.get("StudyDate", "00000000")),
-            "Accession Number": ds.get("AccessionNumber", "Desconocido"),
-            "Patient ID": ds.get("PatientID", "Desconocido")
-        }
-    else:
-        raise FileNotFoundError(f"No se encontró ningún archivo DICOM en el directorio: {dicom_dir}")
+    # Datos del paciente desde el índice de encabezados del estudio (sin abrir los DICOM)
+    ds = encabezado_paciente(dicom_dir)
+    datos_paciente = {
+        "Paciente": formatear_nombre(ds.get("PatientName", "Desconocido")),
+        "Edad": formatear_edad(ds.get("PatientAge", "00")),
+        "Sexo": ds.get("PatientSex", "Desconocido"),
+        "Fecha del estudio": formatear_fecha(ds.get("StudyDate", "00000000")),
+        "Accession Number": ds.get("AccessionNumber", "Desconocido"),
+        "Patient ID": ds.get("PatientID", "Desconocido")
+    }
 
 
 
     # Registra las fuentes OpenSans Light y OpenSans Bold
-    pdfmetrics.registerFont(TTFont('OpenSansLight', '//home/usuario/Bibliografia/pipeline_v2/recursos/OpenSans-Light.ttf'))
-    pdfmetrics.registerFont(TTFont('OpenSansRegular', '//home/usuario/Bibliografia/pipeline_v2/recursos/OpenSans-Regular.ttf'))
-    pdfmetrics.registerFont(TTFont('ArialUnicode', '//home/usuario/Bibliografia/pipeline_v2/recursos/Arial-Unicode-Regular.ttf'))
+    # Se registran una sola vez por proceso (desde memoria si los recursos están precargados)
+    recursos.registrar_fuentes()
 
     # Lee el PDF existente (template) para obtener las dimensiones y número de páginas
-    template_pdf_path = '/home/usuario/Bibliografia/pipeline_v2/recursos/reporte_completo.pdf'
-    existing_pdf = PyPDF2.PdfReader(open(template_pdf_path, "rb"))
+    template_pdf_path = recursos.ruta("plantilla_completo")
+    existing_pdf = PyPDF2.PdfReader(recursos.origen(template_pdf_path))
     num_pages = len(existing_pdf.pages)
     template_page = existing_pdf.pages[0]
     template_dims = template_page.mediabox
@@ -218,14 +209,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
 
     # Agregar varias imágenes y modificar su tamaño
     def dibujar_imagen_escalada(canvas, ruta_imagen, x, y, factor_escala):
-        """Carga, escala y dibuja una imagen en el canvas."""
-        imagen = Image.open(ruta_imagen)
-        ancho_original, alto_original = imagen.size
-
-        ancho_escalado = ancho_original * factor_escala
-        alto_escalado = alto_original * factor_escala
-
-        canvas.drawImage(ruta_imagen, x, y, width=ancho_escalado, height=alto_escalado)
+        """Escala y dibuja una imagen en el canvas (decodificada una sola vez por el registro compartido)."""
+        _dibujar_imagen_registrada(canvas, ruta_imagen, x, y, factor_escala)
 
     # Cargar archivo de espesores
     archivo_xlsx_thickness = os.path.join(path_stats, 'aparc_stats_thickness_Z_score_robusto.xlsx')
@@ -577,9 +562,7 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
 
     #----------------------------------------------------------------------------------
     # Función para añadir contenido a una página específica
-    def create_page_content(page_number):
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=(template_dims[2], template_dims[3]))
+    def create_page_content(can, page_number):
 
         # Posiciones iniciales para la escritura de los datos
         x_position = 20
@@ -658,7 +641,7 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             ruta_imagen_1 = os.path.join(path_surf, 'sag_thickness.png')
             ruta_imagen_2 = os.path.join(path_surf, 'cor_thickness.png')
             ruta_imagen_3 = os.path.join(path_surf, 'ax_thickness.png')
-            ruta_imagen_4 = '/home/usuario/Bibliografia/pipeline_v2/recursos/colorbar_thickness.png'
+            ruta_imagen_4 = recursos.ruta("colorbar_espesor")
             ruta_imagen_5 = os.path.join(path_mri, 'mask', 'control_de_calidad.png')
             ruta_imagen_6 = os.path.join(path_stats, 'comparac_control_pentagono.png')
             ruta_imagen_7 = os.path.join(path_stats, 'comparac_control_heatmap.png')
@@ -767,11 +750,20 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
     #----------------------------------------------------------------------------------  
     # Página 2
 
-        # Función para centrar el texto en una columna
-        def centrar_texto(canvas, texto, x_posicion_inicial, ancho_columna, y, fuente, tamano_fuente):
-            ancho_texto = pdfmetrics.stringWidth(texto, fuente, tamano_fuente)
-            x_centro = x_posicion_inicial + (ancho_columna - ancho_texto) / 2
-            canvas.drawString(x_centro, y, texto)
+        # Columnas de las tablas de Z scores (espesores, áreas e índices de plegamiento):
+        # valor del paciente en x=323, Z score en x=368, rango en x=440 y umbral en x=550
+        def columnas_z_score(campo_valor, n_decimales, dx_z=0, umbral_doble=False):
+            columnas = [
+                ColumnaTabla('Regiones_ESP', 35),
+                ColumnaTabla(campo_valor, 323, decimales(n_decimales)),
+                ColumnaTabla('Z_Score_Paciente', 368 + dx_z, decimales(2)),
+                ColumnaTabla('Rango normal ajustado por edad según Z scores', 440),
+            ]
+            if umbral_doble:
+                columnas.append(ColumnaTabla('Dentro_de_Umbral_±3.5', 550))
+            columnas.append(ColumnaTabla('Dentro_de_Umbral_±3.5', 550, fuente="ArialUnicode"))
+            return columnas
+
         # Asumiendo que tienes las columnas con anchos definidos
         ancho_columna_volumen_cm3 = 100
         ancho_columna_volumen_vit = 100
@@ -797,6 +789,14 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
 
             #y_position -= 17
 
+            # Columnas centradas (volumen, %VIT y rango) y nombre de la región
+            columnas_volumen = [
+                ColumnaTabla('Volumen_cm3', x_position_volumen_cm3, ancho=ancho_columna_volumen_cm3, alineacion="centro"),
+                ColumnaTabla('Volumen_%VIT', x_position_volumen_vit, ancho=ancho_columna_volumen_vit, alineacion="centro"),
+                ColumnaTabla('Rango_normal_ajustado_por_edad_según_%VIT', x_position_rango_normal, ancho=ancho_columna_rango_normal, alineacion="centro"),
+                ColumnaTabla('Regiones_ESP', x_position_region + 15),
+            ]
+
             for categoria, datos in datos_organizados.items():
                 if categoria != "Volumen de Áreas Corticales":
                     can.setFont("OpenSansRegular", 10)
@@ -810,21 +810,7 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
 
 
 
-                    for _, fila in datos.iterrows():
-                        # Centrar el texto de las columnas y dibujar
-                        centrar_texto(can, fila['Volumen_cm3'], x_position_volumen_cm3, ancho_columna_volumen_cm3, y_position, "OpenSansLight", 9)
-                        centrar_texto(can, fila['Volumen_%VIT'], x_position_volumen_vit, ancho_columna_volumen_vit, y_position, "OpenSansLight", 9)
-                        centrar_texto(can, fila['Rango_normal_ajustado_por_edad_según_%VIT'], x_position_rango_normal, ancho_columna_rango_normal, y_position, "OpenSansLight", 9)
-
-                        can.drawString(x_position_region + 15, y_position, fila['Regiones_ESP'])
-
-                        y_position -= 20
-                        if y_position < 50:
-                            # Maneja el cambio de página
-                            can.showPage()
-                            can.setFont("OpenSansLight", 9)
-                            can.setFillColorRGB(0, 0, 0)
-                            y_position = 750
+                    y_position = dibujar_tabla(can, datos, columnas_volumen, y_position, y_minimo=50)
 
                     y_position -= 10
 
@@ -863,16 +849,13 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
                 can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
                 y_position -= 17
 
-                for _, fila in datos.iterrows():
-                    can.drawString(x_position_region + 15, y_position, fila['Regiones_ESP'])
-                    can.drawString(x_position_volumen_cm3, y_position, f"{fila['Volumen_cm3']}")
-                    can.drawString(x_position_volumen_vit, y_position, f"{fila['Volumen_%VIT']}")
-                    can.drawString(x_position_rango_normal + 3, y_position, f"{fila['Rango_normal_ajustado_por_edad_según_%VIT']}")
-
-                    y_position -= 20
-
-                    if y_position < 50:
-                        break
+                columnas_corticales = [
+                    ColumnaTabla('Regiones_ESP', x_position_region + 15),
+                    ColumnaTabla('Volumen_cm3', x_position_volumen_cm3),
+                    ColumnaTabla('Volumen_%VIT', x_position_volumen_vit),
+                    ColumnaTabla('Rango_normal_ajustado_por_edad_según_%VIT', x_position_rango_normal + 3),
+                ]
+                y_position = dibujar_tabla(can, datos, columnas_corticales, y_position, y_minimo=50, cortar=True)
                     
             # Agregar datos de Asimetrias antes del aviso de aclaración
             y_position_asimetrias_left = y_position - 50  # Ajusta la posición según sea necesario
@@ -916,19 +899,23 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             ]
 
 
-            for _, fila in df_asimetrias.iterrows():
-                asimetria_val = float(fila['Asimetria'])  # Convertir a float
-                rango_normal_aip = fila['Rango_normal_ajustado_por_edad_según_AIP']  # Obtener el rango normal ajustado
-                if fila['Region'] in grupo_izquierda:
-                    can.drawString(x_position_region + 15, y_position_asimetrias_left - 35, fila['Region'])
-                    can.drawString(x_position_volumen_cm3 - 90, y_position_asimetrias_left - 35, f"{asimetria_val:.2f}")
-                    can.drawString(x_position_volumen_cm3 - 40, y_position_asimetrias_left - 35, rango_normal_aip)
-                    y_position_asimetrias_left -= 20
-                elif fila['Region'] in grupo_derecha:
-                    can.drawString(x_position_right_column - 55, y_position_asimetrias_right - 35, fila['Region'])
-                    can.drawString(x_position_right_column + 80, y_position_asimetrias_right - 35, f"{asimetria_val:.2f}")
-                    can.drawString(x_position_right_column + 135, y_position_asimetrias_right - 35, rango_normal_aip)
-                    y_position_asimetrias_right -= 20
+            # Cada grupo es una tabla independiente (se conserva el orden de df_asimetrias)
+            columnas_izquierda = [
+                ColumnaTabla('Region', x_position_region + 15),
+                ColumnaTabla('Asimetria', x_position_volumen_cm3 - 90, decimales(2)),
+                ColumnaTabla('Rango_normal_ajustado_por_edad_según_AIP', x_position_volumen_cm3 - 40),
+            ]
+            columnas_derecha = [
+                ColumnaTabla('Region', x_position_right_column - 55),
+                ColumnaTabla('Asimetria', x_position_right_column + 80, decimales(2)),
+                ColumnaTabla('Rango_normal_ajustado_por_edad_según_AIP', x_position_right_column + 135),
+            ]
+            y_position_asimetrias_left = dibujar_tabla(
+                can, df_asimetrias[df_asimetrias['Region'].isin(grupo_izquierda)], columnas_izquierda,
+                y_position_asimetrias_left, dy=-35)
+            y_position_asimetrias_right = dibujar_tabla(
+                can, df_asimetrias[df_asimetrias['Region'].isin(grupo_derecha)], columnas_derecha,
+                y_position_asimetrias_right, dy=-35)
 
             # Ajusta y_position para continuar con el contenido existente
             y_position = min(y_position_asimetrias_left, y_position_asimetrias_right)
@@ -1006,11 +993,6 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.drawString(530, y_position + 19, "Z score ±3.5")
             can.setFont("OpenSansLight", 9)
 
-            # Ajustar posiciones de columnas
-            x_position_valor_paciente = 323
-            x_position_z_score = 368
-            x_position_rango_normal = 440
-            x_position_umbral = 550
 
             y_position -= 10
 
@@ -1026,30 +1008,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
                 can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
                 y_position -= 25
 
-                for region in regiones:
-                    datos = df_thickness[df_thickness['Regiones_ESP'] == region]
-                    for _, fila in datos.iterrows():
-                        can.drawString(35, y_position - 17, str(fila['Regiones_ESP']))
-                        valor_paciente_mm = f"{float(fila['Valor_Paciente_mm']):.2f}" if not pd.isna(fila['Valor_Paciente_mm']) else "0.00"
-                        z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                        rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-
-                        can.drawString(x_position_valor_paciente, y_position - 17, valor_paciente_mm)
-                        can.drawString(x_position_z_score, y_position - 17, z_score_paciente)
-                        can.drawString(x_position_rango_normal, y_position - 17, rango_normal)
-
-                        can.setFont("ArialUnicode", 9)
-                        dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                        can.drawString(x_position_umbral, y_position - 17, dentro_de_umbral)
-                        can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-
-                        y_position -= 20
-
-                        if y_position < 50:
-                            can.showPage()
-                            can.setFont("OpenSansLight", 9)
-                            can.setFillColorRGB(0, 0, 0)
-                            y_position = 750
+                datos = filas_en_orden(df_thickness, 'Regiones_ESP', regiones)
+                y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente_mm', 2), y_position, y_minimo=50, dy=-17)
 
                 y_position -= 10
 
@@ -1075,11 +1035,6 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.drawString(530, y_position + 19, "Z score ±3.5")
             can.setFont("OpenSansLight", 9)
 
-            # Ajustar posiciones de columnas
-            x_position_valor_paciente = 323
-            x_position_z_score = 368
-            x_position_rango_normal = 440
-            x_position_umbral = 550
 
             # Mostrar el Lóbulo Frontal completo
             grupo = 'Espesores del Lóbulo Frontal'
@@ -1091,33 +1046,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
             y_position -= 35
 
-            for region in grupos_regiones[grupo]:
-                datos = df_thickness[df_thickness['Regiones_ESP'] == region]
-                for _, fila in datos.iterrows():
-                    can.drawString(35, y_position, str(fila['Regiones_ESP']))
-
-                    valor_paciente_mm = f"{float(fila['Valor_Paciente_mm']):.2f}" if not pd.isna(fila['Valor_Paciente_mm']) else "0.00"
-                    z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                    rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-
-                    can.drawString(x_position_valor_paciente, y_position, valor_paciente_mm)
-                    can.drawString(x_position_z_score, y_position, z_score_paciente)
-                    can.drawString(x_position_rango_normal, y_position, rango_normal)
-                    #can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-
-                    can.setFont("ArialUnicode", 9)
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                    can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-                    can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-
-                    y_position -= 20
-
-                    if y_position < 50:
-                        can.showPage()
-                        can.setFont("OpenSansLight", 9)
-                        can.setFillColorRGB(0, 0, 0)
-                        y_position = 750
+            datos = filas_en_orden(df_thickness, 'Regiones_ESP', grupos_regiones[grupo])
+            y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente_mm', 2), y_position, y_minimo=50)
 
             y_position -= 10  
 
@@ -1131,33 +1061,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
             y_position -= 19
 
-            for region in grupos_regiones[grupo]:
-                datos = df_thickness[df_thickness['Regiones_ESP'] == region]
-                for _, fila in datos.iterrows():
-                    can.drawString(35, y_position, str(fila['Regiones_ESP']))
-
-                    valor_paciente_mm = f"{float(fila['Valor_Paciente_mm']):.2f}" if not pd.isna(fila['Valor_Paciente_mm']) else "0.00"
-                    z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                    rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-
-                    can.drawString(x_position_valor_paciente, y_position, valor_paciente_mm)
-                    can.drawString(x_position_z_score, y_position, z_score_paciente)
-                    can.drawString(x_position_rango_normal, y_position, rango_normal)
-                    #can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-
-                    can.setFont("ArialUnicode", 9)
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                    can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-                    can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-
-                    y_position -= 20
-
-                    if y_position < 20:
-                        can.showPage()
-                        can.setFont("OpenSansLight", 9)
-                        can.setFillColorRGB(0, 0, 0)
-                        y_position = 750
+            datos = filas_en_orden(df_thickness, 'Regiones_ESP', grupos_regiones[grupo])
+            y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente_mm', 2), y_position, y_minimo=20)
 
     #----------------------------------------------------------------------------------  
     # Página 6
@@ -1178,11 +1083,6 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.drawString(530, y_position + 19, "Z score ±3.5")
             can.setFont("OpenSansLight", 9)
 
-            # Ajustar posiciones de columnas
-            x_position_valor_paciente = 323
-            x_position_z_score = 368
-            x_position_rango_normal = 440
-            x_position_umbral = 550
 
             # Mostrar 'Otras Regiones'
             grupo = 'Espesores de Otras Regiones'
@@ -1194,33 +1094,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
             y_position -= 17
 
-            for region in grupos_regiones[grupo]:
-                datos = df_thickness[df_thickness['Regiones_ESP'] == region]
-                for _, fila in datos.iterrows():
-                    can.drawString(35, y_position, str(fila['Regiones_ESP']))
-
-                    valor_paciente_mm = f"{float(fila['Valor_Paciente_mm']):.2f}" if not pd.isna(fila['Valor_Paciente_mm']) else "0.00"
-                    z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                    rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-
-                    can.drawString(x_position_valor_paciente, y_position, valor_paciente_mm)
-                    can.drawString(x_position_z_score, y_position, z_score_paciente)
-                    can.drawString(x_position_rango_normal, y_position, rango_normal)
-                    #can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-
-                    can.setFont("ArialUnicode", 9)
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                    can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-                    can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-
-                    y_position -= 20
-
-                    if y_position < 50:
-                        can.showPage()
-                        can.setFont("OpenSansLight", 9)
-                        can.setFillColorRGB(0, 0, 0)
-                        y_position = 750
+            datos = filas_en_orden(df_thickness, 'Regiones_ESP', grupos_regiones[grupo])
+            y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente_mm', 2), y_position, y_minimo=50)
 
             y_position -= 10  
     
@@ -1255,11 +1130,6 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.drawString(530, y_position + 19, "Z score ±3.5")
             can.setFont("OpenSansLight", 9)
 
-            # Ajustar posiciones de columnas
-            x_position_valor_paciente = 323
-            x_position_z_score = 368
-            x_position_rango_normal = 440
-            x_position_umbral = 550
 
             # Procesar los grupos de regiones de áreas
             for grupo, regiones in grupos_regiones_area.items():
@@ -1271,31 +1141,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
                 can.setFillColorRGB(0.2, 0.2, 0.2)  # Color gris oscuro
                 y_position -= 17
 
-                for region in regiones:
-                    datos = df_area[df_area['Regiones_ESP'] == region]
-                    for _, fila in datos.iterrows():
-                        can.drawString(35, y_position - 20, str(fila['Regiones_ESP']))
-                        valor_paciente_mm2 = f"{float(fila['Valor_Paciente_mm2']):.0f}" if not pd.isna(fila['Valor_Paciente_mm2']) else "0.00"
-                        z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                        rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-                        dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-
-                        can.drawString(x_position_valor_paciente, y_position - 20, valor_paciente_mm2)
-                        can.drawString(x_position_z_score + 5, y_position - 20, z_score_paciente)
-                        can.drawString(x_position_rango_normal, y_position - 20, rango_normal)
-                        can.drawString(x_position_umbral, y_position - 20, dentro_de_umbral)
-
-                        can.setFont("ArialUnicode", 9)
-                        dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                        can.drawString(x_position_umbral, y_position - 20, dentro_de_umbral)
-                        can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-                        y_position -= 20
-
-                        if y_position < 70:
-                            can.showPage()
-                            can.setFont("OpenSansLight", 9)
-                            can.setFillColorRGB(0, 0, 0)
-                            y_position = 750
+                datos = filas_en_orden(df_area, 'Regiones_ESP', regiones)
+                y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente_mm2', 0, dx_z=5, umbral_doble=True), y_position, y_minimo=70, dy=-20)
 
                 y_position -= 10
 
@@ -1319,11 +1166,6 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.drawString(530, y_position + 19, "Z score ±3.5")
             can.setFont("OpenSansLight", 9)
 
-            # Ajustar posiciones de columnas
-            x_position_valor_paciente = 323
-            x_position_z_score = 368
-            x_position_rango_normal = 440
-            x_position_umbral = 550    
 
 
             # Mostrar todo el grupo 'Lóbulo Frontal'
@@ -1336,27 +1178,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
             y_position -= 17
 
-            for region in grupos_regiones_area[grupo]:
-                datos = df_area[df_area['Regiones_ESP'] == region]
-                for _, fila in datos.iterrows():
-                    can.drawString(35, y_position, str(fila['Regiones_ESP']))
-
-                    valor_paciente_mm2 = f"{float(fila['Valor_Paciente_mm2']):.0f}" if not pd.isna(fila['Valor_Paciente_mm2']) else "0.00"
-                    z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                    rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-
-                    can.drawString(x_position_valor_paciente, y_position, valor_paciente_mm2)
-                    can.drawString(x_position_z_score, y_position, z_score_paciente)
-                    can.drawString(x_position_rango_normal, y_position, rango_normal)
-                    #can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-
-                    can.setFont("ArialUnicode", 9)
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                    can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-                    can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-
-                    y_position -= 20
+            datos = filas_en_orden(df_area, 'Regiones_ESP', grupos_regiones_area[grupo])
+            y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente_mm2', 0), y_position)
 
             # Mostrar el grupo 'Áreas del Lóbulo Cingulado'
             grupo = 'Áreas del Lóbulo Cingulado'
@@ -1368,27 +1191,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
             y_position -= 17
 
-            for region in grupos_regiones_area[grupo]:
-                datos = df_area[df_area['Regiones_ESP'] == region]
-                for _, fila in datos.iterrows():
-                    can.drawString(35, y_position - 10, str(fila['Regiones_ESP']))
-
-                    valor_paciente_mm2 = f"{float(fila['Valor_Paciente_mm2']):.0f}" if not pd.isna(fila['Valor_Paciente_mm2']) else "0.00"
-                    z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                    rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-
-                    can.drawString(x_position_valor_paciente, y_position - 10, valor_paciente_mm2)
-                    can.drawString(x_position_z_score, y_position - 10, z_score_paciente)
-                    can.drawString(x_position_rango_normal, y_position - 10, rango_normal)
-                    #can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-
-                    can.setFont("ArialUnicode", 9)
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                    can.drawString(x_position_umbral, y_position - 10, dentro_de_umbral)
-                    can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-
-                    y_position -= 20
+            datos = filas_en_orden(df_area, 'Regiones_ESP', grupos_regiones_area[grupo])
+            y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente_mm2', 0), y_position, dy=-10)
 
 
 
@@ -1411,11 +1215,6 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.drawString(530, y_position + 19, "Z score ±3.5")
             can.setFont("OpenSansLight", 9)
 
-            # Ajustar posiciones de columnas
-            x_position_valor_paciente = 323
-            x_position_z_score = 368
-            x_position_rango_normal = 440
-            x_position_umbral = 550
 
             # Mostrar el grupo 'Otras Regiones'
             grupo = 'Áreas de Otras Regiones'
@@ -1427,27 +1226,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
             y_position -= 17
 
-            for region in grupos_regiones_area[grupo]:
-                datos = df_area[df_area['Regiones_ESP'] == region]
-                for _, fila in datos.iterrows():
-                    can.drawString(35, y_position, str(fila['Regiones_ESP']))
-
-                    valor_paciente_mm2 = f"{float(fila['Valor_Paciente_mm2']):.0f}" if not pd.isna(fila['Valor_Paciente_mm2']) else "0.00"
-                    z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                    rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-
-                    can.drawString(x_position_valor_paciente, y_position, valor_paciente_mm2)
-                    can.drawString(x_position_z_score, y_position, z_score_paciente)
-                    can.drawString(x_position_rango_normal, y_position, rango_normal)
-                    #can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-
-                    can.setFont("ArialUnicode", 9)
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                    can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-                    can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-
-                    y_position -= 20
+            datos = filas_en_orden(df_area, 'Regiones_ESP', grupos_regiones_area[grupo])
+            y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente_mm2', 0), y_position)
 
             ruta_imagen_10 = f'{path_stats}/aparc_stats_area_Z_score_robusto_plots.png'
             dibujar_imagen_escalada(can, ruta_imagen_10, 25, 70, factor_escala=0.13)
@@ -1472,11 +1252,6 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.drawString(530, y_position + 19, "Z score ±3.5")
             can.setFont("OpenSansLight", 9)
 
-            # Ajustar posiciones de columnas
-            x_position_valor_paciente = 323
-            x_position_z_score = 368
-            x_position_rango_normal = 440
-            x_position_umbral = 550    
 
             #------------------------------------------------------------------------------------
             #------------------------------------------------------------------------------------
@@ -1500,31 +1275,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
                 can.setFillColorRGB(0.2, 0.2, 0.2)  # Color gris oscuro
                 y_position -= 25
 
-                for region in regiones:
-                    datos = df_foldind[df_foldind['Regiones_ESP'] == region]
-                    for _, fila in datos.iterrows():
-                        can.drawString(35, y_position - 20, str(fila['Regiones_ESP']))
-                        valor_paciente = f"{float(fila['Valor_Paciente']):.0f}" if not pd.isna(fila['Valor_Paciente']) else "0.00"
-                        z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                        rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-                        dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-
-                        can.drawString(x_position_valor_paciente, y_position - 20, valor_paciente)
-                        can.drawString(x_position_z_score + 5, y_position - 20, z_score_paciente)
-                        can.drawString(x_position_rango_normal, y_position - 20, rango_normal)
-                        can.drawString(x_position_umbral, y_position - 20, dentro_de_umbral)
-
-                        can.setFont("ArialUnicode", 9)
-                        dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                        can.drawString(x_position_umbral, y_position - 20, dentro_de_umbral)
-                        can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-                        y_position -= 20
-
-                        if y_position < 60:
-                            can.showPage()
-                            can.setFont("OpenSansLight", 9)
-                            can.setFillColorRGB(0, 0, 0)
-                            y_position = 750
+                datos = filas_en_orden(df_foldind, 'Regiones_ESP', regiones)
+                y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente', 0, dx_z=5, umbral_doble=True), y_position, y_minimo=60, dy=-20)
 
                 y_position -= 10
     #----------------------------------------------------------------------------------  
@@ -1546,11 +1298,6 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.drawString(530, y_position + 19, "Z score ±3.5")
             can.setFont("OpenSansLight", 9)
 
-            # Ajustar posiciones de columnas
-            x_position_valor_paciente = 323
-            x_position_z_score = 368
-            x_position_rango_normal = 440
-            x_position_umbral = 550
 
             # Mostrar el Lóbulo Frontal completo
             grupo = 'Índices del Lóbulo Frontal'
@@ -1562,27 +1309,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
             y_position -= 17
 
-            for region in grupos_regiones_foldind[grupo]:
-                datos = df_foldind[df_foldind['Regiones_ESP'] == region]
-                for _, fila in datos.iterrows():
-                    can.drawString(35, y_position, str(fila['Regiones_ESP']))
-
-                    valor_paciente = f"{float(fila['Valor_Paciente']):.0f}" if not pd.isna(fila['Valor_Paciente']) else "0.00"
-                    z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                    rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-
-                    can.drawString(x_position_valor_paciente, y_position, valor_paciente)
-                    can.drawString(x_position_z_score, y_position, z_score_paciente)
-                    can.drawString(x_position_rango_normal, y_position, rango_normal)
-                    #can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-
-                    can.setFont("ArialUnicode", 9)
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                    can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-                    can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-
-                    y_position -= 20
+            datos = filas_en_orden(df_foldind, 'Regiones_ESP', grupos_regiones_foldind[grupo])
+            y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente', 0), y_position)
 
             # Mostrar el Lóbulo Cingulado completo
             grupo = 'Índices del Lóbulo Cingulado'
@@ -1594,33 +1322,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
             y_position -= 17
 
-            for region in grupos_regiones_foldind[grupo]:
-                datos = df_foldind[df_foldind['Regiones_ESP'] == region]
-                for _, fila in datos.iterrows():
-                    can.drawString(35, y_position, str(fila['Regiones_ESP']))
-
-                    valor_paciente = f"{float(fila['Valor_Paciente']):.0f}" if not pd.isna(fila['Valor_Paciente']) else "0.00"
-                    z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                    rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-
-                    can.drawString(x_position_valor_paciente, y_position, valor_paciente)
-                    can.drawString(x_position_z_score, y_position, z_score_paciente)
-                    can.drawString(x_position_rango_normal, y_position, rango_normal)
-                    #can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-
-                    can.setFont("ArialUnicode", 9)
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                    can.drawString(x_position_umbral, y_position, dentro_de_umbral)
-                    can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-
-                    y_position -= 20
-
-                    if y_position < 20:
-                        can.showPage()
-                        can.setFont("OpenSansLight", 9)
-                        can.setFillColorRGB(0, 0, 0)
-                        y_position = 750
+            datos = filas_en_orden(df_foldind, 'Regiones_ESP', grupos_regiones_foldind[grupo])
+            y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente', 0), y_position, y_minimo=20)
 
 
             # Mostrar el grupo 'Otras Regiones'
@@ -1633,27 +1336,8 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
             y_position -= 17
 
-            for region in grupos_regiones_foldind[grupo]:
-                datos = df_foldind[df_foldind['Regiones_ESP'] == region]
-                for _, fila in datos.iterrows():
-                    can.drawString(35, y_position - 10, str(fila['Regiones_ESP']))
-
-                    valor_paciente = f"{float(fila['Valor_Paciente']):.0f}" if not pd.isna(fila['Valor_Paciente']) else "0.00"
-                    z_score_paciente = f"{float(fila['Z_Score_Paciente']):.2f}" if not pd.isna(fila['Z_Score_Paciente']) else "0.00"
-                    rango_normal = str(fila['Rango normal ajustado por edad según Z scores'])
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-
-                    can.drawString(x_position_valor_paciente, y_position - 10, valor_paciente)
-                    can.drawString(x_position_z_score, y_position - 10, z_score_paciente)
-                    can.drawString(x_position_rango_normal, y_position - 10, rango_normal)
-                    #can.drawString(x_position_umbral, y_position - 10, dentro_de_umbral)
-
-                    can.setFont("ArialUnicode", 9)
-                    dentro_de_umbral = str(fila['Dentro_de_Umbral_±3.5'])
-                    can.drawString(x_position_umbral, y_position - 10, dentro_de_umbral)
-                    can.setFont("OpenSansLight", 9)  # Vuelve a la fuente original
-
-                    y_position -= 20
+            datos = filas_en_orden(df_foldind, 'Regiones_ESP', grupos_regiones_foldind[grupo])
+            y_position = dibujar_tabla(can, datos, columnas_z_score('Valor_Paciente', 0), y_position, dy=-10)
     #----------------------------------------------------------------------------------  
     # Página 12
         elif page_number == 11:
@@ -1796,40 +1480,17 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
             can.setFillColorRGB(0.2, 0.2, 0.2)  # Color
             y_position -= 20
 
-            for _, fila in df_cerebelo.iterrows():
-                    can.drawString(35, y_position, str(fila['Estructura']))
-
-                    volumen = f"{float(fila['Volumen_mm3']):.0f}" if not pd.isna(fila['Volumen_mm3']) else "0.00"
-                    vol_rel = f"{float(fila['Volumen_relativo_%eTIV']):.2f}" if not pd.isna(fila['Volumen_relativo_%eTIV']) else "0.00"
-
-                    can.drawString(x_position_volumen, y_position, volumen)
-                    can.drawString(x_position_vol_rel, y_position, vol_rel)
-
-                    y_position -= 20
+            columnas_cerebelo = [
+                ColumnaTabla('Estructura', 35),
+                ColumnaTabla('Volumen_mm3', x_position_volumen, decimales(0)),
+                ColumnaTabla('Volumen_relativo_%eTIV', x_position_vol_rel, decimales(2)),
+            ]
+            y_position = dibujar_tabla(can, df_cerebelo, columnas_cerebelo, y_position, fuente="OpenSansLight", tamano=10)
         
             # Insertar la imagen de la firma
-            ruta_imagen_firma = '/home/usuario/Bibliografia/pipeline_v2/recursos/firma_suaviz.png'
+            ruta_imagen_firma = recursos.ruta("firma")
             dibujar_imagen_escalada(can, ruta_imagen_firma, 20, 20, factor_escala=0.17)
 
-        can.save()
-        packet.seek(0)
-        return PyPDF2.PdfReader(packet)        
-
-    #---------------------------------------------------------------------------
-    # Añadir contenido a cada página y combinarlo con el template
-    for i in range(num_pages):
-        # Crea contenido para la página actual
-        new_pdf_reader = create_page_content(i)
-        new_pdf_page = new_pdf_reader.pages[0]
-
-        # Obtiene la página correspondiente del PDF de plantilla
-        template_pdf_page = existing_pdf.pages[i]
-
-        # Fusiona la página de plantilla con el nuevo contenido
-        template_pdf_page.merge_page(new_pdf_page)
-
-        # Añade la página combinada al documento final
-        output.add_page(template_pdf_page)
 
     def comprimir_pdf(input_path, output_path):
         gs_command = [
@@ -1839,10 +1500,53 @@ def generate_morphometric_report(dicom_dir, subjects_dir, base_control_path):
         ]
         subprocess.run(gs_command, check=True)
 
-    # Generar y guardar el PDF original
+    #---------------------------------------------------------------------------
+    # Datos e imágenes que dibuja cada página: si no cambian, la página se toma de la caché
+    ruta_recursos = str(recursos.raiz)
+    dependencias_paginas = {
+        0: {"datos": [datos_paciente, os.path.basename(base_control_path)],
+            "archivos": [os.path.join(path_surf, 'sag_thickness.png'), os.path.join(path_surf, 'cor_thickness.png'),
+                         os.path.join(path_surf, 'ax_thickness.png'), os.path.join(ruta_recursos, 'colorbar_thickness.png'),
+                         os.path.join(path_mri, 'mask', 'control_de_calidad.png'),
+                         os.path.join(path_stats, 'comparac_control_pentagono.png'),
+                         os.path.join(path_stats, 'comparac_control_heatmap.png'), os.path.join(path_mri, 'mask', 'mesh.png')]},
+        1: {"datos": [datos_organizados]},
+        2: {"datos": [datos_organizados.get("Volumen de Áreas Corticales"), df_asimetrias],
+            "archivos": [os.path.join(path_mri, 'parcelacion_cortical.png')]},
+        3: {"datos": [df_thickness, grupos_regiones]},
+        4: {"datos": [df_thickness, grupos_regiones]},
+        5: {"datos": [df_thickness, grupos_regiones],
+            "archivos": [os.path.join(path_stats, 'aparc_stats_thickness_Z_score_robusto_plots.png')]},
+        6: {"datos": [df_area, grupos_regiones_area]},
+        7: {"datos": [df_area, grupos_regiones_area]},
+        8: {"datos": [df_area, grupos_regiones_area],
+            "archivos": [os.path.join(path_stats, 'aparc_stats_area_Z_score_robusto_plots.png')]},
+        9: {"datos": [df_foldind, grupos_regiones_foldind]},
+        10: {"datos": [df_foldind, grupos_regiones_foldind]},
+        11: {"archivos": [os.path.join(path_stats, 'aparc_stats_foldind_Z_score_robusto_plots.png')]},
+        12: {"datos": [df_sclimbic, df_sclimbic_zqa_scores, df_sclimbic_confidences, traducciones_regiones_limbic],
+             "archivos": [os.path.join(path_mri, 'sclimbic_3d.png')]},
+        13: {"datos": [df_cerebelo], "archivos": [os.path.join(ruta_recursos, 'firma_suaviz.png')]},
+    }
+    cache = None
+    if usar_cache:
+        cache = CachePaginas(os.path.join(path_stats, '.cache_reporte', 'completo'), template_pdf_path,
+                             archivos_codigo=[__file__])
+
+    #---------------------------------------------------------------------------
+    # Añadir contenido a cada página, combinarlo con el template y guardar el PDF original
     final_pdf_path_original = os.path.join(path_stats, 'Reporte_completo.pdf')
-    with open(final_pdf_path_original, "wb") as outputStream:
-        output.write(outputStream)
+    print("\nTiempo de construcción por página:")
+    if incremental:
+        # Cada página se escribe a disco al terminarla y ghostscript las une (memoria acotada)
+        componer_reporte_incremental(template_pdf_path, create_page_content, num_pages, final_pdf_path_original,
+                                     cache=cache, dependencias_paginas=dependencias_paginas)
+    else:
+        # Un único canvas para todo el reporte: las imágenes repetidas se comparten como un solo XObject
+        componer_reporte(existing_pdf, create_page_content, num_pages, output,
+                         cache=cache, dependencias_paginas=dependencias_paginas)
+        with open(final_pdf_path_original, "wb") as outputStream:
+            output.write(outputStream)
 
     # Imprimir la ruta del archivo original
     print(f"\nArchivo PDF original generado exitosamente en: {final_pdf_path_original}")
@@ -1,7 +1,8 @@
-def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control_path):
+def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control_path, incremental=False):
     
     
-    import pydicom
+    from processing.dicom_utils import encabezado_paciente
+    from processing.recursos import recursos
     from reportlab.pdfgen import canvas
     from reportlab.pdfbase.ttfonts import TTFont
     from reportlab.pdfbase import pdfmetrics
@@ -10,6 +11,8 @@ def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control
     from reportlab.lib.pagesizes import letter
     from reportlab.lib.units import inch
     import PyPDF2
+    from processing.reporte_pdf import componer_reporte, componer_reporte_incremental, dibujar_imagen_escalada as _dibujar_imagen_registrada
+    from processing.reporte_tablas import ColumnaTabla, dibujar_tabla
     import io
     from PIL import Image
     import pandas as pd
@@ -45,13 +48,6 @@ def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control
         mes_texto = meses[mes - 1]
         return f"{dia} - {mes_texto} - {año}"
 
-    def buscar_primer_dicom(dicom_dir):
-        # Buscar archivos DICOM en el directorio dado
-        for root, dirs, files in os.walk(dicom_dir):
-            for file in files:
-                if file.endswith(".dcm"):
-                    return os.path.join(root, file)
-        return None
 
     # Cargar el archivo DICOM
    
@@ -75,27 +71,22 @@ def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control
         raise FileNotFoundError(f"No se encontró la carpeta 'mri' en la ruta calculada: {path_mri}")
     
 
-    dicom_path = buscar_primer_dicom(dicom_dir)
-    if dicom_path:
-        ds = pydicom.dcmread(dicom_path)
-        # Extraer datos del paciente del archivo DICOM
-        datos_paciente = {
-            "Paciente": formatear_nombre(ds.get("PatientName", "Desconocido")),
-            "Edad": formatear_edad(ds.get("PatientAge", "00")),
-            "Sexo": ds.get("PatientSex", "Desconocido"),
-            "Fecha del estudio": formatear_fecha(ds.get("StudyDate", "00000000")),
-            "Accession Number": ds.get("AccessionNumber", "Desconocido"),
-            "Patient ID": ds.get("PatientID", "Desconocido")
-        }
-    else:
-        raise FileNotFoundError(f"No se encontró ningún archivo DICOM en el directorio: {dicom_dir}")
+    # Datos del paciente desde el índice de encabezados del estudio (sin abrir los DICOM)
+    ds = encabezado_paciente(dicom_dir)
+    datos_paciente = {
+        "Paciente": formatear_nombre(ds.get("PatientName", "Desconocido")),
+        "Edad": formatear_edad(ds.get("PatientAge", "00")),
+        "Sexo": ds.get("PatientSex", "Desconocido"),
+        "Fecha del estudio": formatear_fecha(ds.get("StudyDate", "00000000")),
+        "Accession Number": ds.get("AccessionNumber", "Desconocido"),
+        "Patient ID": ds.get("PatientID", "Desconocido")
+    }
 
 
 
     # Registra las fuentes OpenSans Light y OpenSans Bold
-    pdfmetrics.registerFont(TTFont('OpenSansLight', '//home/usuario/Bibliografia/pipeline_v2/recursos/OpenSans-Light.ttf'))
-    pdfmetrics.registerFont(TTFont('OpenSansRegular', '//home/usuario/Bibliografia/pipeline_v2/recursos/OpenSans-Regular.ttf'))
-    pdfmetrics.registerFont(TTFont('ArialUnicode', '//home/usuario/Bibliografia/pipeline_v2/recursos/Arial-Unicode-Regular.ttf'))
+    # Se registran una sola vez por proceso (desde memoria si los recursos están precargados)
+    recursos.registrar_fuentes()
 
     def formatear_porcentaje(num):
         num = float(num)
@@ -138,8 +129,8 @@ def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control
     df_sclimbic_confidences = pd.read_csv(path_csv_limbic_confidences)
 
     # Lee el PDF existente (template) para obtener las dimensiones y número de páginas
-    template_pdf_path = '/home/usuario/Bibliografia/pipeline_v2/recursos/epilepsia PDF Report.pdf'
-    existing_pdf = PyPDF2.PdfReader(open(template_pdf_path, "rb"))
+    template_pdf_path = recursos.ruta("plantilla_epilepsia")
+    existing_pdf = PyPDF2.PdfReader(recursos.origen(template_pdf_path))
     num_pages = len(existing_pdf.pages)
     template_page = existing_pdf.pages[0]
     template_dims = template_page.mediabox
@@ -438,21 +429,12 @@ def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control
 
     # Agregar varias imágenes y modificar su tamaño
     def dibujar_imagen_escalada(canvas, ruta_imagen, x, y, factor_escala):
-        """Carga, escala y dibuja una imagen en el canvas."""
-        imagen = Image.open(ruta_imagen)  #
-        ancho_original, alto_original = imagen.size
-
-        ancho_escalado = ancho_original * factor_escala
-        alto_escalado = alto_original * factor_escala
-
-        canvas.drawImage(ruta_imagen, x, y, width=ancho_escalado, height=alto_escalado)
+        """Escala y dibuja una imagen en el canvas (decodificada una sola vez por el registro compartido)."""
+        _dibujar_imagen_registrada(canvas, ruta_imagen, x, y, factor_escala)
 
     #----------------------------------------------------------------------------------
     # Función para añadir contenido a una página específica
-    def create_page_content(page_number):
-        packet = io.BytesIO()  # io.BytesIO() crea un archivo virtual en memoria. Esto eprmite generar un pdf temporal en memoria sin escribirlo en disco.
-        can = canvas.Canvas(packet, pagesize=(template_dims[2], template_dims[3]))  # canvas.Canvas(...) crea un lienzo en blanco sobre el cual dibujar texto, imágenes y formas.
-        #packet indica que el pdf se genera en el buffer de memori. pagesize define el tamaño de la pagina utilizando el pdf template, edonde template_dims[2] es el ancho y template_dims[3] es el alto.
+    def create_page_content(can, page_number):
 
         # Posiciones iniciales para la escritura de los datos
         x_position = 20
@@ -463,28 +445,6 @@ def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control
         x_position_percentil = 515
 
 
-        # Función para centrar el texto en una columna
-        def centrar_texto(canvas, texto, x_posicion_inicial, ancho_columna, y, fuente, tamano_fuente):
-                """
-                Parámetros:
-
-                canvas → objeto Canvas de ReportLab donde se va a dibujar el texto.
-
-                texto → el string que se quiere escribir.
-
-                x_posicion_inicial → coordenada X del borde izquierdo de la columna.
-
-                ancho_columna → ancho total de la columna (en puntos).
-
-                y → coordenada vertical donde se dibujará el texto.
-
-                fuente → nombre de la fuente usada ("OpenSansLight", "Helvetica", etc.).
-
-                tamano_fuente → tamaño del texto en puntos.
-                """
-                ancho_texto = pdfmetrics.stringWidth(texto, fuente, tamano_fuente)  # pdfmetrics.stringWidth() → función de ReportLab que devuelve el ancho del texto en puntos según la fuente y tamaño especificados.
-                x_centro = x_posicion_inicial + (ancho_columna - ancho_texto) / 2  # calcula el centro de la columna
-                canvas.drawString(x_centro, y, texto)  # escribe el texto en el centro de la columna
 
         #----------------------------------------------------------------------------------
         # Página 1
@@ -594,33 +554,19 @@ def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control
                     y_position -= 20
                     
                     can.setFont("OpenSansLight", 9)
-                    for _, fila in datos.iterrows():
-                        # Centrar el texto de las otras columnas (sin cambios)
-                        centrar_texto(can, str(fila['Volumen_cm3']), (x_position_volumen_cm3), ancho_columna_volumen_cm3, y_position, "OpenSansLight", 10)
-                        centrar_texto(can, str(fila['Rango_normal_ajustado_por_edad_según_%VIT']), x_position_rango_normal, ancho_columna_rango_normal, y_position, "OpenSansLight", 10)
-                        centrar_texto(can, str(fila['Percentil (sujeto)']), x_position_percentil, ancho_columna_rango_normal, y_position, "OpenSansLight", 10)
-
-                        
-                        # Comprobar si la categoría es la de espesores
-                        if categoria == 'Espesores corticales por hemisferio':
-                            texto_volrel = '-'
-                        else:
-                            texto_volrel = str(fila['Volrel% (sujeto)'])
-                        
-                        # Dibujar el texto correspondiente para la columna Volrel
-                        centrar_texto(can, texto_volrel, x_position_volumen_vit, ancho_columna_volumen_vit, y_position, "OpenSansLight", 10)
-
-
-                        # Dibujar el nombre de la región (sin cambios)
-                        can.drawString(x_position_region , y_position, fila['Measure:GrayVol'])
-
-                        y_position -= 20    
-                        if y_position < 50:
-                            # Maneja el cambio de página
-                            can.showPage()
-                            can.setFont("OpenSansLight", 9)
-                            can.setFillColorRGB(0, 0, 0)
-                            y_position = 750
+                    # En los espesores la columna Volrel se completa con '-'
+                    if categoria == 'Espesores corticales por hemisferio':
+                        campo_volrel = lambda d: pd.Series('-', index=d.index)
+                    else:
+                        campo_volrel = 'Volrel% (sujeto)'
+                    columnas = [
+                        ColumnaTabla('Volumen_cm3', (x_position_volumen_cm3), ancho=ancho_columna_volumen_cm3, alineacion="centro", medida=("OpenSansLight", 10)),
+                        ColumnaTabla('Rango_normal_ajustado_por_edad_según_%VIT', x_position_rango_normal, ancho=ancho_columna_rango_normal, alineacion="centro", medida=("OpenSansLight", 10)),
+                        ColumnaTabla('Percentil (sujeto)', x_position_percentil, ancho=ancho_columna_rango_normal, alineacion="centro", medida=("OpenSansLight", 10)),
+                        ColumnaTabla(campo_volrel, x_position_volumen_vit, ancho=ancho_columna_volumen_vit, alineacion="centro", medida=("OpenSansLight", 10)),
+                        ColumnaTabla('Measure:GrayVol', x_position_region),
+                    ]
+                    y_position = dibujar_tabla(can, datos, columnas, y_position, y_minimo=50, tamano=9)
 
 
 
@@ -644,33 +590,19 @@ def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control
                     y_position -= 20
                     
                     can.setFont("OpenSansLight", 9)
-                    for _, fila in datos.iterrows():
-                        # Centrar el texto de las otras columnas (sin cambios)
-                        centrar_texto(can, str(fila['Volumen_cm3']), (x_position_volumen_cm3), ancho_columna_volumen_cm3, y_position, "OpenSansLight", 10)
-                        centrar_texto(can, str(fila['Rango_normal_ajustado_por_edad_según_%VIT']), x_position_rango_normal, ancho_columna_rango_normal, y_position, "OpenSansLight", 10)
-                        centrar_texto(can, str(fila['Percentil (sujeto)']), x_position_percentil, ancho_columna_rango_normal, y_position, "OpenSansLight", 10)
-
-                        
-                        # Comprobar si la categoría es la de espesores
-                        if categoria == 'Espesores corticales por hemisferio':
-                            texto_volrel = '-'
-                        else:
-                            texto_volrel = str(fila['Volrel% (sujeto)'])
-                        
-                        # Dibujar el texto correspondiente para la columna Volrel
-                        centrar_texto(can, texto_volrel, x_position_volumen_vit, ancho_columna_volumen_vit, y_position, "OpenSansLight", 10)
-
-
-                        # Dibujar el nombre de la región (sin cambios)
-                        can.drawString(x_position_region , y_position, fila['Measure:GrayVol'])
-
-                        y_position -= 20    
-                        if y_position < 50:
-                            # Maneja el cambio de página
-                            can.showPage()
-                            can.setFont("OpenSansLight", 9)
-                            can.setFillColorRGB(0, 0, 0)
-                            y_position = 750
+                    # En los espesores la columna Volrel se completa con '-'
+                    if categoria == 'Espesores corticales por hemisferio':
+                        campo_volrel = lambda d: pd.Series('-', index=d.index)
+                    else:
+                        campo_volrel = 'Volrel% (sujeto)'
+                    columnas = [
+                        ColumnaTabla('Volumen_cm3', (x_position_volumen_cm3), ancho=ancho_columna_volumen_cm3, alineacion="centro", medida=("OpenSansLight", 10)),
+                        ColumnaTabla('Rango_normal_ajustado_por_edad_según_%VIT', x_position_rango_normal, ancho=ancho_columna_rango_normal, alineacion="centro", medida=("OpenSansLight", 10)),
+                        ColumnaTabla('Percentil (sujeto)', x_position_percentil, ancho=ancho_columna_rango_normal, alineacion="centro", medida=("OpenSansLight", 10)),
+                        ColumnaTabla(campo_volrel, x_position_volumen_vit, ancho=ancho_columna_volumen_vit, alineacion="centro", medida=("OpenSansLight", 10)),
+                        ColumnaTabla('Measure:GrayVol', x_position_region),
+                    ]
+                    y_position = dibujar_tabla(can, datos, columnas, y_position, y_minimo=50, tamano=9)
             y_position-=20
             #estructuras subcorticales limbicas 
             can.setFont("OpenSansRegular", 11)
@@ -772,44 +704,16 @@ def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control
                     can.setFillColorRGB(0.2, 0.2, 0.2)  # Color 
                     y_position -= 20 
 
-                    for _, fila in datos.iterrows():
-                        # Centrar el texto de las columnas y dibujar
-                        centrar_texto(can, str(fila['Asimetria']), x_position_volumen_cm3+105, 100, y_position, "OpenSansLight", 10)
-                        #centrar_texto(can, str(fila['Mediana']), x_position_volumen_vit, 100, y_position, "OpenSansLight", 10)
-                        centrar_texto(can, str(fila['Rango_normal_ajustado_por_edad_según_AIP']), x_position_rango_normal-5, 100, y_position, "OpenSansLight", 10)
-
-                        can.drawString(x_position_region +5, y_position, fila['Measure:GrayVol'])
-
-                        y_position -= 20    
-                        if y_position < 15:
-                            # Maneja el cambio de página
-                            can.showPage()
-                            can.setFont("OpenSansLight", 9)
-                            can.setFillColorRGB(0, 0, 0)
-                            y_position = 750
+                    columnas = [
+                        ColumnaTabla('Asimetria', x_position_volumen_cm3+105, ancho=100, alineacion="centro", medida=("OpenSansLight", 10)),
+                        ColumnaTabla('Rango_normal_ajustado_por_edad_según_AIP', x_position_rango_normal-5, ancho=100, alineacion="centro", medida=("OpenSansLight", 10)),
+                        ColumnaTabla('Measure:GrayVol', x_position_region +5),
+                    ]
+                    y_position = dibujar_tabla(can, datos, columnas, y_position, y_minimo=15, tamano=9)
 
                     y_position -= 20
 
         #-----------------------------------------------------------------------------------
-        can.save()
-        packet.seek(0)
-        return PyPDF2.PdfReader(packet)
-
-    #---------------------------------------------------------------------------
-    # Añadir contenido a cada página y combinarlo con el template
-    for i in range(num_pages):
-        # Crea contenido para la página actual
-        new_pdf_reader = create_page_content(i)
-        new_pdf_page = new_pdf_reader.pages[0]
-
-        # Obtiene la página correspondiente del PDF de plantilla
-        template_pdf_page = existing_pdf.pages[i]
-
-        # Fusiona la página de plantilla con el nuevo contenido
-        template_pdf_page.merge_page(new_pdf_page)
-
-        # Añade la página combinada al documento final
-        output.add_page(template_pdf_page)
 
     def comprimir_pdf(input_path, output_path):
         gs_command = [
@@ -819,10 +723,18 @@ def generate_morphometric_report_epilepsia(dicom_dir, subjects_dir, base_control
         ]
         subprocess.run(gs_command, check=True)
 
-    # Generar y guardar el PDF original
+    #---------------------------------------------------------------------------
+    # Añadir contenido a cada página, combinarlo con el template y guardar el PDF original
     final_pdf_path_original = os.path.join(path_stats, 'Reporte_epilepsia.pdf')
-    with open(final_pdf_path_original, "wb") as outputStream:
-        output.write(outputStream)
+    print("\nTiempo de construcción por página:")
+    if incremental:
+        # Cada página se escribe a disco al terminarla y ghostscript las une (memoria acotada)
+        componer_reporte_incremental(template_pdf_path, create_page_content, num_pages, final_pdf_path_original)
+    else:
+        # Un único canvas para todo el reporte: las imágenes repetidas se comparten como un solo XObject
+        componer_reporte(existing_pdf, create_page_content, num_pages, output)
+        with open(final_pdf_path_original, "wb") as outputStream:
+            output.write(outputStream)
 
     # Imprimir la ruta del archivo original
     print(f"\nArchivo PDF original generado exitosamente en: {final_pdf_path_original}")
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import glob
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import PyPDF2
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas as rl_canvas
+
+
+# ------------------------------------------------------------------------------
+# Registro de imágenes
+# ------------------------------------------------------------------------------
+class RegistroImagenes:
+    """
+    Registro de imágenes compartido por las páginas y los reportes de un mismo paciente.
+
+    Cada archivo se abre y se decodifica una sola vez (clave: ruta absoluta, mtime y tamaño)
+    y se reutiliza el mismo ImageReader en cada drawImage. ReportLab identifica la imagen por
+    su contenido, por lo que dentro de un canvas se emite un único XObject por imagen.
+    """
+
+    def __init__(self):
+        self._lectores = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _clave(ruta_imagen):
+        ruta = os.path.abspath(str(ruta_imagen))
+        st = os.stat(ruta)
+        return ruta, st.st_mtime_ns, st.st_size
+
+    def lector(self, ruta_imagen):
+        """Devuelve el ImageReader cacheado de la imagen (lo crea la primera vez)."""
+        clave = self._clave(ruta_imagen)
+        with self._lock:
+            lector = self._lectores.get(clave)
+            if lector is None:
+                # Si el archivo cambió en disco se descarta la versión anterior
+                for vieja in [c for c in self._lectores if c[0] == clave[0]]:
+                    del self._lectores[vieja]
+                lector = ImageReader(clave[0])
+                self._lectores[clave] = lector
+        return lector
+
+    def dimensiones(self, ruta_imagen):
+        """Devuelve (ancho, alto) en píxeles sin volver a abrir el archivo."""
+        return self.lector(ruta_imagen).getSize()
+
+    def limpiar(self):
+        """Libera las imágenes decodificadas (p. ej. al terminar los reportes de un paciente)."""
+        with self._lock:
+            self._lectores.clear()
+
+
+# Instancia compartida por los cuatro reportes del mismo proceso
+registro_imagenes = RegistroImagenes()
+
+
+def dibujar_imagen_escalada(canvas, ruta_imagen, x, y, factor_escala, registro=None):
+    """Escala y dibuja una imagen en el canvas usando el registro de imágenes."""
+    registro = registro or registro_imagenes
+    lector = registro.lector(ruta_imagen)
+    ancho_original, alto_original = lector.getSize()
+
+    ancho_escalado = ancho_original * factor_escala
+    alto_escalado = alto_original * factor_escala
+
+    canvas.drawImage(lector, x, y, width=ancho_escalado, height=alto_escalado)
+
+
+# ------------------------------------------------------------------------------
+# Caché de superposiciones por página
+# ------------------------------------------------------------------------------
+def _actualizar_huella(hasher, valor):
+    """Agrega al hash una representación estable de los datos que dibuja una página."""
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        hasher.update(repr(list(valor.columns) if isinstance(valor, pd.DataFrame) else valor.name).encode())
+        hasher.update(pd.util.hash_pandas_object(valor, index=True).to_numpy().tobytes())
+    elif isinstance(valor, dict):
+        for clave in sorted(valor, key=repr):
+            _actualizar_huella(hasher, clave)
+            _actualizar_huella(hasher, valor[clave])
+    elif isinstance(valor, (list, tuple)):
+        for elemento in valor:
+            _actualizar_huella(hasher, elemento)
+    elif isinstance(valor, np.ndarray):
+        hasher.update(valor.tobytes())
+    else:
+        hasher.update(repr(valor).encode())
+    hasher.update(b"|")
+
+
+class CachePaginas:
+    """
+    Caché en disco de la superposición (contenido dibujado con ReportLab) de cada página.
+
+    La clave de una página combina: los archivos de código del reporte, la página de plantilla,
+    los datos que dibuja (DataFrames, dicts, valores) y la huella (ruta, tamaño, mtime) de los
+    archivos que incrusta (imágenes, CSV). Si nada de eso cambió, la superposición guardada se
+    vuelve a fusionar con la plantilla sin ejecutar create_page_content.
+    """
+
+    def __init__(self, directorio, template_pdf_path, archivos_codigo=()):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+        base = hashlib.sha256()
+        # El código de composición y del motor de tablas también forma parte de la clave
+        codigo_comun = [__file__, os.path.join(os.path.dirname(os.path.abspath(__file__)), "reporte_tablas.py")]
+        for ruta in [template_pdf_path, *archivos_codigo, *codigo_comun]:
+            with open(ruta, "rb") as f:
+                base.update(hashlib.sha256(f.read()).digest())
+        self._base = base.digest()
+
+    def clave(self, page_number, datos=(), archivos=()):
+        hasher = hashlib.sha256(self._base)
+        _actualizar_huella(hasher, page_number)
+        _actualizar_huella(hasher, datos)
+        for ruta in archivos:
+            st = os.stat(ruta)
+            _actualizar_huella(hasher, (os.path.abspath(ruta), st.st_size, st.st_mtime_ns))
+        return f"pagina_{page_number:03d}_{hasher.hexdigest()[:32]}"
+
+    def ruta(self, clave):
+        return os.path.join(self.directorio, f"{clave}.pdf")
+
+    def obtener(self, clave):
+        """Ruta de la superposición cacheada o None si no existe."""
+        ruta = self.ruta(clave)
+        return ruta if os.path.exists(ruta) else None
+
+    def guardar(self, clave, pagina_superposicion):
+        """Guarda la superposición de la página y descarta las versiones anteriores de esa página."""
+        prefijo = clave.rsplit("_", 1)[0]
+        for vieja in glob.glob(os.path.join(self.directorio, f"{prefijo}_*.pdf")):
+            os.remove(vieja)
+        escritor = PyPDF2.PdfWriter()
+        escritor.add_page(pagina_superposicion)
+        ruta_tmp = self.ruta(clave) + ".tmp"
+        with open(ruta_tmp, "wb") as f:
+            escritor.write(f)
+        os.replace(ruta_tmp, self.ruta(clave))
+
+
+def _claves_cache(cache, dependencias_paginas, num_pages):
+    """Clave de caché de cada página (None para las páginas sin dependencias declaradas)."""
+    if cache is None or not dependencias_paginas:
+        return [None] * num_pages
+    return [cache.clave(n, **dependencias_paginas[n]) if n in dependencias_paginas else None
+            for n in range(num_pages)]
+
+
+# ------------------------------------------------------------------------------
+# Composición de páginas sobre la plantilla
+# ------------------------------------------------------------------------------
+def informar_tiempos_paginas(tiempos):
+    """Imprime el tiempo de construcción de cada página y el total."""
+    for page_number, segundos in tiempos:
+        print(f"  Página {page_number + 1}: {segundos:.2f} s")
+    print(f"  Total: {sum(segundos for _, segundos in tiempos):.2f} s")
+
+
+def componer_reporte(existing_pdf, create_page_content, num_pages, output, cache=None, dependencias_paginas=None):
+    """
+    Dibuja el contenido de todas las páginas en un único canvas y lo fusiona con la plantilla.
+
+    Al usar un solo documento de ReportLab, las imágenes repetidas entre páginas se comparten
+    como un mismo XObject. create_page_content(can, page_number) dibuja sobre el canvas recibido;
+    si una página desborda (can.showPage() interno) sólo se fusiona su primera hoja, igual que antes.
+
+    Con un CachePaginas y dependencias_paginas ({page_number: {"datos": ..., "archivos": ...}}),
+    las páginas cuyos datos no cambiaron se toman de la caché y no se vuelven a dibujar.
+    """
+    claves = _claves_cache(cache, dependencias_paginas, num_pages)
+    cacheadas = {n: cache.obtener(clave) for n, clave in enumerate(claves) if clave and cache.obtener(clave)}
+
+    primera_hoja = {}
+    tiempos = []
+    superposicion = None
+    if len(cacheadas) < num_pages:
+        template_dims = existing_pdf.pages[0].mediabox
+        packet = io.BytesIO()
+        can = rl_canvas.Canvas(packet, pagesize=(template_dims[2], template_dims[3]))
+        for page_number in range(num_pages):
+            if page_number in cacheadas:
+                continue
+            inicio = time.perf_counter()
+            primera_hoja[page_number] = can.getPageNumber() - 1
+            create_page_content(can, page_number)
+            can.showPage()
+            tiempos.append((page_number, time.perf_counter() - inicio))
+        can.save()
+        packet.seek(0)
+        superposicion = PyPDF2.PdfReader(packet)
+
+    for page_number in range(num_pages):
+        if page_number in cacheadas:
+            pagina_superposicion = PyPDF2.PdfReader(cacheadas[page_number]).pages[0]
+        else:
+            pagina_superposicion = superposicion.pages[primera_hoja[page_number]]
+            if claves[page_number]:
+                cache.guardar(claves[page_number], pagina_superposicion)
+        # Fusiona la página de plantilla con el nuevo contenido y la añade al documento final
+        template_pdf_page = existing_pdf.pages[page_number]
+        template_pdf_page.merge_page(pagina_superposicion)
+        output.add_page(template_pdf_page)
+
+    if cacheadas:
+        print(f"  Páginas tomadas de la caché: {', '.join(str(n + 1) for n in sorted(cacheadas))}")
+    informar_tiempos_paginas(tiempos)
+    return output
+
+
+def _concatenar_paginas(rutas_paginas, ruta_salida):
+    """Une los PDF de una página en ruta_salida con ghostscript, que los lee de a uno."""
+    ruta_tmp = f"{ruta_salida}.tmp"
+    subprocess.run(["gs", "-sDEVICE=pdfwrite", "-dNOPAUSE", "-dQUIET", "-dBATCH", "-dAutoRotatePages=/None",
+                    f"-sOutputFile={ruta_tmp}", *rutas_paginas], check=True)
+    os.replace(ruta_tmp, ruta_salida)
+
+
+def componer_reporte_incremental(template_pdf_path, create_page_content, num_pages, ruta_salida,
+                                 cache=None, dependencias_paginas=None):
+    """
+    Variante de componer_reporte con memoria acotada a una página: cada página se dibuja en su
+    propio canvas, se fusiona con su página de plantilla y se escribe en
+    <ruta_salida>.paginas/NNN.pdf con un PdfWriter propio que se descarta enseguida. Al final
+    ghostscript une las páginas en ruta_salida (las lee de a una) y se borra la carpeta.
+
+    La plantilla se lee de disco una sola vez; cada página usa un lector nuevo sobre esos bytes,
+    así la página fusionada no queda retenida en la caché de páginas de un lector compartido.
+
+    A diferencia del modo en memoria, las imágenes repetidas en varias páginas se incrustan una vez
+    por página (el paso de compresión con ghostscript vuelve a unificarlas).
+    Admite la misma caché de páginas que componer_reporte.
+    Devuelve la lista de (page_number, segundos) de cada página dibujada.
+    """
+    claves = _claves_cache(cache, dependencias_paginas, num_pages)
+    tiempos = []
+    with open(template_pdf_path, "rb") as f_template:
+        plantilla = f_template.read()
+    directorio_paginas = f"{ruta_salida}.paginas"
+    shutil.rmtree(directorio_paginas, ignore_errors=True)
+    os.makedirs(directorio_paginas)
+    try:
+        rutas_paginas = []
+        for page_number in range(num_pages):
+            inicio = time.perf_counter()
+            template_pdf_page = PyPDF2.PdfReader(io.BytesIO(plantilla)).pages[page_number]
+            ruta_cacheada = cache.obtener(claves[page_number]) if claves[page_number] else None
+            if ruta_cacheada:
+                pagina_superposicion = PyPDF2.PdfReader(ruta_cacheada).pages[0]
+            else:
+                template_dims = template_pdf_page.mediabox
+                packet = io.BytesIO()
+                can = rl_canvas.Canvas(packet, pagesize=(template_dims[2], template_dims[3]))
+                create_page_content(can, page_number)
+                can.showPage()
+                can.save()
+                del can
+                packet.seek(0)
+                # Sólo se fusiona la primera hoja de la página, igual que en componer_reporte
+                pagina_superposicion = PyPDF2.PdfReader(packet).pages[0]
+                if claves[page_number]:
+                    cache.guardar(claves[page_number], pagina_superposicion)
+
+            template_pdf_page.merge_page(pagina_superposicion)
+            pagina = PyPDF2.PdfWriter()
+            pagina.add_page(template_pdf_page)
+            ruta_pagina = os.path.join(directorio_paginas, f"{page_number:03d}.pdf")
+            with open(ruta_pagina, "wb") as f_pagina:
+                pagina.write(f_pagina)
+            rutas_paginas.append(ruta_pagina)
+            # Nada de la página queda en memoria al pasar a la siguiente
+            del pagina, template_pdf_page, pagina_superposicion
+            if not ruta_cacheada:
+                tiempos.append((page_number, time.perf_counter() - inicio))
+
+        _concatenar_paginas(rutas_paginas, ruta_salida)
+    finally:
+        shutil.rmtree(directorio_paginas, ignore_errors=True)
+
+    informar_tiempos_paginas(tiempos)
+    return tiempos
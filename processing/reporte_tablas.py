@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from reportlab.pdfbase import pdfmetrics
+
+
+# ------------------------------------------------------------------------------
+# Especificación de columnas
+# ------------------------------------------------------------------------------
+# campo      -> columna del DataFrame (o función fila_df -> Serie para columnas derivadas)
+# x          -> posición X del borde izquierdo de la columna
+# formato    -> función Serie -> Serie de str (None: str())
+# fuente     -> fuente con la que se dibuja (None: la fuente base de la tabla)
+# tamano     -> tamaño de la fuente con la que se dibuja
+# ancho      -> ancho de la columna (requerido para 'centro' y 'derecha')
+# alineacion -> 'izquierda' | 'centro' | 'derecha'
+# medida     -> (fuente, tamaño) usados para medir el texto al alinear, si difieren del dibujo
+ColumnaTabla = namedtuple(
+    "ColumnaTabla",
+    ["campo", "x", "formato", "fuente", "tamano", "ancho", "alineacion", "medida"],
+    defaults=(None, None, None, None, "izquierda", None),
+)
+
+# Plan de dibujo ya calculado: hoja relativa de cada fila y operaciones por columna
+PlanTabla = namedtuple("PlanTabla", ["hojas", "operaciones", "y_final", "salto_final"])
+
+
+def decimales(n, vacio="0.00"):
+    """Formateador vectorizado: número con n decimales; vacío/no numérico -> 'vacio'."""
+    def _formatear(serie):
+        valores = pd.to_numeric(serie, errors="coerce")
+        textos = valores.map(("{:.%df}" % n).format)
+        return textos.where(valores.notna(), vacio)
+    return _formatear
+
+
+def filas_en_orden(df, columna, orden):
+    """
+    Devuelve las filas de df cuyo valor en 'columna' está en 'orden', ordenadas según esa lista
+    (equivalente a concatenar df[df[columna] == valor] para cada valor, sin recorrerlo por valor).
+    Un valor repetido en 'orden' repite sus filas, igual que la concatenación.
+    """
+    pedidos = pd.DataFrame({"valor": list(orden), "posicion": np.arange(len(orden))})
+    pedidos = pedidos[pedidos["valor"].notna()]  # df[columna] == NaN nunca coincide
+    filas = pd.DataFrame({"valor": df[columna].to_numpy(), "fila": np.arange(len(df))})
+    pares = pedidos.merge(filas, on="valor", how="inner").sort_values(["posicion", "fila"], kind="stable")
+    return df.iloc[pares["fila"].to_numpy()]
+
+
+# ------------------------------------------------------------------------------
+# Cálculo de posiciones
+# ------------------------------------------------------------------------------
+def _capacidad(y_actual, interlineado, y_minimo):
+    """Filas que entran en la hoja antes de que 'y' quede por debajo de y_minimo (al menos una)."""
+    return max(1, int(np.floor((y_actual - y_minimo) / interlineado)) + 1)
+
+
+def _posiciones_filas(n, y_inicial, interlineado, y_minimo, y_reinicio):
+    """
+    Reproduce el patrón 'dibujar fila; y -= interlineado; si y < y_minimo: showPage(); y = y_reinicio'
+    calculando de una vez la hoja y la coordenada Y de cada fila.
+    """
+    hojas = np.zeros(n, dtype=int)
+    ys = np.empty(n, dtype=float)
+    inicio, hoja, y_actual, salto_final = 0, 0, float(y_inicial), False
+    while inicio < n:
+        capacidad = n - inicio if y_minimo is None else _capacidad(y_actual, interlineado, y_minimo)
+        fin = min(n, inicio + capacidad)
+        ys[inicio:fin] = y_actual - interlineado * np.arange(fin - inicio)
+        hojas[inicio:fin] = hoja
+        y_actual -= interlineado * (fin - inicio)
+        salto_final = y_minimo is not None and y_actual < y_minimo
+        if salto_final:
+            hoja += 1
+            y_actual = float(y_reinicio)
+        inicio = fin
+    if n == 0:
+        y_actual = float(y_inicial)
+    return hojas, ys, y_actual, salto_final
+
+
+def _textos_columna(datos, columna):
+    serie = columna.campo(datos) if callable(columna.campo) else datos[columna.campo]
+    if columna.formato is not None:
+        serie = columna.formato(serie)
+    return serie.astype(str)
+
+
+def _anchos(textos, fuente, tamano):
+    """Ancho de cada texto; cada cadena distinta se mide una sola vez."""
+    unicos = pd.unique(textos.to_numpy())
+    medidas = {t: pdfmetrics.stringWidth(t, fuente, tamano) for t in unicos}
+    return textos.map(medidas).to_numpy(dtype=float)
+
+
+def preparar_tabla(datos, columnas, y_inicial, *, interlineado=20, y_minimo=None, y_reinicio=750,
+                   dy=0, cortar=False, fuente="OpenSansLight", tamano=9):
+    """
+    Calcula (sin dibujar) textos, anchos y posiciones de todas las celdas de la tabla.
+    'dy' desplaza la Y de dibujo respecto de la Y de control usada para el salto de página.
+    Con cortar=True la tabla se trunca al llegar a y_minimo (el 'break' de los bucles originales)
+    en lugar de continuar en una hoja nueva.
+    """
+    if cortar and y_minimo is not None:
+        datos = datos.iloc[:_capacidad(float(y_inicial), interlineado, y_minimo)]
+        y_minimo = None
+    hojas, ys, y_final, salto_final = _posiciones_filas(len(datos), y_inicial, interlineado,
+                                                         y_minimo, y_reinicio)
+    operaciones = []
+    for columna in columnas:
+        fuente_col = columna.fuente or fuente
+        tamano_col = columna.tamano or tamano
+        textos = _textos_columna(datos, columna)
+        xs = np.full(len(textos), float(columna.x))
+        if columna.alineacion != "izquierda":
+            fuente_medida, tamano_medida = columna.medida or (fuente_col, tamano_col)
+            libre = columna.ancho - _anchos(textos, fuente_medida, tamano_medida)
+            xs += libre / 2 if columna.alineacion == "centro" else libre
+        operaciones.append((fuente_col, tamano_col, xs, ys + dy, textos.to_numpy()))
+    return PlanTabla(hojas, operaciones, y_final, salto_final)
+
+
+# ------------------------------------------------------------------------------
+# Dibujo
+# ------------------------------------------------------------------------------
+def emitir_tabla(can, plan, *, fuente="OpenSansLight", tamano=9, color_salto=(0, 0, 0)):
+    """
+    Emite el plan sobre el canvas: un único objeto de texto por hoja en lugar de un drawString
+    (bloque BT/ET) por celda. Los saltos de página se hacen igual que en los bucles originales.
+    """
+    n_hojas = int(plan.hojas.max()) + 1 if len(plan.hojas) else 0
+    for hoja in range(n_hojas):
+        if hoja > 0:
+            can.showPage()
+            can.setFont(fuente, tamano)
+            can.setFillColorRGB(*color_salto)
+        en_hoja = plan.hojas == hoja
+        texto = can.beginText()
+        for fuente_col, tamano_col, xs, ys, textos in plan.operaciones:
+            texto.setFont(fuente_col, tamano_col)
+            for x, y, t in zip(xs[en_hoja], ys[en_hoja], textos[en_hoja]):
+                texto.setTextOrigin(x, y)
+                texto.textOut(t)
+        can.drawText(texto)
+    if plan.salto_final:
+        can.showPage()
+        can.setFillColorRGB(*color_salto)
+    # Deja el canvas en la fuente base de la tabla, como hacían los bucles originales
+    can.setFont(fuente, tamano)
+    return plan.y_final
+
+
+def dibujar_tabla(can, datos, columnas, y_inicial, *, interlineado=20, y_minimo=None, y_reinicio=750,
+                  dy=0, cortar=False, fuente="OpenSansLight", tamano=9, color_salto=(0, 0, 0)):
+    """
+    Dibuja un DataFrame como tabla a partir de una lista de ColumnaTabla y devuelve la Y final
+    (la misma que dejaban los bucles 'for _, fila in datos.iterrows()' que reemplaza).
+    """
+    plan = preparar_tabla(datos, columnas, y_inicial, interlineado=interlineado, y_minimo=y_minimo,
+                          y_reinicio=y_reinicio, dy=dy, cortar=cortar, fuente=fuente, tamano=tamano)
+    return emitir_tabla(can, plan, fuente=fuente, tamano=tamano, color_salto=color_salto)
+
+
+# ------------------------------------------------------------------------------
+# Benchmark de regresión
+# ------------------------------------------------------------------------------
+def benchmark_tablas(n_filas=2000, repeticiones=5):
+    """
+    Compara el dibujo fila a fila (iterrows + drawString) con el motor de tablas sobre datos
+    sintéticos con la fuente estándar Helvetica. Devuelve los tiempos medios en segundos.
+    """
+    import io
+    from reportlab.pdfgen import canvas
+
+    rng = np.random.default_rng(0)
+    datos = pd.DataFrame({
+        "Regiones_ESP": [f"Región {i}" for i in range(n_filas)],
+        "Valor": rng.normal(2.5, 0.3, n_filas),
+        "Z": rng.normal(0, 1, n_filas),
+        "Rango": ["-2.58 - 2.58"] * n_filas,
+    })
+    columnas = [
+        ColumnaTabla("Regiones_ESP", 35),
+        ColumnaTabla("Valor", 323, formato=decimales(2), ancho=40, alineacion="centro"),
+        ColumnaTabla("Z", 368, formato=decimales(2)),
+        ColumnaTabla("Rango", 440),
+    ]
+
+    def por_filas():
+        can = canvas.Canvas(io.BytesIO())
+        can.setFont("Helvetica", 9)
+        y = 780
+        for _, fila in datos.iterrows():
+            can.drawString(35, y, str(fila["Regiones_ESP"]))
+            valor = f"{float(fila['Valor']):.2f}"
+            ancho = pdfmetrics.stringWidth(valor, "Helvetica", 9)
+            can.drawString(323 + (40 - ancho) / 2, y, valor)
+            can.drawString(368, y, f"{float(fila['Z']):.2f}")
+            can.drawString(440, y, str(fila["Rango"]))
+            y -= 20
+            if y < 50:
+                can.showPage()
+                can.setFont("Helvetica", 9)
+                y = 750
+        can.save()
+
+    def con_motor():
+        can = canvas.Canvas(io.BytesIO())
+        can.setFont("Helvetica", 9)
+        dibujar_tabla(can, datos, columnas, 780, y_minimo=50, fuente="Helvetica", tamano=9)
+        can.save()
+
+    tiempos = {}
+    for nombre, funcion in (("iterrows", por_filas), ("motor", con_motor)):
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            funcion()
+        tiempos[nombre] = (time.perf_counter() - inicio) / repeticiones
+    return tiempos
+
+
+if __name__ == "__main__":
+    resultados = benchmark_tablas()
+    for nombre, segundos in resultados.items():
+        print(f"{nombre:>9}: {segundos * 1000:.1f} ms")
+    print(f"Aceleración: x{resultados['iterrows'] / resultados['motor']:.1f}")
@@ -37,14 +37,15 @@ import numpy as np
 import pandas as pd
 from typing import Dict, List, Tuple, Optional
 from openpyxl.styles import NamedStyle, Font, PatternFill
+from processing.recursos import recursos
 
 # ------------------------------- Helpers de parsing y normalización -------------------------------
 def seleccionar_base_control_especificos(edad, genero):
     """
     Selecciona automáticamente la base de datos control según la edad y el género.
     """
-    # Ruta absoluta al directorio que contiene las bases de datos
-    base_dir = "/home/usuario/Bibliografia/pipeline_v2/recursos/morfo_cerebral/especificos/"
+    # Directorio que contiene las bases de datos (ver processing/recursos.py)
+    base_dir = recursos.directorio("normativa_especificos")
 
     if edad <= 18:
         grupo = "18_29"
@@ -478,7 +479,7 @@ def _build_comparison_table(
     df_subj["Volrel% (sujeto)"] = df_subj.apply(_calc_volrel, axis=1)
 
     # ============ Cargar base control y unir ============
-    df_ctrl = pd.read_excel(base_control_path, sheet_name="metricas", engine="openpyxl")
+    df_ctrl = pd.read_excel(recursos.origen(base_control_path), sheet_name="metricas", engine="openpyxl")
 
     # Normalizar llaves para merge robusto
     df_ctrl["_key"] = df_ctrl["Measure:GrayVol"].map(_normalize_key)
@@ -664,7 +665,7 @@ def _build_asymmetry_table(
     df_li = pd.DataFrame(li_rows, columns=["Measure:GrayVol","LI% (Volrel)"])
 
     # Unir con hoja Asimetrias (base)
-    df_ref = pd.read_excel(base_control_path, sheet_name="Asimetrias", engine="openpyxl")
+    df_ref = pd.read_excel(recursos.origen(base_control_path), sheet_name="Asimetrias", engine="openpyxl")
     need_cols = ["Measure:GrayVol","Mediana","IC_95%_Bajo","IC_95%_Alto","IC_99%_Bajo","IC_99%_Alto","rango normal"]
     miss = [c for c in need_cols if c not in df_ref.columns]
     if miss:
@@ -9,6 +9,7 @@ import math
 import pandas as pd
 from openpyxl import Workbook
 from openpyxl.styles import Font, NamedStyle, PatternFill
+from processing.recursos import recursos
 
 
 # Traducciones de regiones
@@ -119,8 +120,8 @@ def seleccionar_base_control(edad, genero):
     """
     Selecciona automáticamente la base de datos control según la edad y el género.
     """
-    # Ruta absoluta al directorio que contiene las bases de datos
-    base_dir = "/home/usuario/Bibliografia/pipeline_v2/recursos/morfo_cerebral/volumen/"
+    # Directorio que contiene las bases de datos (ver processing/recursos.py)
+    base_dir = recursos.directorio("normativa_volumen")
 
     if edad <= 18:
         grupo = "18_29"
@@ -172,7 +173,7 @@ def calcular_asimetrias_pares(df_final, base_control_path):
     Extrae los IC_99% de la hoja 'Asimetrias' del archivo base de datos.
     """
     # Leer la hoja 'Asimetrias' del archivo base de datos
-    df_asimetrias_estadisticas = pd.read_excel(base_control_path, sheet_name='Asimetrias', engine='openpyxl')
+    df_asimetrias_estadisticas = pd.read_excel(recursos.origen(base_control_path), sheet_name='Asimetrias', engine='openpyxl')
 
     # Crear DataFrame con columnas correctas
     resultados_asimetria = pd.DataFrame(columns=['Region', 'Asimetria', 'IC_99%_Bajo', 'IC_99%_Alto', 'Rango_normal_ajustado_por_edad_según_AIP'])
@@ -225,7 +226,7 @@ def procesar_volumenes(stats_folder, base_control_path):
                                    names=['Measure:volume', 'Volumen_cm3'], skiprows=1)
     df_volumenes_porcentaje = pd.read_csv(file_path_volumenes_porcentaje, sep='\t', header=None,
                                           names=['Measure:volume', 'Volumen_%VIT'], skiprows=1)
-    df_control = pd.read_excel(base_control_path, sheet_name='Bootstrap_Results', engine='openpyxl')
+    df_control = pd.read_excel(recursos.origen(base_control_path), sheet_name='Bootstrap_Results', engine='openpyxl')
 
     # Truncar IC_99% y IC_95% valores a dos decimales
     for column in ['IC_99%_Bajo', 'IC_99%_Alto', 'IC_95%_Bajo', 'IC_95%_Alto']:
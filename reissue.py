@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Re-emisión de reportes PDF a partir de los resultados ya calculados.
+
+Regenera únicamente los reportes (reporte_completo, reporte_general, reporte_epilepsia y
+reporte_pediatrico) de una lista de estudios usando los stats/*.xlsx, CSV y PNG existentes,
+sin volver a correr FastSurfer, máscaras, capturas ni análisis. Los estudios se procesan en
+paralelo y los que no tienen todas las entradas necesarias se omiten.
+
+Ejemplos:
+    python reissue.py /datos/estudio_1 /datos/estudio_2
+    python reissue.py --lista estudios.txt --workers 8 --reportes completo general
+"""
+
+import os
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from processing.entradas_reportes import ENTRADAS_REPORTES
+
+
+def resolver_directorios(ruta_estudio):
+    """
+    Acepta el directorio DICOM del estudio (con la carpeta FastSurfer adentro, como --dicom_dir
+    en main_local.py) o directamente la carpeta FastSurfer. Devuelve (dicom_dir, subjects_dir).
+    """
+    ruta_estudio = os.path.abspath(ruta_estudio.rstrip(os.sep))
+    if os.path.isdir(os.path.join(ruta_estudio, "stats")):
+        return os.path.dirname(ruta_estudio), ruta_estudio
+    return ruta_estudio, os.path.join(ruta_estudio, "FastSurfer")
+
+
+def entradas_faltantes(dicom_dir, subjects_dir, reportes):
+    """Lista las entradas necesarias para los reportes pedidos que no existen en disco."""
+    faltantes = []
+    for reporte in reportes:
+        for entrada in ENTRADAS_REPORTES[reporte]:
+            if entrada.startswith("dicom:"):
+                ruta = os.path.join(dicom_dir, entrada[len("dicom:"):])
+            else:
+                ruta = os.path.join(subjects_dir, entrada)
+            if not os.path.exists(ruta) and ruta not in faltantes:
+                faltantes.append(ruta)
+    return faltantes
+
+
+def reemitir_estudio(ruta_estudio, reportes, incremental=False):
+    """
+    Regenera los reportes pedidos de un estudio. Se ejecuta en un proceso del pool.
+    Devuelve un diccionario con el estado ('ok', 'omitido' o 'error'), el detalle y la duración.
+    """
+    from processing.dicom_utils import leer_dicom_y_extraer_info
+    from processing.volumetric_analysis import seleccionar_base_control
+    from processing.reporte_completo import generate_morphometric_report
+    from processing.reporte_general import generate_morphometric_report_general
+    from processing.reporte_epilepsia import generate_morphometric_report_epilepsia
+    from processing.reporte_pediatrico import generate_morphometric_report_pediatrico
+    from processing.reporte_pdf import registro_imagenes
+
+    generadores = {
+        "completo": generate_morphometric_report,
+        "general": generate_morphometric_report_general,
+        "epilepsia": generate_morphometric_report_epilepsia,
+        "pediatrico": generate_morphometric_report_pediatrico,
+    }
+
+    inicio = time.perf_counter()
+    dicom_dir, subjects_dir = resolver_directorios(ruta_estudio)
+    faltantes = entradas_faltantes(dicom_dir, subjects_dir, reportes)
+    if faltantes:
+        return {"estudio": ruta_estudio, "estado": "omitido",
+                "detalle": f"{len(faltantes)} entradas faltantes (p. ej. {faltantes[0]})",
+                "segundos": time.perf_counter() - inicio}
+
+    try:
+        # La base de control sólo se usa para rotular el reporte; se vuelve a elegir como en main_local.py
+        paciente_info = leer_dicom_y_extraer_info(dicom_dir)
+        edad = int(paciente_info["edad"].split()[0])
+        base_control_path = seleccionar_base_control(edad, paciente_info["género"])
+
+        for reporte in reportes:
+            generadores[reporte](dicom_dir, subjects_dir, base_control_path, incremental=incremental)
+        estado, detalle = "ok", ", ".join(reportes)
+    except Exception as e:
+        estado, detalle = "error", f"{e}\n{traceback.format_exc()}"
+    finally:
+        registro_imagenes.limpiar()
+
+    return {"estudio": ruta_estudio, "estado": estado, "detalle": detalle,
+            "segundos": time.perf_counter() - inicio}
+
+
+def leer_lista_estudios(ruta_lista):
+    """Lee un .txt con un directorio por línea (ignora líneas vacías y comentarios '#')."""
+    with open(ruta_lista, "r", encoding="utf-8") as f:
+        return [linea.strip() for linea in f if linea.strip() and not linea.lstrip().startswith("#")]
+
+
+def reemitir_lote(estudios, reportes, workers=None, incremental=False):
+    """Re-emite los reportes de todos los estudios en paralelo y devuelve los resultados en orden."""
+    resultados = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futuros = {pool.submit(reemitir_estudio, estudio, reportes, incremental): estudio for estudio in estudios}
+        for futuro in as_completed(futuros):
+            estudio = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e:  # p. ej. el proceso del pool murió
+                resultado = {"estudio": estudio, "estado": "error", "detalle": str(e), "segundos": 0.0}
+            resultados[estudio] = resultado
+            print(f"[{resultado['estado'].upper()}] {estudio} ({resultado['segundos']:.1f} s)")
+    return [resultados[estudio] for estudio in estudios]
+
+
+def imprimir_resumen(resultados):
+    print("\nResumen de re-emisión:")
+    for estado in ("ok", "omitido", "error"):
+        grupo = [r for r in resultados if r["estado"] == estado]
+        print(f"  {estado}: {len(grupo)}")
+        if estado != "ok":
+            for r in grupo:
+                print(f"    - {r['estudio']}: {r['detalle'].splitlines()[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Regenera los reportes PDF desde los resultados ya calculados (sin re-procesar).",
+        epilog="Ejemplo: python reissue.py --lista estudios.txt --workers 8",
+    )
+    parser.add_argument("estudios", nargs="*",
+                        help="Directorios de estudio (directorio DICOM con FastSurfer/ o la carpeta FastSurfer).")
+    parser.add_argument("--lista", type=str, help="Archivo .txt con un directorio de estudio por línea.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Cantidad de estudios en paralelo (por defecto, uno por núcleo).")
+    parser.add_argument("--reportes", nargs="+", choices=list(ENTRADAS_REPORTES), default=list(ENTRADAS_REPORTES),
+                        help="Reportes a regenerar (por defecto, todos).")
+    parser.add_argument("--reporte_incremental", action="store_true",
+                        help="Escribir cada página a disco al terminarla y unirlas con ghostscript (memoria de una página).")
+    args = parser.parse_args()
+
+    estudios = list(args.estudios)
+    if args.lista:
+        estudios += leer_lista_estudios(args.lista)
+    if not estudios:
+        parser.error("Debe indicar al menos un directorio de estudio o --lista.")
+
+    inicio = time.perf_counter()
+    resultados = reemitir_lote(estudios, args.reportes, workers=args.workers, incremental=args.reporte_incremental)
+    imprimir_resumen(resultados)
+    print(f"\nTiempo total: {time.perf_counter() - inicio:.1f} s")
+
+    # Código de salida distinto de cero si algún estudio falló (los omitidos no cuentan como error)
+    return 1 if any(r["estado"] == "error" for r in resultados) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,226 @@
+from __future__ import annotations
+from pathlib import Path
+import time
+import uuid
+import logging
+from typing import Dict, Iterable, List, Optional, Union
+
+import pandas as pd
+
+# =========================
+# Logging
+# =========================
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+logger = logging.getLogger("ALMACEN")
+
+# ============================================================
+# Almacén columnar de métricas de la cohorte (Parquet particionado)
+# ============================================================
+# Una fila por (modelo, sujeto, etiqueta, métrica). Partición en disco:
+#   <raiz>/modelo=<modelo>/metrica=<metrica>/parte-<id>.parquet
+# 'escrito' (ns) permite quedarse con el último valor si un lote se vuelve a correr.
+COLUMNAS = ["modelo", "sujeto", "etiqueta", "estructura", "metrica", "valor", "escrito"]
+CLAVE = ["modelo", "sujeto", "etiqueta", "metrica"]
+PARTICIONES = ["modelo", "metrica"]
+
+
+def _pyarrow():
+    """Importa pyarrow bajo demanda (sólo lo necesita el almacén, no el resto de los scripts)."""
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "El almacén de métricas usa Parquet y requiere pyarrow "
+            "(conda install -c conda-forge pyarrow)."
+        ) from e
+    return pa, ds, pq
+
+
+# ============================================================
+# Conversión a formato largo
+# ============================================================
+def id_sujeto(ruta: Union[str, Path]) -> str:
+    """
+    ID de sujeto estable a partir de la ruta de su archivo (la misma clave 'sujeto' para todos los
+    scripts que escriben en el almacén, así DICE, HD95 y volúmenes de un sujeto se pueden cruzar):
+      - Si contiene '/mri/' o '/stats/', usa el directorio anterior (estándar FreeSurfer).
+      - Si no, usa el nombre del directorio padre.
+      - Fallback: stem del archivo (sin extensión).
+    """
+    p = Path(ruta)
+    parts = list(p.parts)
+    for carpeta in ("mri", "stats"):
+        if carpeta in parts:
+            idx = len(parts) - 1 - parts[::-1].index(carpeta)
+            if idx > 0:
+                return parts[idx - 1]
+    if p.parent.name:
+        return p.parent.name
+    return p.stem
+
+
+def ids_sujetos(rutas: Iterable[Union[str, Path]]) -> List[str]:
+    """
+    id_sujeto de cada ruta de un lote, sin repetidos. Si varias rutas dan el mismo ID (p. ej.
+    archivos sueltos en una misma carpeta), para ésas se usa el nombre del archivo sin extensión;
+    si aun así se repite, se le agrega la posición en el lote ('<id>_<n>') y se avisa.
+    """
+    rutas = [Path(r) for r in rutas]
+    ids = [id_sujeto(r) for r in rutas]
+    repetidos = {i for i in ids if ids.count(i) > 1}
+    ids = [r.name.split(".")[0] if i in repetidos else i for r, i in zip(rutas, ids)]
+    repetidos = sorted({i for i in ids if ids.count(i) > 1})
+    if repetidos:
+        logger.warning(f"[ALMACEN] IDs de sujeto repetidos, se numeran por posición: {repetidos}")
+        ids = [f"{i}_{n}" if i in repetidos else i for n, i in enumerate(ids, start=1)]
+    return ids
+
+
+def formato_largo(
+    df: pd.DataFrame,
+    *,
+    modelo: str,
+    sujeto: Union[str, int],
+    etiqueta: str,
+    metricas: Union[Dict[str, str], Iterable[str]],
+    estructura: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Pasa una tabla ancha por sujeto (una fila por etiqueta) al formato del almacén.
+      - 'etiqueta' / 'estructura': columnas con el ID y el nombre de la etiqueta.
+      - 'sujeto': columna de df (si existe) o valor constante para todas las filas.
+      - 'metricas': columnas a guardar, o {columna: nombre_de_metrica} para renombrarlas.
+    """
+    if not isinstance(metricas, dict):
+        metricas = {c: c for c in metricas}
+    metricas = {c: m for c, m in metricas.items() if c in df.columns}
+
+    ids = pd.DataFrame({
+        "modelo": str(modelo),
+        "sujeto": df[sujeto].astype(str) if isinstance(sujeto, str) and sujeto in df.columns else str(sujeto),
+        "etiqueta": df[etiqueta].astype(str),
+        "estructura": df[estructura].astype(str) if estructura else df[etiqueta].astype(str),
+    }, index=df.index)
+    valores = df[list(metricas)].rename(columns=metricas)
+    largo = pd.concat([ids, valores], axis=1).melt(
+        id_vars=list(ids.columns), var_name="metrica", value_name="valor"
+    )
+    largo["valor"] = pd.to_numeric(largo["valor"], errors="coerce")
+    return largo[COLUMNAS[:-1]]
+
+
+# ============================================================
+# Escritura
+# ============================================================
+def agregar_metricas(raiz: Union[str, Path], largo: Union[pd.DataFrame, List[pd.DataFrame]]) -> int:
+    """
+    Agrega filas (formato largo, ver formato_largo) al almacén. Cada llamada escribe un archivo
+    nuevo por partición, así varios lotes pueden escribir sin pisarse. Devuelve filas escritas.
+    """
+    pa, _, pq = _pyarrow()
+    if isinstance(largo, list):
+        largo = pd.concat(largo, ignore_index=True) if largo else pd.DataFrame(columns=COLUMNAS[:-1])
+    if largo.empty:
+        return 0
+
+    faltantes = [c for c in COLUMNAS[:-1] if c not in largo.columns]
+    if faltantes:
+        raise ValueError(f"Faltan columnas para el almacén: {faltantes}")
+
+    df = largo[COLUMNAS[:-1]].copy()
+    for c in ("modelo", "sujeto", "etiqueta", "estructura", "metrica"):
+        df[c] = df[c].astype(str)
+    df["valor"] = pd.to_numeric(df["valor"], errors="coerce").astype(float)
+    df["escrito"] = time.time_ns()
+
+    raiz = Path(raiz)
+    raiz.mkdir(parents=True, exist_ok=True)
+    pq.write_to_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        root_path=str(raiz),
+        partition_cols=PARTICIONES,
+        basename_template=f"parte-{uuid.uuid4().hex}-{{i}}.parquet",
+    )
+    logger.info(f"[ALMACEN] {len(df)} filas agregadas en {raiz}")
+    return len(df)
+
+
+# ============================================================
+# Consultas
+# ============================================================
+def consultar(
+    raiz: Union[str, Path],
+    *,
+    modelos: Optional[Iterable[str]] = None,
+    metricas: Optional[Iterable[str]] = None,
+    sujetos: Optional[Iterable[Union[str, int]]] = None,
+    etiquetas: Optional[Iterable[Union[str, int]]] = None,
+    deduplicar: bool = True,
+) -> pd.DataFrame:
+    """
+    Lee el almacén filtrando por modelo/métrica (sólo se abren esas particiones) y,
+    opcionalmente, por sujeto/etiqueta. Con deduplicar=True, si una misma clave
+    (modelo, sujeto, etiqueta, métrica) se escribió más de una vez, queda la más reciente.
+    """
+    _, ds, _ = _pyarrow()
+    raiz = Path(raiz)
+    if not raiz.is_dir():
+        raise FileNotFoundError(f"No existe el almacén de métricas: {raiz}")
+
+    dataset = ds.dataset(str(raiz), format="parquet", partitioning="hive")
+    filtro = None
+    for campo, valores in (("modelo", modelos), ("metrica", metricas),
+                           ("sujeto", sujetos), ("etiqueta", etiquetas)):
+        if valores is None:
+            continue
+        condicion = ds.field(campo).isin([str(v) for v in valores])
+        filtro = condicion if filtro is None else (filtro & condicion)
+
+    df = dataset.to_table(filter=filtro).to_pandas()
+    for c in ("modelo", "metrica"):
+        if c in df.columns:
+            df[c] = df[c].astype(str)  # las particiones vuelven como categorías
+    if deduplicar and not df.empty:
+        df = df.sort_values("escrito", kind="stable").drop_duplicates(CLAVE, keep="last")
+    return df[[c for c in COLUMNAS if c in df.columns]].reset_index(drop=True)
+
+
+def resumen_por_etiqueta(
+    raiz: Union[str, Path],
+    metrica: str,
+    *,
+    modelos: Optional[Iterable[str]] = None,
+    estadistico: str = "mean",
+) -> pd.DataFrame:
+    """
+    Tabla estructura x modelo con el estadístico ('mean', 'median', 'std', ...) de la métrica
+    sobre todos los sujetos (lo que antes se armaba leyendo un csv_promedio.csv por modelo).
+    """
+    df = consultar(raiz, modelos=modelos, metricas=[metrica])
+    if df.empty:
+        return pd.DataFrame()
+    return df.pivot_table(index="estructura", columns="modelo", values="valor", aggfunc=estadistico)
+
+
+def compactar(raiz: Union[str, Path]) -> None:
+    """
+    Reescribe cada partición (modelo, métrica) en un único archivo, sin claves duplicadas.
+    Útil después de muchos lotes chicos.
+    """
+    pa, _, pq = _pyarrow()
+    raiz = Path(raiz)
+    for particion in sorted(p for p in raiz.glob("modelo=*/metrica=*") if p.is_dir()):
+        partes = sorted(particion.glob("*.parquet"))
+        if len(partes) <= 1:
+            continue
+        # Dentro de la partición modelo y métrica son constantes: la clave es (sujeto, etiqueta)
+        df = pd.concat([pq.read_table(str(p)).to_pandas() for p in partes], ignore_index=True)
+        df = df.drop(columns=[c for c in PARTICIONES if c in df.columns])
+        df = df.sort_values("escrito", kind="stable").drop_duplicates(["sujeto", "etiqueta"], keep="last")
+        destino = particion / f"parte-{uuid.uuid4().hex}-0.parquet"
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), str(destino))
+        for p in partes:
+            p.unlink()
+        logger.info(f"[ALMACEN] {particion.relative_to(raiz)}: {len(partes)} archivos -> 1 ({len(df)} filas)")
@@ -4,9 +4,13 @@ import os
 import logging
 from typing import Dict, Iterable, List, Optional, Tuple, Union, Set
 
-import nibabel as nib
 import numpy as np
 import pandas as pd
+from scipy import sparse
+
+from almacen_metricas import agregar_metricas, formato_largo, id_sujeto, ids_sujetos
+from etiquetas import cargar_etiquetas
+from lotes_paralelos import ejecutar_en_orden, workers_por_defecto
 
 # =========================
 # Logging
@@ -111,6 +115,97 @@ def _resolve_requested_labels(
     return resolved
 
 
+# =========================
+# Motor de DICE por matriz de confusión de etiquetas
+# =========================
+def _cargar_etiquetas(path: Union[str, Path]) -> np.ndarray:
+    """
+    Carga un volumen de etiquetas como enteros sin pasar por get_fdata() (float64),
+    con el tipo entero más chico que alcanza (ver etiquetas.cargar_etiquetas).
+    """
+    return cargar_etiquetas(path)[1]
+
+
+def _compactar_etiquetas(data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Remapea un volumen de etiquetas a índices compactos 0..K-1.
+    Devuelve (etiquetas_ordenadas, indices) con indices del mismo shape que data.
+    Para rangos de etiquetas acotados (FreeSurfer: 0..~14175) usa una tabla de búsqueda
+    en lugar de np.unique (que ordena todo el volumen).
+    """
+    flat = data.ravel()
+    vmin = int(flat.min())
+    vmax = int(flat.max())
+    if vmax - vmin < (1 << 20):
+        # Con tipos chicos (uint8/int16) la resta se hace en intp para no desbordar
+        desplazado = flat.astype(np.intp) - vmin if vmin != 0 else flat
+        presentes = np.flatnonzero(np.bincount(desplazado, minlength=vmax - vmin + 1))
+        tabla = np.zeros(vmax - vmin + 1, dtype=np.int32)
+        tabla[presentes] = np.arange(presentes.size, dtype=np.int32)
+        return presentes + vmin, tabla[desplazado]
+    etiquetas, indices = np.unique(flat, return_inverse=True)
+    return etiquetas, indices.astype(np.int32)
+
+
+def matriz_confusion_etiquetas(
+    data_a: np.ndarray,
+    data_b: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, sparse.csr_matrix]:
+    """
+    Histograma conjunto (matriz de confusión) de dos volúmenes de etiquetas en una sola pasada.
+    Devuelve (etiquetas_a, etiquetas_b, C) donde C[i, j] = nº de voxeles con etiqueta
+    etiquetas_a[i] en A y etiquetas_b[j] en B (matriz dispersa).
+    """
+    if data_a.shape != data_b.shape:
+        raise ValueError("Los volúmenes tienen dimensiones diferentes.")
+
+    etiquetas_a, idx_a = _compactar_etiquetas(data_a)
+    etiquetas_b, idx_b = _compactar_etiquetas(data_b)
+    na, nb = etiquetas_a.size, etiquetas_b.size
+
+    codigos = idx_a.astype(np.int64) * nb + idx_b
+    if na * nb <= (1 << 24):
+        conteos = np.bincount(codigos, minlength=na * nb)
+        codigos = np.flatnonzero(conteos)
+        conteos = conteos[codigos]
+    else:
+        codigos, conteos = np.unique(codigos, return_counts=True)
+
+    C = sparse.coo_matrix((conteos, (codigos // nb, codigos % nb)), shape=(na, nb)).tocsr()
+    return etiquetas_a, etiquetas_b, C
+
+
+def dice_desde_matriz_confusion(
+    etiquetas_a: np.ndarray,
+    etiquetas_b: np.ndarray,
+    C: sparse.csr_matrix,
+    etiquetas: Optional[Iterable[int]] = None
+) -> Dict[int, Tuple[float, int, int, int]]:
+    """
+    DICE de cada etiqueta a partir de la matriz de confusión.
+    Devuelve {etiqueta: (dice, n_a, n_b, interseccion)}; por defecto evalúa la UNIÓN de etiquetas.
+    """
+    n_a_por_fila = np.asarray(C.sum(axis=1)).ravel()
+    n_b_por_col = np.asarray(C.sum(axis=0)).ravel()
+    pos_a = {int(lab): i for i, lab in enumerate(etiquetas_a)}
+    pos_b = {int(lab): j for j, lab in enumerate(etiquetas_b)}
+
+    if etiquetas is None:
+        etiquetas = sorted(set(pos_a) | set(pos_b))
+
+    resultados: Dict[int, Tuple[float, int, int, int]] = {}
+    for lab in etiquetas:
+        lab = int(lab)
+        i, j = pos_a.get(lab), pos_b.get(lab)
+        n_a = int(n_a_por_fila[i]) if i is not None else 0
+        n_b = int(n_b_por_col[j]) if j is not None else 0
+        interseccion = int(C[i, j]) if (i is not None and j is not None) else 0
+        suma = n_a + n_b
+        dice = (2.0 * interseccion) / suma if suma > 0 else np.nan
+        resultados[lab] = (dice, n_a, n_b, interseccion)
+    return resultados
+
+
 # =========================
 # Funcion original
 # =========================
@@ -118,29 +213,17 @@ def calcular_dice_por_etiqueta(path_a, path_b):
     """
     Versión original: calcula DICE por etiqueta (UNIÓN de etiquetas).
     Mantengo esta función tal cual la compartiste, por compatibilidad con tu flujo previo.
+    Internamente usa la matriz de confusión (una sola pasada sobre los volúmenes).
     """
-    data_a = nib.load(str(path_a)).get_fdata()
-    data_b = nib.load(str(path_b)).get_fdata()
+    data_a = _cargar_etiquetas(path_a)
+    data_b = _cargar_etiquetas(path_b)
 
     if data_a.shape != data_b.shape:
         raise ValueError("Los volúmenes tienen dimensiones diferentes.")
 
-    data_a = np.round(data_a).astype(np.int32)
-    data_b = np.round(data_b).astype(np.int32)
-
-    etiquetas = sorted(set(np.unique(data_a)) | set(np.unique(data_b)))
-    resultados = {}
-
-    for etiqueta in etiquetas:
-        mask_a = (data_a == etiqueta)
-        mask_b = (data_b == etiqueta)
-        interseccion = np.logical_and(mask_a, mask_b).sum()
-        suma = mask_a.sum() + mask_b.sum()
-        if suma == 0:
-            dice = np.nan
-        else:
-            dice = (2.0 * interseccion) / suma
-        resultados[etiqueta] = dice
+    etiquetas_a, etiquetas_b, C = matriz_confusion_etiquetas(data_a, data_b)
+    por_etiqueta = dice_desde_matriz_confusion(etiquetas_a, etiquetas_b, C)
+    resultados = {etiqueta: valores[0] for etiqueta, valores in por_etiqueta.items()}
 
     return resultados
 
@@ -168,16 +251,17 @@ def calcular_dice_por_etiqueta_v2(
 
     lut = load_fs_lut(lut_path)
 
-    img_a = nib.load(str(path_a))
-    img_b = nib.load(str(path_b))
-    data_a = np.round(img_a.get_fdata()).astype(np.int32)
-    data_b = np.round(img_b.get_fdata()).astype(np.int32)
+    data_a = _cargar_etiquetas(path_a)
+    data_b = _cargar_etiquetas(path_b)
 
     if data_a.shape != data_b.shape:
         raise ValueError("Los volúmenes tienen dimensiones diferentes. Asegúrate de re-muestrear antes.")
 
-    labels_a = set(np.unique(data_a).tolist())
-    labels_b = set(np.unique(data_b).tolist())
+    # Una sola pasada: matriz de confusión entre las etiquetas de ambos volúmenes
+    etiquetas_a, etiquetas_b, C = matriz_confusion_etiquetas(data_a, data_b)
+
+    labels_a = set(etiquetas_a.tolist())
+    labels_b = set(etiquetas_b.tolist())
     candidate_labels: Set[int] = labels_a & labels_b
 
     if exclude_background and 0 in candidate_labels:
@@ -207,19 +291,12 @@ def calcular_dice_por_etiqueta_v2(
         return pd.DataFrame(columns=["Etiqueta", "Estructura", "DICE"])
 
     rows: List[Dict[str, Union[int, float, str]]] = []
-    for lab in sorted(final_labels):
-        mask_a = (data_a == lab)
-        mask_b = (data_b == lab)
-        n_a = int(mask_a.sum())
-        n_b = int(mask_b.sum())
+    por_etiqueta = dice_desde_matriz_confusion(etiquetas_a, etiquetas_b, C, sorted(final_labels))
+    for lab, (dice, n_a, n_b, _) in por_etiqueta.items():
         if n_a == 0 or n_b == 0:
             logger.debug(f"Etiqueta {lab} sin voxeles en uno de los volúmenes; se omite.")
             continue
 
-        interseccion = np.logical_and(mask_a, mask_b).sum()
-        suma = n_a + n_b
-        dice = (2.0 * interseccion) / suma if suma > 0 else np.nan
-
         rows.append({
             "Etiqueta": int(lab),
             "Estructura": lut.get(lab, "UNKNOWN"),
@@ -305,30 +382,30 @@ def _read_paths_txt(txt_path: Union[str, Path]) -> List[Path]:
     return paths
 
 
-def _infer_subject_id(p: Path) -> str:
-    """
-    Heurística para extraer el ID de sujeto a partir de la ruta:
-      - Si contiene '/mri/', usa el directorio anterior a 'mri' (estándar FreeSurfer).
-      - Si no, usa el nombre del directorio padre.
-      - Fallback: stem del archivo (sin extensión).
-    """
-    p = Path(p)
-    parts = list(p.parts)
-    try:
-        idx = parts.index("mri")
-        if idx > 0:
-            return parts[idx - 1]
-    except ValueError:
-        pass
-    if p.parent.name:
-        return p.parent.name
-    return p.stem
-
-
 def _sanitize_filename(s: str) -> str:
     return "".join(ch if (ch.isalnum() or ch in "-_") else "_" for ch in s)
 
 
+def _dice_par(
+    fs_p: Path,
+    mdl_p: Path,
+    lut_path: Optional[Path],
+    select: Optional[Iterable[Union[int, str]]],
+    mode: str,
+    exclude_background: bool,
+    dice_decimals: int,
+) -> pd.DataFrame:
+    """Cálculo de un par (se ejecuta en un proceso del pool cuando workers > 1)."""
+    return calcular_dice_por_etiqueta_v2(
+        fs_p, mdl_p,
+        lut_path=lut_path,      # se vuelve a cargar dentro; está bien por aislamiento
+        select=select,
+        mode=mode,
+        exclude_background=exclude_background,
+        dice_decimals=dice_decimals
+    )
+
+
 def calcular_dice_batch_desde_txt(
     txt_refs: Union[str, Path],          # .txt con rutas a FS (referencia)
     txt_model: Union[str, Path],         # .txt con rutas al modelo (SynthSeg / FastSurfer / Clinical)
@@ -340,12 +417,20 @@ def calcular_dice_batch_desde_txt(
     mode: str = "all",
     exclude_background: bool = True,
     dice_decimals: int = 3,
-    save_aggregate_csv: bool = True
+    save_aggregate_csv: bool = True,
+    workers: int = 1,
+    reintentos: int = 1,
+    almacen: Optional[Union[str, Path]] = None,
 ) -> Path:
     """
     Procesa N pares (FS vs modelo) leídos desde dos .txt en el MISMO orden.
     - Genera un CSV por sujeto: columnas ['Etiqueta','Estructura','DICE'] (como tu función original).
-    - Opcionalmente, también un CSV agregado con todas las filas (agrega columnas sujeto y modelo).
+    - Opcionalmente, también un CSV agregado con todas las filas (agrega columnas sujeto y modelo),
+      que se va escribiendo a medida que terminan los pares (siempre en el orden de los .txt).
+    - 'workers' > 1 reparte los pares en un pool de procesos; un par que falla se reintenta
+      'reintentos' veces y, si sigue fallando, se informa y se continúa con el resto.
+    - 'almacen': si se indica, los DICE de todos los sujetos se agregan al almacén Parquet de
+      métricas (ver almacen_metricas) con metrica='dice' y sujeto = id_sujeto(ruta FS).
 
     Devuelve la ruta del CSV agregado si se generó, o la carpeta de salida si no.
     """
@@ -361,11 +446,10 @@ def calcular_dice_batch_desde_txt(
         raise ValueError(f"Las listas tienen distinto largo: FS={len(fs_paths)} vs Modelo={len(mdl_paths)}. "
                          "Asegúrate de que estén alineadas y en el mismo orden.")
 
-    # Cargar LUT una sola vez
-    lut = load_fs_lut(lut_path)
+    mdl_tag = _sanitize_filename(model_name)
 
-    agg_rows: List[Dict[str, Union[str, int, float]]] = []
-    p=1
+    # Pares válidos (los que no existen se informan y no se envían al pool)
+    pares: List[Tuple[int, Path, Path]] = []
     for i, (fs_p, mdl_p) in enumerate(zip(fs_paths, mdl_paths), start=1):
         if not fs_p.is_file():
             logger.error(f"[{i}] No existe archivo FS: {fs_p}")
@@ -373,25 +457,27 @@ def calcular_dice_batch_desde_txt(
         if not mdl_p.is_file():
             logger.error(f"[{i}] No existe archivo del modelo: {mdl_p}")
             continue
+        logger.info(f"[{i}] Sujeto='{id_sujeto(fs_p)}' | FS='{fs_p.name}' vs {model_name}='{mdl_p.name}'")
+        pares.append((i, fs_p, mdl_p))
 
-        subject_id = _infer_subject_id(fs_p)
-        subj_tag = _sanitize_filename(subject_id)
-        mdl_tag = _sanitize_filename(model_name)
+    tareas = [(fs_p, mdl_p, lut_path, select, mode, exclude_background, dice_decimals) for _, fs_p, mdl_p in pares]
+    logger.info(f"Pares a procesar: {len(tareas)} (workers={workers})")
 
-        logger.info(f"[{i}] Sujeto='{subject_id}' | FS='{fs_p.name}' vs {model_name}='{mdl_p.name}'")
+    # CSV agregado: encabezado ahora, filas a medida que llegan los resultados
+    columnas_agg = ["sujeto", "modelo", "Etiqueta", "Estructura", "DICE"]
+    agg_path = out_dir / f"dice_{mdl_tag}_agregado.csv"
+    if save_aggregate_csv:
+        pd.DataFrame(columns=columnas_agg).to_csv(agg_path, index=False)
+    n_filas_agg = 0
+    filas_almacen: List[pd.DataFrame] = []
+    sujetos = ids_sujetos(fs_p for _, fs_p, _ in pares)
 
-        # Cálculo (misma lógica que v2; no modificado)
-        try:
-            df_subj = calcular_dice_por_etiqueta_v2(
-                fs_p, mdl_p,
-                lut_path=lut_path,      # se vuelve a cargar dentro; está bien por aislamiento
-                select=select,
-                mode=mode,
-                exclude_background=exclude_background,
-                dice_decimals=dice_decimals
-            )
-        except Exception as e:
-            logger.error(f"[{i}] Error calculando DICE para '{subject_id}': {e}")
+    p=1
+    for k, df_subj, error in ejecutar_en_orden(_dice_par, tareas, workers=workers, reintentos=reintentos):
+        i, fs_p, _ = pares[k]
+        subject_id = sujetos[k]
+        if error is not None:
+            logger.error(f"[{i}] Error calculando DICE para '{subject_id}': {error}")
             continue
 
         # Guardado por sujeto (mismo formato)
@@ -400,21 +486,25 @@ def calcular_dice_batch_desde_txt(
             guardar_dice_como_csv(df_subj, out_csv_subj)
         except Exception as e:
             logger.error(f"[{i}] No se pudo guardar CSV de sujeto '{subject_id}': {e}")
-        # Acumular para CSV agregado
-        for _, row in df_subj.iterrows():
-            agg_rows.append({
+        # Agregar al CSV combinado
+        if save_aggregate_csv and not df_subj.empty:
+            df_rows = pd.DataFrame({
                 "sujeto": p,
                 "modelo": model_name,
-                "Etiqueta": int(row["Etiqueta"]),
-                "Estructura": str(row["Estructura"]),
-                "DICE": float(row["DICE"]),
-            })
+                "Etiqueta": df_subj["Etiqueta"].astype(int).to_numpy(),
+                "Estructura": df_subj["Estructura"].astype(str).to_numpy(),
+                "DICE": df_subj["DICE"].astype(float).to_numpy(),
+            }, columns=columnas_agg)
+            df_rows.to_csv(agg_path, mode="a", header=False, index=False)
+            n_filas_agg += len(df_rows)
+        if almacen is not None and not df_subj.empty:
+            filas_almacen.append(formato_largo(df_subj, modelo=model_name, sujeto=subject_id, etiqueta="Etiqueta",
+                                               estructura="Estructura", metricas={"DICE": "dice"}))
         p=p+1
+    if almacen is not None:
+        agregar_metricas(almacen, filas_almacen)
     if save_aggregate_csv:
-        df_agg = pd.DataFrame(agg_rows, columns=["sujeto", "modelo", "Etiqueta", "Estructura", "DICE"])
-        agg_path = out_dir / f"dice_{_sanitize_filename(model_name)}_agregado.csv"
-        df_agg.to_csv(agg_path, index=False)
-        logger.info(f"CSV agregado guardado en: {agg_path} (filas: {len(df_agg)})")
+        logger.info(f"CSV agregado guardado en: {agg_path} (filas: {n_filas_agg})")
         return agg_path
 
     return out_dir
@@ -424,6 +514,12 @@ def calcular_dice_batch_desde_txt(
 # Ejemplo de uso por lotes (opcional)
 # ============================================================
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="DICE por etiqueta en lote (FS vs modelo).")
+    parser.add_argument("--workers", type=int, default=workers_por_defecto(),
+                        help="Pares en paralelo (por defecto SLURM_CPUS_PER_TASK o 1).")
+    args = parser.parse_args()
+
     # Archivos .txt con rutas alineadas (una ruta por línea, mismo orden):
     # txt_fs  : rutas a FS (referencia)
     # txt_ss  : rutas a SynthSeg (mismo orden que txt_fs)
@@ -448,6 +544,6 @@ if __name__ == "__main__":
         exclude_background=True,
         dice_decimals=3,
         save_aggregate_csv=True,
-        lut_path="/home/mbudani/apps/freesurfer/FreeSurferColorLUT.txt" 
-
+        lut_path="/home/mbudani/apps/freesurfer/FreeSurferColorLUT.txt",
+        workers=args.workers,        # pares en paralelo (por defecto, CPUs de SLURM)
     )
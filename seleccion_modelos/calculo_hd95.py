@@ -11,6 +11,10 @@ from scipy import ndimage
 from scipy.spatial import cKDTree
 import pandas as pd
 
+from almacen_metricas import agregar_metricas, formato_largo, ids_sujetos
+from etiquetas import cargar_etiquetas
+from lotes_paralelos import ejecutar_en_orden, workers_por_defecto
+
 
 # ============================================================
 # Configuración básica de logging (logs informativos en consola)
@@ -45,24 +49,22 @@ def _read_paths_txt(txt_path: Union[str, Path]) -> List[Path]:
 def load_label_image(path: Path) -> Tuple[nib.spatialimages.SpatialImage, np.ndarray, np.ndarray]:
     #En cuanto a la flecha indica que la funcion retorna una tupla, nib.spatialimages.SpatialImage es el primer valor de la tupl
     #Es un objeto de nibabel que crea el cargador de iamgenes .nii o .mgz, este objeto contien tanto los datos de la imagen como la cabecera.
-    #el segundo valor de la tupla es un array multidimensional int32 donde se guardaran los valores de la segmentacion
+    #el segundo valor de la tupla es un array multidimensional de enteros donde se guardaran los valores de la segmentacion
     #le tercer valor en la tupla es también un array NumPy que contiene la matriz afín (matriz 4x4) asociada con la imagen. Esta matriz transforma las coordenadas del índice del voxel (i, j, k) en coordenadas espaciales (mm), es decir, convierte los índices de voxel en unidades físicas del espacio.
     #Es decir a la funcion le ingreso la direccion a una imagen segmentada y me devuelve una tupla con 
     #Los valores de la iamgen, los valores de las segmentaciones y una matriz para pasar a coordenadas espaciales.
     """
     Carga una imagen etiquetada (label map) en formato .mgz / .nii 
-    y devuelve: (objeto nibabel, array de datos int32, matriz afín 4x4).
-    - get_fdata() convierte a float64 por defecto -> luego lo pasamos a int32.
-    - Redondeamos antes por seguridad numérica (p.ej. 2.0000001 -> 2).
+    y devuelve: (objeto nibabel, array de datos enteros, matriz afín 4x4).
+    - Lee el tipo entero guardado en disco vía dataobj (sin pasar por get_fdata() en float64).
+    - Si el archivo guarda floats, valida que sean enteros y los redondea (p.ej. 2.0000001 -> 2).
+    - Devuelve el tipo entero más chico que alcanza (ver etiquetas.cargar_etiquetas).
     """
-    img = nib.load(str(path))#carga el path de la imagen en un archivo de nibabel
+    img, data = cargar_etiquetas(path)#carga el path de la imagen en un archivo de nibabel
     #img es un objeto de tipo SpatialImage de nibabel, que contiene tanto los datos de 
     # #la imagen (los valores numéricos de los voxeles) como la información de la cabecera (dimensiones, affine, etc.).
-    data = img.get_fdata()               # ndarray en float64
-    data = np.round(data).astype(np.int32)
-    #get_fdata() es un método de los objetos SpatialImage en nibabel que extrae los datos de la imagen.
-    #get_fdata() devuelve los datos de la imagen como un array NumPy (np.ndarray), y por defecto, los convierte en tipo float64. Este es un tipo de dato numérico que permite una mayor precisión.
-    # En el caso de imágenes de segmentación (etiquetas), get_fdata() carga todos los valores de los voxeles de la imagen en un formato flotante, pero los valores de las etiquetas son enteros, así que los convertimos después.
+    #get_fdata() devolvía los datos en float64 (8 bytes por voxel) y después había que pasarlos a int32;
+    #leyendo dataobj los datos quedan en su tipo entero de disco (uint8/int16/int32), sin copias en float.
     affine = img.affine                  # 4x4, lleva de (i,j,k,1) a mm
     #img.affine: Es la matriz afín que está asociada con la imagen cargada. Es una matriz 
     # 4x4 que transforma las coordenadas de índice de voxel (i, j, k) (que son índices de
@@ -93,17 +95,46 @@ def make_surface(mask: np.ndarray) -> np.ndarray:
     return surface
 
 
+# ============================================================
+# Recortes por etiqueta (bounding boxes)
+# ============================================================
+def label_bounding_boxes(data: np.ndarray, max_label: int) -> List[Optional[Tuple[slice, ...]]]:
+    """
+    Bounding box de cada etiqueta 1..max_label en UNA pasada (ndimage.find_objects).
+    El elemento lab-1 es la tupla de slices de la etiqueta 'lab' (None si no está presente).
+    """
+    return ndimage.find_objects(data, max_label=max_label)
+
+
+def padded_crop(bbox: Tuple[slice, ...], shape: Tuple[int, ...], pad: int = 1) -> Tuple[slice, ...]:
+    """
+    Agranda el bounding box 'pad' voxeles por lado (recortado a los límites del volumen).
+    Con pad >= 1 el borde del recorte queda fuera de la etiqueta, por lo que la erosión
+    (border_value=0) y la superficie obtenidas en el recorte son idénticas a las del volumen completo.
+    """
+    return tuple(slice(max(sl.start - pad, 0), min(sl.stop + pad, n)) for sl, n in zip(bbox, shape))
+
+
+def crop_offset(crop: Tuple[slice, ...]) -> np.ndarray:
+    """Índice IJK de la esquina del recorte dentro del volumen completo."""
+    return np.array([sl.start for sl in crop], dtype=int)
+
+
 # ============================================================
 # Distancias entre superficies en milímetros (KDTree en mm)
 # ============================================================
-def surface_points_mm(surface_mask: np.ndarray, affine: np.ndarray) -> np.ndarray:
+def surface_points_mm(surface_mask: np.ndarray, affine: np.ndarray, offset: Optional[np.ndarray] = None) -> np.ndarray:
     """
     Devuelve un array (N,3) con coordenadas en MILÍMETROS de los voxeles
     que pertenecen a la superficie (surface_mask=True), aplicando el afín.
+    Si surface_mask es un recorte del volumen, 'offset' es el índice IJK de su esquina
+    (se suma antes de aplicar el afín del volumen completo).
     """
     idx = np.argwhere(surface_mask)  # (N,3) en índices IJK
     if idx.size == 0:
         return np.empty((0, 3), dtype=float)
+    if offset is not None:
+        idx = idx + offset
     # Pasar de índices IJK a coordenadas físicas (mm) con el afín 4x4
     xyz_mm = apply_affine(affine, idx)  # (N,3)
     return xyz_mm
@@ -136,7 +167,14 @@ def hd50_hd95_hdmax_bidirectional_mm(points_A_mm: np.ndarray, points_B_mm: np.nd
     """
     d_AB = directed_surface_distances_mm(points_A_mm, points_B_mm)
     d_BA = directed_surface_distances_mm(points_B_mm, points_A_mm)
+    return hd50_hd95_hdmax_from_distances(d_AB, d_BA)
 
+
+def hd50_hd95_hdmax_from_distances(d_AB: np.ndarray, d_BA: np.ndarray) -> Tuple[float, float, float]:
+    """
+    HD50, HD95 y HDmax a partir de las distancias dirigidas ya calculadas (cualquier motor).
+    Devuelve (hd50_mm, hd95_mm, hdmax_mm).
+    """
     # Unir ambas direcciones
     all_d = np.concatenate([d_AB, d_BA])
 
@@ -149,6 +187,87 @@ def hd50_hd95_hdmax_bidirectional_mm(points_A_mm: np.ndarray, points_B_mm: np.nd
     hdmax = float(np.max(all_d[np.isfinite(all_d)]))
     return (hd50, hd95, hdmax)
 
+
+# ============================================================
+# Distancias entre superficies por transformada de distancia (EDT)
+# ============================================================
+SURFACE_ENGINES = ("kdtree", "edt")
+
+
+def voxel_spacing_mm(affine: np.ndarray) -> np.ndarray:
+    """Tamaño de voxel (mm) en cada eje IJK: norma de las columnas 3x3 del afín."""
+    return np.sqrt((np.asarray(affine)[:3, :3] ** 2).sum(axis=0))
+
+
+def same_grid(shape_a: Tuple[int, ...], affine_a: np.ndarray, shape_b: Tuple[int, ...], affine_b: np.ndarray) -> bool:
+    """True si ambos volúmenes comparten rejilla (misma forma y mismo afín)."""
+    return tuple(shape_a) == tuple(shape_b) and np.allclose(affine_a, affine_b, atol=1e-4)
+
+
+def union_crop(crop_a: Tuple[slice, ...], crop_b: Tuple[slice, ...]) -> Tuple[slice, ...]:
+    """Recorte mínimo que contiene a ambos recortes."""
+    return tuple(slice(min(a.start, b.start), max(a.stop, b.stop)) for a, b in zip(crop_a, crop_b))
+
+
+def directed_surface_distances_edt_mm(surface_src: np.ndarray, surface_dst: np.ndarray, spacing: np.ndarray) -> np.ndarray:
+    """
+    Distancias dirigidas src -> dst (en mm) leyendo una transformada de distancia euclídea
+    anisotrópica de la superficie destino en los voxeles de la superficie origen.
+    Ambas máscaras deben ser recortes de la MISMA rejilla (mismo afín).
+    """
+    if not surface_src.any():
+        return np.empty((0,), dtype=float)
+    if not surface_dst.any():
+        return np.full((int(surface_src.sum()),), np.inf, dtype=float)
+
+    # Distancia de cada voxel al voxel de superficie destino más cercano (los ceros de ~surface_dst)
+    dt = ndimage.distance_transform_edt(~surface_dst, sampling=spacing)
+    return dt[surface_src]
+
+
+def label_surface_distances_mm(
+    ref_data: np.ndarray,
+    pred_data: np.ndarray,
+    ref_affine: np.ndarray,
+    pred_affine: np.ndarray,
+    lab: int,
+    bbox_ref: Tuple[slice, ...],
+    bbox_pred: Tuple[slice, ...],
+    engine: str = "kdtree",
+) -> Tuple[int, int, np.ndarray, np.ndarray]:
+    """
+    Superficies de la etiqueta 'lab' en ref y pred (sobre sus recortes) y distancias dirigidas
+    ref->pred y pred->ref en mm con el motor pedido:
+      - 'kdtree': puntos de superficie en mm (afín propio de cada volumen) + cKDTree.
+      - 'edt'   : transformada de distancia anisotrópica sobre el recorte común (misma rejilla).
+    Devuelve (n_surf_ref, n_surf_pred, d_ref_pred, d_pred_ref).
+    """
+    # Recortes con 1 voxel de margen (la erosión no depende de nada fuera de ellos)
+    crop_ref = padded_crop(bbox_ref, ref_data.shape)
+    crop_pred = padded_crop(bbox_pred, pred_data.shape)
+
+    if engine == "edt":
+        # Un único recorte para ambos volúmenes: las distancias se leen por índice
+        crop = union_crop(crop_ref, crop_pred)
+        surf_ref = make_surface(ref_data[crop] == lab)
+        surf_pred = make_surface(pred_data[crop] == lab)
+        spacing = voxel_spacing_mm(ref_affine)
+        d_ref_pred = directed_surface_distances_edt_mm(surf_ref, surf_pred, spacing)
+        d_pred_ref = directed_surface_distances_edt_mm(surf_pred, surf_ref, spacing)
+        return int(surf_ref.sum()), int(surf_pred.sum()), d_ref_pred, d_pred_ref
+
+    # Máscaras binarias y superficies (conectividad 26), sólo en el recorte
+    surf_ref = make_surface(ref_data[crop_ref] == lab)
+    surf_pred = make_surface(pred_data[crop_pred] == lab)
+
+    # Coordenadas de superficie en mm (aplicando afines propios)
+    pts_ref_mm = surface_points_mm(surf_ref, ref_affine, offset=crop_offset(crop_ref))
+    pts_pred_mm = surface_points_mm(surf_pred, pred_affine, offset=crop_offset(crop_pred))
+    d_ref_pred = directed_surface_distances_mm(pts_ref_mm, pts_pred_mm)
+    d_pred_ref = directed_surface_distances_mm(pts_pred_mm, pts_ref_mm)
+    return pts_ref_mm.shape[0], pts_pred_mm.shape[0], d_ref_pred, d_pred_ref
+
+
 def _resolve_requested_labels(
     select: Optional[Iterable[Union[int, str]]],
     lut: Dict[int, str]
@@ -255,7 +374,8 @@ def compute_hd_metrics_per_label(
     verbose: bool = True,
     *,
     select: Optional[Iterable[Union[int, str]]] = None,  # NUEVO: IDs o nombres LUT
-    mode: str = "all"                                    # NUEVO: 'all' | 'include' | 'exclude'
+    mode: str = "all",                                   # NUEVO: 'all' | 'include' | 'exclude'
+    engine: str = "kdtree",                              # 'kdtree' | 'edt' (motor de distancias)
 ) -> pd.DataFrame:
     """
     Calcula HD50/HD95/HDmax por etiqueta entre ref (p.ej., FreeSurfer) y pred (p.ej., SynthSeg).
@@ -276,7 +396,15 @@ def compute_hd_metrics_per_label(
         * 'exclude': quita las de 'select'
       - 'select' admite IDs (int) y/o nombres LUT (str). Nombres exactos (case-insensitive).
       - Si se pasa un nombre que no existe en LUT -> ValueError.
+      - 'engine' elige el motor de distancias superficie-superficie:
+        * 'kdtree': cKDTree sobre los puntos de superficie en mm (por defecto).
+        * 'edt': transformada de distancia euclídea anisotrópica (espaciado del afín) sobre el
+          recorte de la etiqueta. Requiere que ref y pred compartan rejilla; si no, se usa 'kdtree'.
     """
+    engine = engine.lower().strip()
+    if engine not in SURFACE_ENGINES:
+        raise ValueError(f"El parámetro 'engine' debe ser uno de {SURFACE_ENGINES}.")
+
     # Cargar LUT (si está disponible)
     lut = load_fs_lut(lut_path)
 
@@ -284,11 +412,17 @@ def compute_hd_metrics_per_label(
     ref_img, ref_data, ref_affine = load_label_image(ref_path)
     pred_img, pred_data, pred_affine = load_label_image(pred_path)
 
+    if engine == "edt" and not same_grid(ref_data.shape, ref_affine, pred_data.shape, pred_affine):
+        logger.warning("engine='edt' requiere ref y pred en la misma rejilla -> se usa 'kdtree'.")
+        engine = "kdtree"
+
+    # Conteo de voxeles de todas las etiquetas en una sola pasada por volumen
+    max_label = int(max(ref_data.max(), pred_data.max(), 0))
+    counts_ref = np.bincount(ref_data[ref_data > 0], minlength=max_label + 1)
+    counts_pred = np.bincount(pred_data[pred_data > 0], minlength=max_label + 1)
+
     # Candidatas (unión) y excluir fondo (0)
-    labels_ref = np.unique(ref_data)
-    labels_pred = np.unique(pred_data)
-    candidate_labels = sorted(set(labels_ref) | set(labels_pred))
-    candidate_labels = [int(l) for l in candidate_labels if l != 0]
+    candidate_labels = [int(l) for l in np.flatnonzero(counts_ref + counts_pred) if l != 0]
 
     logger.info(f"Candidatas (excluyendo 0): {len(candidate_labels)}")
 
@@ -298,8 +432,8 @@ def compute_hd_metrics_per_label(
     sizes_pred: Dict[int, int] = {}
 
     for lab in candidate_labels:
-        n_ref = int((ref_data == lab).sum())
-        n_pred = int((pred_data == lab).sum())
+        n_ref = int(counts_ref[lab])
+        n_pred = int(counts_pred[lab])
 
         # Reglas: presentes en ambos
         if n_ref == 0 or n_pred == 0:
@@ -346,38 +480,33 @@ def compute_hd_metrics_per_label(
         logger.info(f"CSV guardado en: {out_csv}")
         return df_empty
 
-    # TERCER PASO: cálculo métrico (idéntico a lo que ya hacías)
+    # TERCER PASO: cálculo métrico (idéntico a lo que ya hacías, sobre el recorte de cada etiqueta)
+    # Bounding boxes de todas las etiquetas, una pasada por volumen
+    bboxes_ref = label_bounding_boxes(ref_data, max_label)
+    bboxes_pred = label_bounding_boxes(pred_data, max_label)
+
     rows: List[Dict[str, object]] = []
 
     for lab in sorted(final_labels):
-        # Máscaras binarias
-        mask_ref = (ref_data == lab)
-        mask_pred = (pred_data == lab)
-
-        # Superficies (conectividad 26)
-        surf_ref = make_surface(mask_ref)
-        surf_pred = make_surface(mask_pred)
-
-        n_surf_ref = int(surf_ref.sum())
-        n_surf_pred = int(surf_pred.sum())
+        # Superficies (conectividad 26) y distancias bidireccionales sobre el recorte de la etiqueta
+        n_surf_ref, n_surf_pred, d_ref_pred, d_pred_ref = label_surface_distances_mm(
+            ref_data, pred_data, ref_affine, pred_affine, lab,
+            bboxes_ref[lab - 1], bboxes_pred[lab - 1], engine=engine,
+        )
 
         if n_surf_ref == 0 or n_surf_pred == 0:
             if verbose:
                 logger.info(f"Label {lab}: superficie vacía en uno de los volúmenes -> se omite.")
             continue
 
-        # Coordenadas de superficie en mm (aplicando afines propios)
-        pts_ref_mm = surface_points_mm(surf_ref, ref_affine)
-        pts_pred_mm = surface_points_mm(surf_pred, pred_affine)
-
-        # Distancias bidireccionales -> HD50 / HD95 / HDmax
-        hd50, hd95, hdmax = hd50_hd95_hdmax_bidirectional_mm(pts_ref_mm, pts_pred_mm)
+        # HD50 / HD95 / HDmax
+        hd50, hd95, hdmax = hd50_hd95_hdmax_from_distances(d_ref_pred, d_pred_ref)
 
         rows.append({
             "label_id": lab,
             "label_name": lut.get(lab, ""),  # si no está, quedará vacío (como antes)
-            "n_vox_ref": sizes_ref.get(lab, int((ref_data == lab).sum())),
-            "n_vox_pred": sizes_pred.get(lab, int((pred_data == lab).sum())),
+            "n_vox_ref": sizes_ref[lab],
+            "n_vox_pred": sizes_pred[lab],
             "n_surf_ref": n_surf_ref,
             "n_surf_pred": n_surf_pred,
             "hd50_mm": hd50,
@@ -397,6 +526,20 @@ def compute_hd_metrics_per_label(
     logger.info(f"CSV guardado en: {out_csv}")
     return df
 
+def _hd_metrics_par(ref_path, pred_path, out_csv, lut_path, min_voxels, verbose, select, mode, engine) -> pd.DataFrame:
+    """Cálculo de un par (se ejecuta en un proceso del pool cuando workers > 1)."""
+    return compute_hd_metrics_per_label(
+        ref_path=ref_path,
+        pred_path=pred_path,
+        out_csv=out_csv,
+        lut_path=lut_path,
+        min_voxels=min_voxels,
+        verbose=verbose,
+        select=select,
+        mode=mode,
+        engine=engine,
+    )
+
 def batch_hd95_from_txt(
     refs_txt: Union[str, Path],
     preds_txt: Union[str, Path],
@@ -407,24 +550,38 @@ def batch_hd95_from_txt(
     verbose: bool = True,
     select: Optional[Iterable[Union[int, str]]] = None,
     mode: str = "all",
+    engine: str = "kdtree",
+    workers: int = 1,
+    reintentos: int = 1,
+    model_name: Optional[str] = None,
+    almacen: Optional[Union[str, Path]] = None,
 ) -> Optional[pd.DataFrame]:
     """
     Procesa N pares (ref, pred) leídos de dos TXT (una ruta por línea, mismo orden).
     Por cada par:
       - Ejecuta compute_hd_metrics_per_label (cálculo HD50/HD95/HDmax por etiqueta).
-      - Guarda un CSV por sujeto en 'out_dir' con nombre 'hd95_<basename_ref>.csv'.
-    Al final:
-      - Genera 'hd95_combined.csv' con una columna 'subject_id' (basename del ref).
+      - Guarda un CSV por sujeto en 'out_dir' con nombre 'hd95_<subject_id>.csv'.
+    A medida que terminan los pares (siempre en el orden de los TXT):
+      - Escribe 'hd95_combined.csv' con una columna 'subject_id'.
+    'subject_id' es ids_sujetos(refs) (almacen_metricas): único en el lote aunque los ref se llamen
+    igual ('<sujeto>/mri/aparc+aseg.nii'), y la misma clave que usa el almacén.
+    Con 'workers' > 1 los pares se reparten en un pool de procesos.
 
     Comportamiento y validaciones:
       - Aborta si la cantidad de líneas en ambos TXT no coincide.
-      - Si un par falla, lo reporta (logging.error) y continúa con el resto.
-      - 'select' y 'mode' se aplican igual para todos los sujetos.
+      - Si un par falla, se reintenta 'reintentos' veces; si sigue fallando, lo reporta (logging.error)
+        y continúa con el resto.
+      - 'select', 'mode' y 'engine' se aplican igual para todos los sujetos.
       - LUT: usa FREESURFER_HOME por defecto, o 'lut_path' si se proporciona.
+      - 'almacen': si se indica (junto con 'model_name'), HD50/HD95/HDmax y los voxeles de superficie
+        se agregan al almacén Parquet de métricas (ver almacen_metricas), con sujeto = id_sujeto(ref).
 
     Devuelve:
-      - DataFrame combinado (si hubo al menos un sujeto exitoso); de lo contrario, None.
+      - DataFrame combinado leído de 'hd95_combined.csv' (si hubo al menos un sujeto exitoso); de lo contrario, None.
     """
+    if almacen is not None and not model_name:
+        raise ValueError("Para escribir en el almacén de métricas hay que indicar 'model_name'.")
+
     refs = _read_paths_txt(refs_txt)
     preds = _read_paths_txt(preds_txt)
 
@@ -437,51 +594,128 @@ def batch_hd95_from_txt(
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    combined: List[pd.DataFrame] = []
     total = len(refs)
-    logger.info(f"[BATCH HD95] Pares a procesar: {total}")
-
-    for i, (ref_path, pred_path) in enumerate(zip(refs, preds), start=1):
-        subject_id = ref_path.stem  # usamos el basename del archivo de referencia
-        out_csv = out_dir / f"hd95_{subject_id}.csv"
-
-        #logger.info(f"[{i}/{total}] Procesando sujeto '{subject_id}'")
-        try:
-            df = compute_hd_metrics_per_label(
-                ref_path=ref_path,
-                pred_path=pred_path,
-                out_csv=out_csv,
-                lut_path=lut_path,
-                min_voxels=min_voxels,
-                verbose=verbose,
-                select=select,
-                mode=mode,
-            )
-            if df is not None and not df.empty:
-                df2 = df.copy()
-                df2.insert(0, "subject_id", subject_id)
-                combined.append(df2)
-            else:
-                logger.warning(f"[{subject_id}] DataFrame vacío. Revisa si hubo filtros que dejaron sin etiquetas.")
-        except Exception as e:
-            logger.error(f"[{subject_id}] Error durante el procesamiento: {e}")
+    logger.info(f"[BATCH HD95] Pares a procesar: {total} (workers={workers})")
+
+    # ID único por sujeto: nombre del CSV por sujeto, columna 'subject_id' y clave del almacén
+    subject_ids = ids_sujetos(refs)
+    tareas = [
+        (ref_path, pred_path, out_dir / f"hd95_{subject_id}.csv", lut_path, min_voxels, verbose, select, mode, engine)
+        for ref_path, pred_path, subject_id in zip(refs, preds, subject_ids)
+    ]
+
+    # El combinado se crea con el primer sujeto exitoso y se le agregan filas a medida que llegan
+    combined_csv = out_dir / "hd95_combined.csv"
+    if combined_csv.exists():
+        combined_csv.unlink()
+
+    # Las filas del almacén (formato largo, sólo las métricas) se arman con cada sujeto que llega;
+    # las tablas por sujeto no se acumulan
+    filas_almacen: List[pd.DataFrame] = []
+    for k, df, error in ejecutar_en_orden(_hd_metrics_par, tareas, workers=workers, reintentos=reintentos):
+        subject_id = subject_ids[k]
+        if error is not None:
+            logger.error(f"[{subject_id}] Error durante el procesamiento: {error}")
             continue
+        if df is not None and not df.empty:
+            df2 = df.copy()
+            df2.insert(0, "subject_id", subject_id)
+            df2.to_csv(combined_csv, mode="a", header=not combined_csv.exists(), index=False)
+            if almacen is not None:
+                filas_almacen.append(formato_largo(
+                    df2, modelo=model_name, sujeto=subject_id, etiqueta="label_id", estructura="label_name",
+                    metricas=["hd50_mm", "hd95_mm", "hdmax_mm", "n_surf_ref", "n_surf_pred"],
+                ))
+        else:
+            logger.warning(f"[{subject_id}] DataFrame vacío. Revisa si hubo filtros que dejaron sin etiquetas.")
 
-    if not combined:
+    if not combined_csv.exists():
         logger.warning("[BATCH HD95] No se generó ningún resultado. No se creará el CSV combinado.")
         return None
 
-    df_comb = pd.concat(combined, ignore_index=True)
-    combined_csv = out_dir / "hd95_combined.csv"
-    df_comb.to_csv(combined_csv, index=False)
     logger.info(f"[BATCH HD95] CSV combinado guardado en: {combined_csv}")
-    return df_comb
+    if almacen is not None:
+        agregar_metricas(almacen, filas_almacen)
+    # Se devuelve leído del CSV (una sola copia, al final) en lugar de concatenar las tablas por sujeto
+    return pd.read_csv(combined_csv)
+
+
+# ============================================
+# Benchmark de motores de distancia (kdtree vs edt)
+# ============================================
+def benchmark_surface_engines(
+    ref_path: Union[str, Path],
+    pred_path: Union[str, Path],
+    labels: Optional[Iterable[int]] = None,
+    n_largest: int = 10,
+) -> pd.DataFrame:
+    """
+    Compara los motores 'kdtree' y 'edt' etiqueta por etiqueta sobre un par (ref, pred) en la misma rejilla.
+    Por defecto usa las 'n_largest' etiquetas corticales (1000-2999) más grandes de ref.
+    Devuelve un DataFrame con tiempos de cada motor, aceleración y diferencias absolutas (mm)
+    de HD50/HD95/HDmax entre ambos.
+    """
+    import time
+
+    _, ref_data, ref_affine = load_label_image(Path(ref_path))
+    _, pred_data, pred_affine = load_label_image(Path(pred_path))
+    if not same_grid(ref_data.shape, ref_affine, pred_data.shape, pred_affine):
+        raise ValueError("El benchmark requiere ref y pred en la misma rejilla (misma forma y afín).")
+
+    max_label = int(max(ref_data.max(), pred_data.max(), 0))
+    counts_ref = np.bincount(ref_data[ref_data > 0], minlength=max_label + 1)
+    counts_pred = np.bincount(pred_data[pred_data > 0], minlength=max_label + 1)
+    if labels is None:
+        corticales = [l for l in np.flatnonzero(counts_ref) if 1000 <= l < 3000]
+        labels = sorted(corticales, key=lambda l: counts_ref[l], reverse=True)[:n_largest]
+    labels = [int(l) for l in labels if l <= max_label and counts_ref[l] > 0 and counts_pred[l] > 0]
+
+    bboxes_ref = label_bounding_boxes(ref_data, max_label)
+    bboxes_pred = label_bounding_boxes(pred_data, max_label)
+
+    rows: List[Dict[str, object]] = []
+    for lab in labels:
+        resultados = {}
+        for engine in SURFACE_ENGINES:
+            inicio = time.perf_counter()
+            _, _, d_ref_pred, d_pred_ref = label_surface_distances_mm(
+                ref_data, pred_data, ref_affine, pred_affine, lab,
+                bboxes_ref[lab - 1], bboxes_pred[lab - 1], engine=engine,
+            )
+            hd = hd50_hd95_hdmax_from_distances(d_ref_pred, d_pred_ref)
+            resultados[engine] = (time.perf_counter() - inicio, hd)
+
+        (t_kd, hd_kd), (t_edt, hd_edt) = resultados["kdtree"], resultados["edt"]
+        rows.append({
+            "label_id": lab,
+            "n_vox_ref": int(counts_ref[lab]),
+            "t_kdtree_s": t_kd,
+            "t_edt_s": t_edt,
+            "speedup": t_kd / t_edt if t_edt > 0 else np.nan,
+            "diff_hd50_mm": abs(hd_kd[0] - hd_edt[0]),
+            "diff_hd95_mm": abs(hd_kd[1] - hd_edt[1]),
+            "diff_hdmax_mm": abs(hd_kd[2] - hd_edt[2]),
+        })
+        logger.info(f"[BENCH] Label {lab}: kdtree {t_kd:.3f} s | edt {t_edt:.3f} s | "
+                    f"ΔHD95 = {rows[-1]['diff_hd95_mm']:.4f} mm")
+
+    df = pd.DataFrame(rows)
+    if not df.empty:
+        logger.info(f"[BENCH] Aceleración total: x{df['t_kdtree_s'].sum() / df['t_edt_s'].sum():.1f} | "
+                    f"máx ΔHD95 = {df['diff_hd95_mm'].max():.4f} mm")
+    return df
 
 
 # ============================================
 # Ejemplo de uso (puedes ajustarlo o comentar)
 # ============================================
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="HD50/HD95/HDmax por etiqueta en lote (refs vs preds).")
+    parser.add_argument("--workers", type=int, default=workers_por_defecto(),
+                        help="Pares en paralelo (por defecto SLURM_CPUS_PER_TASK o 1).")
+    args = parser.parse_args()
+
     # Deben ser TXT con UNA ruta por línea (mismo orden y misma cantidad de líneas).
     refs_txt  = "/home/mbudani/data/data_2021/to_fast/paths_fs_resampled_to_fast_2021.txt"   # ← cada línea: /ruta/a/freesurfer_resampleado_X.nii.gz
     preds_txt = "/home/mbudani/results/fastsurfer_array_results_2021/path_to_fast_2021.txt"  # ← cada línea: /ruta/a/modelo_X.nii.gz
@@ -499,4 +733,12 @@ if __name__ == "__main__":
         verbose=True,
         select=[1002,1006,1007,1008,1012,1014,1028,1030,1035,2002,2006,2007,2008,2012,2014,2030,2035],          # o, por ejemplo: [1002, 1006, "Left-Hippocampus"]
         mode="all",           # 'all' | 'include' | 'exclude'
+        engine="kdtree",      # 'kdtree' | 'edt' (misma rejilla)
+        workers=args.workers, # pares en paralelo
     )
+
+    # Benchmark opcional de motores sobre el primer par (etiquetas corticales más grandes)
+    RUN_BENCHMARK = False
+    if RUN_BENCHMARK:
+        bench = benchmark_surface_engines(_read_paths_txt(refs_txt)[0], _read_paths_txt(preds_txt)[0])
+        print(bench.to_string(index=False))
@@ -52,6 +52,40 @@ def generar_csv_promedio(dir_csvs, nombre_salida="promedio.csv"):
     df_promedio.to_csv(salida, index=False, encoding="utf-8")
     print(f"✅ CSV promedio generado en: {salida}")
 
+def generar_csv_promedio_desde_almacen(raiz_almacen, modelo, metrica, salida):
+    """
+    Igual que generar_csv_promedio pero consultando el almacén Parquet de métricas
+    (almacen_metricas) en lugar de releer un CSV por sujeto.
+
+    Parámetros:
+    ----------
+    raiz_almacen : str or Path
+        Directorio del almacén de métricas.
+    modelo : str
+        Modelo a promediar (p. ej. "fastsurfer").
+    metrica : str
+        Métrica a promediar (p. ej. "dice", "hd95_mm", "volumen_mm3").
+    salida : str or Path
+        CSV de salida con columnas: etiqueta, estructura, <metrica>, n_sujetos.
+    """
+    from almacen_metricas import consultar
+
+    df = consultar(raiz_almacen, modelos=[modelo], metricas=[metrica])
+    if df.empty:
+        raise FileNotFoundError(f"❌ No hay valores de '{metrica}' para el modelo '{modelo}' en el almacén")
+
+    df_promedio = (
+        df.groupby(["etiqueta", "estructura"], as_index=False)
+          .agg(**{metrica: ("valor", "mean"), "n_sujetos": ("sujeto", "nunique")})
+    )
+    # Orden numérico cuando las etiquetas son IDs de la LUT
+    orden = pd.to_numeric(df_promedio["etiqueta"], errors="coerce")
+    df_promedio = df_promedio.iloc[orden.argsort(kind="stable")] if orden.notna().all() else df_promedio
+
+    salida = Path(salida)
+    df_promedio.to_csv(salida, index=False, encoding="utf-8")
+    print(f"✅ CSV promedio generado en: {salida}")
+
 #generar_csv_promedio("/home/mbudani/results/procesamiento/HD95/clinical", nombre_salida="csv_promedio.csv")
 #generar_csv_promedio("/home/mbudani/results/procesamiento/HD95/clinical/hdb5_cortex", nombre_salida="csv_promedio.csv")
 #generar_csv_promedio("/home/mbudani/results/procesamiento/HD95/clinical/hdb5_subcortex", nombre_salida="csv_promedio.csv")
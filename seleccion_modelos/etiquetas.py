@@ -0,0 +1,56 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Tuple, Union
+
+import nibabel as nib
+import numpy as np
+
+
+# ============================================================
+# Carga de mapas de etiquetas como enteros
+# ============================================================
+def _tipo_entero_minimo(vmin: int, vmax: int) -> np.dtype:
+    """El tipo entero más chico que representa [vmin, vmax] (sin signo si no hay negativos)."""
+    return np.result_type(np.min_scalar_type(vmin), np.min_scalar_type(vmax))
+
+
+def leer_etiquetas(img: nib.spatialimages.SpatialImage) -> np.ndarray:
+    """
+    Lee los datos de un mapa de etiquetas ya abierto con nibabel sin pasar por get_fdata() (float64):
+      - Lee el tipo guardado en disco a través de 'dataobj' (sin copia intermedia en float).
+      - Valida que los valores sean enteros (ValueError si no lo son).
+      - Devuelve el tipo entero más chico que alcanza (uint8 / uint16 / int16 / int32 ...).
+    """
+    proxy = img.dataobj
+    pendiente = getattr(proxy, "slope", 1.0)
+    intercepto = getattr(proxy, "inter", 0.0)
+    sin_escala = (np.isnan(pendiente) or pendiente == 1.0) and (np.isnan(intercepto) or intercepto == 0.0)
+
+    if sin_escala and hasattr(proxy, "get_unscaled"):
+        data = np.asanyarray(proxy.get_unscaled())
+    else:
+        data = np.asanyarray(proxy)
+
+    if data.size == 0:
+        return data.astype(np.uint8)
+
+    if not np.issubdtype(data.dtype, np.integer):
+        # Guardado como float (p. ej. algunos .nii de modelos): se exige que los valores sean enteros
+        if not np.isfinite(data).all():
+            raise ValueError("El mapa de etiquetas contiene valores no finitos (NaN/Inf).")
+        redondeado = np.round(data)
+        if np.abs(data - redondeado).max() > 1e-3:
+            raise ValueError("El mapa de etiquetas contiene valores no enteros (¿es una imagen de intensidades?).")
+        data = redondeado
+
+    vmin, vmax = int(data.min()), int(data.max())
+    tipo = _tipo_entero_minimo(vmin, vmax)
+    if data.dtype == tipo:
+        return data
+    return data.astype(tipo)
+
+
+def cargar_etiquetas(path: Union[str, Path]) -> Tuple[nib.spatialimages.SpatialImage, np.ndarray]:
+    """Abre un .mgz / .nii / .nii.gz y devuelve (imagen nibabel, etiquetas enteras de tipo mínimo)."""
+    img = nib.load(str(path))
+    return img, leer_etiquetas(img)
@@ -0,0 +1,269 @@
+from __future__ import annotations
+from pathlib import Path
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from calculo_dice import matriz_confusion_etiquetas, dice_desde_matriz_confusion
+from calculo_hd95 import (
+    SURFACE_ENGINES,
+    _read_paths_txt,
+    _resolve_requested_labels,
+    hd50_hd95_hdmax_from_distances,
+    label_bounding_boxes,
+    label_surface_distances_mm,
+    load_fs_lut,
+    same_grid,
+)
+from almacen_metricas import agregar_metricas, formato_largo, ids_sujetos
+from etiquetas import cargar_etiquetas
+from lotes_paralelos import ejecutar_en_orden, workers_por_defecto
+
+# =========================
+# Logging
+# =========================
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+logger = logging.getLogger("EVAL")
+
+# Columnas de la tabla de salida (una fila por sujeto y etiqueta)
+COLUMNAS = [
+    "subject_id", "modelo", "label_id", "label_name",
+    "n_vox_ref", "n_vox_pred", "vol_ref_mm3", "vol_pred_mm3", "vol_diff_mm3", "vol_diff_rel",
+    "interseccion", "dice",
+    "n_surf_ref", "n_surf_pred", "hd50_mm", "hd95_mm", "hdmax_mm",
+]
+
+
+# ============================================================
+# Carga (una sola vez por volumen)
+# ============================================================
+def _cargar_volumen(path: Union[str, Path]) -> Tuple[np.ndarray, np.ndarray]:
+    """Devuelve (etiquetas enteras, afín 4x4) leyendo el archivo una única vez."""
+    img, data = cargar_etiquetas(path)
+    return data, img.affine
+
+
+def volumen_voxel_mm3(affine: np.ndarray) -> float:
+    """Volumen de un voxel en mm³ (determinante de la parte 3x3 del afín)."""
+    return float(abs(np.linalg.det(np.asarray(affine)[:3, :3])))
+
+
+# ============================================================
+# Evaluación de un par
+# ============================================================
+def evaluar_par(
+    ref_path: Union[str, Path],
+    pred_path: Union[str, Path],
+    *,
+    lut: Optional[Dict[int, str]] = None,
+    lut_path: Optional[Path] = None,
+    min_voxels: int = 50,
+    select: Optional[Iterable[Union[int, str]]] = None,
+    mode: str = "all",
+    engine: str = "kdtree",
+) -> pd.DataFrame:
+    """
+    Calcula en una sola carga de ref y pred, por etiqueta:
+      - DICE, voxeles e intersección (matriz de confusión, una pasada).
+      - Volumen en mm³ de cada lado y diferencia absoluta/relativa (pred - ref).
+      - Voxeles de superficie y HD50/HD95/HDmax (recorte por etiqueta, motor 'kdtree' o 'edt').
+    Reglas:
+      - Se evalúan las etiquetas presentes en AMBOS volúmenes, sin el fondo (0).
+      - 'select' + 'mode' ('all' | 'include' | 'exclude') como en calculo_dice / calculo_hd95.
+      - HD sólo para etiquetas con al menos 'min_voxels' en ambos (si no, NaN).
+    Devuelve un DataFrame con COLUMNAS (subject_id y modelo vacíos; los completa el lote).
+    """
+    mode = mode.lower().strip()
+    if mode not in {"all", "include", "exclude"}:
+        raise ValueError("El parámetro 'mode' debe ser 'all', 'include' o 'exclude'.")
+    engine = engine.lower().strip()
+    if engine not in SURFACE_ENGINES:
+        raise ValueError(f"El parámetro 'engine' debe ser uno de {SURFACE_ENGINES}.")
+    if lut is None:
+        lut = load_fs_lut(lut_path)
+
+    ref_data, ref_affine = _cargar_volumen(ref_path)
+    pred_data, pred_affine = _cargar_volumen(pred_path)
+    if ref_data.shape != pred_data.shape:
+        raise ValueError("Los volúmenes tienen dimensiones diferentes. Asegúrate de re-muestrear antes.")
+    if engine == "edt" and not same_grid(ref_data.shape, ref_affine, pred_data.shape, pred_affine):
+        logger.warning("engine='edt' requiere ref y pred en la misma rejilla -> se usa 'kdtree'.")
+        engine = "kdtree"
+
+    # Una pasada: conteos, intersecciones y DICE de todas las etiquetas
+    etiquetas_ref, etiquetas_pred, C = matriz_confusion_etiquetas(ref_data, pred_data)
+    candidatas = (set(etiquetas_ref.tolist()) & set(etiquetas_pred.tolist())) - {0}
+
+    if mode == "all" or not select:
+        finales = candidatas
+    else:
+        seleccion = _resolve_requested_labels(select, lut)
+        finales = candidatas & seleccion if mode == "include" else candidatas - seleccion
+
+    if not finales:
+        logger.warning("No hay etiquetas para evaluar tras aplicar select/mode.")
+        return pd.DataFrame(columns=COLUMNAS)
+
+    por_etiqueta = dice_desde_matriz_confusion(etiquetas_ref, etiquetas_pred, C, sorted(finales))
+
+    # Bounding boxes de todas las etiquetas (una pasada por volumen) para las superficies
+    max_label = int(max(etiquetas_ref.max(), etiquetas_pred.max(), 0))
+    bboxes_ref = label_bounding_boxes(ref_data, max_label)
+    bboxes_pred = label_bounding_boxes(pred_data, max_label)
+
+    v_ref = volumen_voxel_mm3(ref_affine)
+    v_pred = volumen_voxel_mm3(pred_affine)
+
+    rows: List[Dict[str, object]] = []
+    for lab, (dice, n_ref, n_pred, inter) in por_etiqueta.items():
+        n_surf_ref = n_surf_pred = 0
+        hd50 = hd95 = hdmax = np.nan
+        if n_ref >= min_voxels and n_pred >= min_voxels:
+            n_surf_ref, n_surf_pred, d_ref_pred, d_pred_ref = label_surface_distances_mm(
+                ref_data, pred_data, ref_affine, pred_affine, lab,
+                bboxes_ref[lab - 1], bboxes_pred[lab - 1], engine=engine,
+            )
+            if n_surf_ref > 0 and n_surf_pred > 0:
+                hd50, hd95, hdmax = hd50_hd95_hdmax_from_distances(d_ref_pred, d_pred_ref)
+
+        vol_ref = n_ref * v_ref
+        vol_pred = n_pred * v_pred
+        rows.append({
+            "subject_id": "",
+            "modelo": "",
+            "label_id": lab,
+            "label_name": lut.get(lab, ""),
+            "n_vox_ref": n_ref,
+            "n_vox_pred": n_pred,
+            "vol_ref_mm3": vol_ref,
+            "vol_pred_mm3": vol_pred,
+            "vol_diff_mm3": vol_pred - vol_ref,
+            "vol_diff_rel": (vol_pred - vol_ref) / vol_ref if vol_ref > 0 else np.nan,
+            "interseccion": inter,
+            "dice": dice,
+            "n_surf_ref": n_surf_ref,
+            "n_surf_pred": n_surf_pred,
+            "hd50_mm": hd50,
+            "hd95_mm": hd95,
+            "hdmax_mm": hdmax,
+        })
+
+    return pd.DataFrame(rows, columns=COLUMNAS)
+
+
+# ============================================================
+# Lote desde dos TXT
+# ============================================================
+def _evaluar_par_lote(ref_path, pred_path, lut, min_voxels, select, mode, engine) -> pd.DataFrame:
+    """Evaluación de un par (se ejecuta en un proceso del pool cuando workers > 1)."""
+    return evaluar_par(ref_path, pred_path, lut=lut, min_voxels=min_voxels,
+                       select=select, mode=mode, engine=engine)
+
+
+def evaluar_batch_desde_txt(
+    refs_txt: Union[str, Path],
+    preds_txt: Union[str, Path],
+    out_csv: Union[str, Path],
+    *,
+    model_name: str,
+    lut_path: Optional[Path] = None,
+    min_voxels: int = 50,
+    select: Optional[Iterable[Union[int, str]]] = None,
+    mode: str = "all",
+    engine: str = "kdtree",
+    decimals: int = 3,
+    workers: int = 1,
+    reintentos: int = 1,
+    almacen: Optional[Union[str, Path]] = None,
+) -> Path:
+    """
+    Procesa N pares (ref, pred) leídos de dos TXT (una ruta por línea, mismo orden) y escribe
+    UNA tabla con todas las métricas (ver COLUMNAS), una fila por sujeto y etiqueta.
+    'subject_id' es el basename del ref (como en batch_hd95_from_txt). Las filas se agregan
+    al CSV a medida que terminan los pares, en el orden de los TXT.
+    'almacen': si se indica, todas las métricas se agregan además al almacén Parquet (almacen_metricas),
+    con sujeto = id_sujeto(ref), la misma clave que usan DICE, HD95 y volúmenes.
+    Devuelve la ruta del CSV.
+    """
+    refs = _read_paths_txt(refs_txt)
+    preds = _read_paths_txt(preds_txt)
+    if len(refs) != len(preds):
+        raise ValueError(
+            f"Cantidad de líneas diferente entre refs ({len(refs)}) y preds ({len(preds)}). "
+            f"Ambos TXT deben tener el MISMO número de rutas."
+        )
+
+    out_csv = Path(out_csv)
+    out_csv.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(columns=COLUMNAS).to_csv(out_csv, index=False)
+
+    # LUT una sola vez para todos los pares
+    lut = load_fs_lut(lut_path)
+    subject_ids = [ref_path.stem for ref_path in refs]
+    tareas = [(ref_path, pred_path, lut, min_voxels, select, mode, engine)
+              for ref_path, pred_path in zip(refs, preds)]
+    logger.info(f"[EVAL] Pares a procesar: {len(tareas)} (workers={workers}, engine={engine})")
+
+    n_ok = 0
+    filas_almacen: List[pd.DataFrame] = []
+    sujetos_almacen = ids_sujetos(refs) if almacen is not None else []
+    for k, df, error in ejecutar_en_orden(_evaluar_par_lote, tareas, workers=workers, reintentos=reintentos):
+        subject_id = subject_ids[k]
+        if error is not None:
+            logger.error(f"[{subject_id}] Error durante la evaluación: {error}")
+            continue
+        if df.empty:
+            logger.warning(f"[{subject_id}] Sin etiquetas evaluadas. Revisa los filtros.")
+            continue
+        df["subject_id"] = subject_id
+        df["modelo"] = model_name
+        df.round(decimals).to_csv(out_csv, mode="a", header=False, index=False)
+        if almacen is not None:
+            filas_almacen.append(formato_largo(df, modelo=model_name, sujeto=sujetos_almacen[k], etiqueta="label_id",
+                                               estructura="label_name", metricas=COLUMNAS[4:]))
+        n_ok += 1
+
+    if almacen is not None:
+        agregar_metricas(almacen, filas_almacen)
+
+    logger.info(f"[EVAL] Tabla guardada en: {out_csv} (sujetos evaluados: {n_ok}/{len(tareas)})")
+    return out_csv
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="DICE + HD50/HD95/HDmax + volúmenes por etiqueta en una sola carga por par.",
+        epilog="Ejemplo: python evaluacion_conjunta.py refs.txt preds.txt eval_fastsurfer.csv --modelo fastsurfer --workers 10",
+    )
+    parser.add_argument("refs_txt", help="TXT con rutas de referencia (FS), una por línea.")
+    parser.add_argument("preds_txt", help="TXT con rutas del modelo, mismo orden.")
+    parser.add_argument("out_csv", help="CSV de salida (una fila por sujeto y etiqueta).")
+    parser.add_argument("--modelo", required=True, help="Nombre del modelo (columna 'modelo').")
+    parser.add_argument("--lut", default=None, help="FreeSurferColorLUT.txt (por defecto, el de $FREESURFER_HOME).")
+    parser.add_argument("--min_voxels", type=int, default=50, help="Mínimo de voxeles para calcular HD.")
+    parser.add_argument("--select", nargs="*", default=None, help="IDs o nombres LUT a incluir/excluir.")
+    parser.add_argument("--mode", choices=["all", "include", "exclude"], default="all")
+    parser.add_argument("--engine", choices=list(SURFACE_ENGINES), default="kdtree",
+                        help="Motor de distancias entre superficies.")
+    parser.add_argument("--workers", type=int, default=workers_por_defecto(),
+                        help="Pares en paralelo (por defecto SLURM_CPUS_PER_TASK o 1).")
+    parser.add_argument("--almacen", default=None,
+                        help="Directorio del almacén Parquet de métricas al que agregar los resultados.")
+    args = parser.parse_args()
+
+    select = [int(s) if s.isdigit() else s for s in args.select] if args.select else None
+    evaluar_batch_desde_txt(
+        args.refs_txt, args.preds_txt, args.out_csv,
+        model_name=args.modelo,
+        lut_path=Path(args.lut) if args.lut else None,
+        min_voxels=args.min_voxels,
+        select=select,
+        mode=args.mode,
+        engine=args.engine,
+        workers=args.workers,
+        almacen=args.almacen,
+    )
@@ -1,10 +1,17 @@
 from pathlib import Path
+import os
+import gzip
+import json
+import hashlib
 import logging
-from typing import List, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
+import numpy as np
 import nibabel as nib
 from nilearn.image import resample_to_img
 
+from lotes_paralelos import ejecutar_en_orden, workers_por_defecto
+
 # ============================================
 # Logging
 # ============================================
@@ -75,6 +82,135 @@ def _next_non_clobber_path(base_out: Path) -> Path:
         k += 1
 
 
+# ============================================
+# Cache de resultados (hash de entradas)
+# ============================================
+def _sha256_archivo(p: Path, bloque: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for chunk in iter(lambda: f.read(bloque), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _sha256_grilla(img) -> str:
+    """
+    Hash de la grilla destino (shape + afín). El resample sólo depende de la grilla del modelo,
+    no de sus etiquetas: modelos distintos con la misma grilla comparten resultado.
+    """
+    h = hashlib.sha256()
+    h.update(repr(tuple(int(n) for n in img.shape[:3])).encode())
+    h.update(np.round(np.asarray(img.affine, dtype=float), 6).tobytes())
+    return h.hexdigest()
+
+
+def _sidecar(out_path: Path) -> Path:
+    """JSON con los hashes de entrada, junto al .nii.gz resampleado."""
+    return out_path.parent / f"{_strip_ext_nii_mgz(out_path)}.resample.json"
+
+
+def _claves_entrada(fs_p: Path, mdl_p: Path) -> Dict[str, str]:
+    return {
+        "fs": str(fs_p),
+        "fs_sha256": _sha256_archivo(fs_p),
+        "grid_sha256": _sha256_grilla(nib.load(str(mdl_p))),  # sólo lee la cabecera
+    }
+
+
+def _buscar_en_cache(base_out: Path, claves: Dict[str, str]) -> Optional[Path]:
+    """
+    Recorre <base>_toMODELgrid.nii.gz, _v2, _v3, ... y devuelve la primera salida existente
+    cuyo sidecar coincide con los hashes de entrada (None si no hay ninguna).
+    """
+    pure = _strip_ext_nii_mgz(base_out)
+    cand, k = base_out, 2
+    while cand.exists():
+        try:
+            guardado = json.loads(_sidecar(cand).read_text(encoding="utf-8"))
+            if (guardado.get("fs_sha256") == claves["fs_sha256"]
+                    and guardado.get("grid_sha256") == claves["grid_sha256"]):
+                return cand
+        except (OSError, ValueError):
+            pass  # salida sin sidecar (versiones anteriores) o ilegible: no se reutiliza
+        cand = base_out.parent / f"{pure}_v{k}.nii.gz"
+        k += 1
+    return None
+
+
+def _reservar_salida(base_out: Path, reservadas: Set[Path]) -> Path:
+    """Como _next_non_clobber_path, pero teniendo en cuenta las salidas ya asignadas en esta corrida."""
+    pure = _strip_ext_nii_mgz(base_out)
+    cand, k = base_out, 2
+    while cand.exists() or cand in reservadas:
+        cand = base_out.parent / f"{pure}_v{k}.nii.gz"
+        k += 1
+    reservadas.add(cand)
+    return cand
+
+
+# ============================================
+# Resample
+# ============================================
+def _indices_enteros(img_fs, img_mdl) -> Optional[List[Tuple[int, np.ndarray]]]:
+    """
+    Si la grilla del modelo coincide con la de FS salvo permutación/inversión de ejes y un
+    desplazamiento entero de voxeles (p. ej. afín identidad), el vecino más cercano es una
+    indexación entera: devuelve, para cada eje destino j, (eje de origen, índices de origen).
+    Si no, devuelve None (se usa nilearn).
+    """
+    if len(img_fs.shape) != 3 or len(img_mdl.shape) < 3:
+        return None
+    T = np.linalg.inv(img_fs.affine) @ img_mdl.affine  # ijk destino -> ijk origen
+    R = np.round(T[:3, :3])
+    t = np.round(T[:3, 3])
+    if not (np.allclose(T[:3, :3], R, atol=1e-4) and np.allclose(T[:3, 3], t, atol=1e-3)):
+        return None
+    if not ((np.abs(R).sum(axis=0) == 1).all() and (np.abs(R).sum(axis=1) == 1).all()):
+        return None
+    ejes = []
+    for j in range(3):
+        a = int(np.flatnonzero(R[:, j])[0])
+        ejes.append((a, int(R[a, j]) * np.arange(img_mdl.shape[j]) + int(t[a])))
+    return ejes
+
+
+def _resample_indices_enteros(img_fs, img_mdl, ejes: List[Tuple[int, np.ndarray]]):
+    """Vecino más cercano por indexación entera (voxeles fuera de FS quedan en 0, como en nilearn)."""
+    data = np.asanyarray(img_fs.dataobj)
+    src = np.transpose(data, [a for a, _ in ejes])
+    validos = [(idx >= 0) & (idx < data.shape[a]) for a, idx in ejes]
+    out = np.zeros(tuple(int(n) for n in img_mdl.shape[:3]), dtype=data.dtype)
+    out[np.ix_(*[np.flatnonzero(v) for v in validos])] = src[np.ix_(*[idx[v] for (_, idx), v in zip(ejes, validos)])]
+    return nib.Nifti1Image(out, img_mdl.affine)
+
+
+def _guardar_comprimido(img, out_path: Path, nivel: int) -> None:
+    """Guarda .nii.gz con el nivel de gzip pedido, escribiendo a un temporal y renombrando."""
+    img = nib.Nifti1Image(np.asanyarray(img.dataobj), img.affine, img.header)
+    tmp = out_path.parent / f".{out_path.name}.tmp"
+    with gzip.open(tmp, "wb", compresslevel=nivel) as f:
+        f.write(img.to_bytes())
+    os.replace(tmp, out_path)
+
+
+def _resample_par(fs_p: Path, mdl_p: Path, out_path: Path, claves: Dict[str, str], nivel_compresion: int) -> str:
+    """Resamplea un par y escribe la salida y su sidecar. Se ejecuta en un proceso del pool."""
+    img_fs = nib.load(str(fs_p))
+    img_mdl = nib.load(str(mdl_p))
+
+    ejes = _indices_enteros(img_fs, img_mdl)
+    if ejes is not None:
+        res_img, metodo = _resample_indices_enteros(img_fs, img_mdl, ejes), "indices_enteros"
+    else:
+        # Resample a la grilla del modelo (nearest para etiquetas)
+        res_img, metodo = resample_to_img(img_fs, img_mdl, interpolation="nearest"), "nilearn"
+
+    _guardar_comprimido(res_img, out_path, nivel_compresion)
+    # El sidecar se escribe al final: una salida a medio escribir nunca coincide con la cache
+    _sidecar(out_path).write_text(json.dumps(dict(claves, metodo=metodo), indent=2), encoding="utf-8")
+    return metodo
+
+
 # ============================================
 # Resample batch
 # ============================================
@@ -82,7 +218,11 @@ def batch_resample_fs_to_model(
     fs_txt: Path,
     model_txt: Path,
     out_dir: Path,
-    out_txt_name: str = "paths_fs_resampled.txt"
+    out_txt_name: str = "paths_fs_resampled.txt",
+    *,
+    workers: int = 1,
+    nivel_compresion: int = 1,
+    usar_cache: bool = True,
 ) -> Tuple[int, int]:
     """
     Lee dos .txt (FS y Modelo), una ruta por línea (mismo orden y cantidad).
@@ -90,6 +230,12 @@ def batch_resample_fs_to_model(
       - resamplea fs_i al espacio de model_i (nearest)
       - guarda en out_dir con nombre: <basename_FS>_toMODELgrid.nii.gz
       - si existe, agrega sufijo incremental _v2, _v3, ...
+    Cache: cada salida lleva un <nombre>.resample.json con el hash del archivo FS y de la grilla
+    del modelo; si ya existe una salida con los mismos hashes se reutiliza en lugar de recalcularla
+    (agregar un modelo nuevo con la misma grilla no vuelve a resamplear FS).
+    Si la grilla del modelo coincide con la de FS (afín identidad, o sólo permutación/inversión de ejes
+    y desplazamiento entero) se usa indexación entera en lugar de nilearn.
+    'workers' > 1 resamplea los pares en paralelo; 'nivel_compresion' es el nivel de gzip (0-9).
     Al final, escribe en out_dir/<out_txt_name> las rutas resultantes (una por línea).
     Devuelve (n_ok, n_fail)
     """
@@ -114,34 +260,48 @@ def batch_resample_fs_to_model(
     out_dir.mkdir(parents=True, exist_ok=True)
 
     out_txt_path = out_dir / out_txt_name
-    saved_paths: List[Path] = []
     n_ok = 0
     n_fail = 0
+    n_cache = 0
 
+    # Planificación (secuencial): reutilizar salidas en cache y reservar nombres para el resto,
+    # así los procesos del pool nunca compiten por el mismo nombre de salida
+    rutas_salida: List[Optional[Path]] = [None] * len(fs_paths)
+    tareas = []
+    indices_tareas: List[int] = []
+    reservadas: Set[Path] = set()
     for idx, (fs_p, mdl_p) in enumerate(zip(fs_paths, model_paths), start=1):
         try:
             logger.info(f"[{idx}/{len(fs_paths)}] FS -> {fs_p.name}   |   Modelo -> {mdl_p.name}")
-
-            img_fs = nib.load(str(fs_p))
-            img_mdl = nib.load(str(mdl_p))
-
-            # Resample a la grilla del modelo (nearest para etiquetas)
-            res_img = resample_to_img(img_fs, img_mdl, interpolation="nearest")
-
-            # Nombre de salida: basename(FS) + _toMODELgrid.nii.gz
-            base_name = _strip_ext_nii_mgz(fs_p)
-            out_path = out_dir / f"{base_name}_toMODELgrid.nii.gz"
-            out_path = _next_non_clobber_path(out_path)
-
-            nib.save(res_img, str(out_path))
-            saved_paths.append(out_path)
-            n_ok += 1
-            logger.info(f"  ✓ guardado: {out_path}")
-
+            base_out = out_dir / f"{_strip_ext_nii_mgz(fs_p)}_toMODELgrid.nii.gz"
+            claves = _claves_entrada(fs_p, mdl_p)
+            en_cache = _buscar_en_cache(base_out, claves) if usar_cache else None
+            if en_cache is not None and en_cache not in reservadas:
+                reservadas.add(en_cache)
+                rutas_salida[idx - 1] = en_cache
+                n_ok += 1
+                n_cache += 1
+                logger.info(f"  = en cache: {en_cache}")
+                continue
+            out_path = _reservar_salida(base_out, reservadas)
+            tareas.append((fs_p, mdl_p, out_path, claves, nivel_compresion))
+            indices_tareas.append(idx - 1)
         except Exception as e:
             n_fail += 1
             logger.error(f"  ✗ error en el par {idx}: {e}")
 
+    for k, metodo, error in ejecutar_en_orden(_resample_par, tareas, workers=workers):
+        i = indices_tareas[k]
+        if error is not None:
+            n_fail += 1
+            logger.error(f"  ✗ error en el par {i + 1}: {error}")
+            continue
+        rutas_salida[i] = tareas[k][2]
+        n_ok += 1
+        logger.info(f"  ✓ guardado ({metodo}): {rutas_salida[i]}")
+
+    saved_paths = [p for p in rutas_salida if p is not None]
+
     # Escribir TXT con rutas guardadas
     try:
         out_txt_content = "\n".join(str(p) for p in saved_paths)
@@ -151,7 +311,7 @@ def batch_resample_fs_to_model(
         logger.error(f"No se pudo escribir el TXT de salida: {out_txt_path} ({e})")
         # no levantamos excepción para no perder el conteo, pero avisamos
 
-    logger.info(f"Resample terminado. OK={n_ok} | FAIL={n_fail}")
+    logger.info(f"Resample terminado. OK={n_ok} (en cache: {n_cache}) | FAIL={n_fail}")
     return n_ok, n_fail
 
 
@@ -175,4 +335,6 @@ if __name__ == "__main__":
         model_txt=model_txt_path,
         out_dir=out_dir,
         out_txt_name=out_list_name,
+        workers=workers_por_defecto(),   # pares en paralelo (SLURM_CPUS_PER_TASK o 1)
+        nivel_compresion=1,              # gzip 0-9
     )
@@ -7,18 +7,38 @@ file_path1 = "/home/mbudani/results/procesamiento/DICE/synthsegDICE/csv_promedio
 file_path2 = "/home/mbudani/results/procesamiento/DICE/clinicalDICE/csv_promedio.csv"   # Cambia esto con la ruta de tu segundo archivo CSV
 file_path3 = "/home/mbudani/results/procesamiento/DICE/fastsurferDICE/csv_promedio.csv" # Cambia esto con la ruta de tu tercer archivo CSV
 
-# Cargar los datos de los tres archivos CSV
-data1 = pd.read_csv(file_path1)
-data2 = pd.read_csv(file_path2)
-data3 = pd.read_csv(file_path3)
+# Almacén de métricas (si se indica, se usa en lugar de los csv_promedio.csv)
+almacen = None  # p. ej. "/home/mbudani/results/procesamiento/almacen_metricas"
+modelos_almacen = {"synthseg": "SynthSeg", "clinical": "Recon-all-Clinical", "fastsurfer": "FastSurfer"}
 
-# Añadir la columna 'Modelo' para identificar los diferentes modelos
-data1['Modelo'] = 'SynthSeg'
-data2['Modelo'] = 'Recon-all-Clinical'
-data3['Modelo'] = 'FastSurfer'
+if almacen is not None:
+    # Promedio de DICE por estructura y modelo, calculado sobre el almacén
+    from almacen_metricas import resumen_por_etiqueta
+    promedios = resumen_por_etiqueta(almacen, "dice", modelos=list(modelos_almacen))
+    combined_data = (
+        promedios.rename(columns=modelos_almacen)
+                 .reset_index()
+                 .melt(id_vars="estructura", var_name="Modelo", value_name="DICE")
+                 .rename(columns={"estructura": "Estructura"})
+                 .dropna(subset=["DICE"])
+    )
+    # Mismo orden de modelos que con los CSV
+    combined_data["Modelo"] = pd.Categorical(combined_data["Modelo"], categories=list(modelos_almacen.values()), ordered=True)
+    combined_data = combined_data.sort_values("Modelo", kind="stable").reset_index(drop=True)
+    combined_data["Modelo"] = combined_data["Modelo"].astype(str)
+else:
+    # Cargar los datos de los tres archivos CSV
+    data1 = pd.read_csv(file_path1)
+    data2 = pd.read_csv(file_path2)
+    data3 = pd.read_csv(file_path3)
+
+    # Añadir la columna 'Modelo' para identificar los diferentes modelos
+    data1['Modelo'] = 'SynthSeg'
+    data2['Modelo'] = 'Recon-all-Clinical'
+    data3['Modelo'] = 'FastSurfer'
 
-# Concatenar los tres DataFrames
-combined_data = pd.concat([data1, data2, data3], ignore_index=True)
+    # Concatenar los tres DataFrames
+    combined_data = pd.concat([data1, data2, data3], ignore_index=True)
 
 # Crear el gráfico de cajas
 plt.figure(figsize=(10, 6))
@@ -23,6 +23,26 @@ def load_and_pivot(file_map, metric, col_metric, col_struct):
         pivoted = pivoted.loc[pivoted.mean(axis=1).sort_values(ascending=True).index]
     return pivoted
 
+# =========================
+# Alternativa: pivotear desde el almacén de métricas (sin leer CSVs)
+# =========================
+def load_and_pivot_almacen(raiz_almacen, model_map, metric, metrica_almacen):
+    """
+    Igual que load_and_pivot, pero con el promedio por estructura y modelo calculado
+    directamente sobre el almacén Parquet (almacen_metricas). model_map: {nombre_en_almacen: nombre_en_grafico}.
+    """
+    from almacen_metricas import resumen_por_etiqueta
+    pivoted = resumen_por_etiqueta(raiz_almacen, metrica_almacen, modelos=list(model_map))
+    pivoted = pivoted.rename(columns=model_map)
+    pivoted = pivoted[[m for m in model_map.values() if m in pivoted.columns]]
+    pivoted.index.name = "Estructura"
+    pivoted.columns.name = "Modelo"
+    if metric.lower() == "dice":
+        pivoted = pivoted.loc[pivoted.mean(axis=1).sort_values(ascending=False).index]
+    else:
+        pivoted = pivoted.loc[pivoted.mean(axis=1).sort_values(ascending=True).index]
+    return pivoted
+
 # =========================
 # Función para crear máscara de resaltado del mejor valor
 # =========================
@@ -51,11 +71,19 @@ files_hd95 = {
     "Recon-all Clinical": "/home/mbudani/results/procesamiento/HD95/clinical/csv_promedio.csv"
 }
 
+# Almacén de métricas (si se indica, se usa en lugar de los csv_promedio.csv)
+almacen = None  # p. ej. "/home/mbudani/results/procesamiento/almacen_metricas"
+modelos_almacen = {"synthseg": "SynthSeg", "fastsurfer": "FastSurfer", "clinical": "Recon-all Clinical"}
+
 # =========================
 # Cargar datos
 # =========================
-pivot_dice = load_and_pivot(files_dice, metric="DICE", col_metric="DICE", col_struct="Estructura")
-pivot_hd95 = load_and_pivot(files_hd95, metric="HD95", col_metric="hd95_mm", col_struct="label_name")
+if almacen is not None:
+    pivot_dice = load_and_pivot_almacen(almacen, modelos_almacen, metric="DICE", metrica_almacen="dice")
+    pivot_hd95 = load_and_pivot_almacen(almacen, modelos_almacen, metric="HD95", metrica_almacen="hd95_mm")
+else:
+    pivot_dice = load_and_pivot(files_dice, metric="DICE", col_metric="DICE", col_struct="Estructura")
+    pivot_hd95 = load_and_pivot(files_hd95, metric="HD95", col_metric="hd95_mm", col_struct="label_name")
 
 # =========================
 # Crear máscaras de resaltado
@@ -0,0 +1,129 @@
+from __future__ import annotations
+import os
+import logging
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+# =========================
+# Logging
+# =========================
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+logger = logging.getLogger("LOTES")
+
+
+def workers_por_defecto() -> int:
+    """CPUs asignadas por SLURM (SLURM_CPUS_PER_TASK) o 1 si no se corre bajo SLURM."""
+    try:
+        return max(1, int(os.environ.get("SLURM_CPUS_PER_TASK", "1")))
+    except ValueError:
+        return 1
+
+
+def _describir_error(e: BaseException) -> str:
+    return f"{type(e).__name__}: {e}"
+
+
+# ============================================================
+# Ejecución de pares independientes (en orden, con reintentos)
+# ============================================================
+def ejecutar_en_orden(
+    funcion: Callable,
+    tareas: Sequence[Tuple],
+    *,
+    workers: int = 1,
+    reintentos: int = 1,
+    en_vuelo: Optional[int] = None,
+) -> Iterator[Tuple[int, object, Optional[str]]]:
+    """
+    Ejecuta funcion(*tarea) para cada tarea y va devolviendo (indice, resultado, error) EN EL ORDEN
+    de 'tareas', a medida que se completan (un resultado se entrega en cuanto terminaron todos los anteriores).
+
+      - workers <= 1: ejecución secuencial en el mismo proceso.
+      - workers > 1 : pool de procesos. Como mucho 'en_vuelo' tareas (por defecto 2*workers) están
+        enviadas o esperando su turno de entrega, lo que acota la memoria (volúmenes cargados y
+        resultados retenidos).
+      - Cada tarea que falla se reintenta hasta 'reintentos' veces; si sigue fallando se entrega
+        con resultado None y el error como texto, sin afectar al resto.
+      - Si un proceso del pool muere (p. ej. por falta de memoria) se crea un pool nuevo y las
+        tareas que estaban en curso se reenvían (cuenta como un intento para cada una).
+
+    'funcion' y los argumentos deben poder serializarse (funciones de nivel de módulo).
+    """
+    tareas = list(tareas)
+    n = len(tareas)
+
+    if workers is None or workers <= 1:
+        for i, args in enumerate(tareas):
+            for intento in range(reintentos + 1):
+                try:
+                    resultado = funcion(*args)
+                except Exception as e:
+                    error = _describir_error(e)
+                    if intento < reintentos:
+                        logger.warning(f"[{i + 1}/{n}] Falló ({error}); reintento {intento + 1}/{reintentos}.")
+                    continue
+                yield i, resultado, None
+                break
+            else:
+                yield i, None, error
+        return
+
+    en_vuelo = max(en_vuelo or 2 * workers, workers)
+    intentos: List[int] = [0] * n
+    listos = {}              # indice -> (resultado, error), esperando su turno de entrega
+    pendientes = {}          # futuro -> indice
+    reenvios: List[int] = []
+    siguiente_envio = 0
+    siguiente_entrega = 0
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while siguiente_entrega < n:
+            # Reenvíos primero; luego tareas nuevas mientras haya lugar
+            while reenvios:
+                i = reenvios.pop(0)
+                pendientes[pool.submit(funcion, *tareas[i])] = i
+            while siguiente_envio < n and siguiente_envio - siguiente_entrega < en_vuelo:
+                pendientes[pool.submit(funcion, *tareas[siguiente_envio])] = siguiente_envio
+                siguiente_envio += 1
+
+            hechos, _ = wait(list(pendientes), return_when=FIRST_COMPLETED)
+            pool_roto = False
+            for futuro in hechos:
+                i = pendientes.pop(futuro)
+                intentos[i] += 1
+                try:
+                    listos[i] = (futuro.result(), None)
+                    continue
+                except BrokenProcessPool as e:
+                    pool_roto = True
+                    error = _describir_error(e)
+                except Exception as e:
+                    error = _describir_error(e)
+                if intentos[i] <= reintentos:
+                    logger.warning(f"[{i + 1}/{n}] Falló ({error}); reintento {intentos[i]}/{reintentos}.")
+                    reenvios.append(i)
+                else:
+                    listos[i] = (None, error)
+
+            if pool_roto:
+                # Las tareas que seguían en el pool roto se reenvían al pool nuevo
+                logger.warning("El pool de procesos se interrumpió; se crea uno nuevo.")
+                for futuro, i in pendientes.items():
+                    intentos[i] += 1
+                    if intentos[i] <= reintentos:
+                        reenvios.append(i)
+                    else:
+                        listos[i] = (None, "BrokenProcessPool: el proceso terminó abruptamente")
+                pendientes.clear()
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = ProcessPoolExecutor(max_workers=workers)
+                reenvios.sort()
+
+            while siguiente_entrega in listos:
+                resultado, error = listos.pop(siguiente_entrega)
+                yield siguiente_entrega, resultado, error
+                siguiente_entrega += 1
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -1,9 +1,12 @@
 from pathlib import Path
 import logging
-from typing import List, Dict, Tuple
+from typing import Iterable, List, Tuple, Union
 
 import pandas as pd
 
+from almacen_metricas import agregar_metricas, formato_largo, ids_sujetos
+from lotes_paralelos import ejecutar_en_orden, workers_por_defecto
+
 # ============================================================================
 # Logging
 # ============================================================================
@@ -45,69 +48,141 @@ def _find_colheaders(lines: List[str]) -> Tuple[int, List[str]]:
 # Parsers específicos
 # ============================================================================
 
-def parse_aseg_measures(path: Path) -> pd.DataFrame:
+COLUMNAS_LARGO = ["seccion", "id_corto", "descripcion", "valor", "unidad"]
+
+# Medidas globales de aseg.stats que se conservan (líneas '# Measure')
+ASEG_MEASURES_REQUERIDAS = {
+    "lhCortexVol",
+    "rhCortexVol",
+    "lhCerebralWhiteMatterVol",
+    "rhCerebralWhiteMatterVol",
+    "eTIV",
+}
+
+# Estructuras de aseg.stats que no se exportan
+ASEG_ESTRUCTURAS_IGNORADAS = {
+    "Left-vessel",
+    "Left-choroid-plexus",
+    "Right-vessel",
+    "Right-choroid-plexus",
+    "5th-Ventricle",
+    "WM-hypointensities",
+    "Left-WM-hypointensities",
+    "Right-WM-hypointensities",
+    "non-WM-hypointensities",
+    "Left-non-WM-hypointensities",
+    "Right-non-WM-hypointensities",
+    "Optic-Chiasm",
+    "CC_Posterior",
+    "CC_Mid_Posterior",
+    "CC_Central",
+    "CC_Mid_Anterior",
+    "CC_Anterior",
+}
+
+
+def _parse_aseg_lineas(lines: List[str], con_measures: bool = True, con_aseg: bool = True) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
-    Extrae *solo* las medidas globales especificadas desde 'aseg.stats',
-    en líneas '# Measure <id_largo>, <id_corto>, <descripcion>, <valor>, <unidad>'.
-
-    Sección: 'aseg.measures'
-    Columnas: seccion, id_corto, descripcion, valor, unidad
+    Recorre UNA vez las líneas de 'aseg.stats' y extrae a la vez:
+      - las medidas globales ('# Measure <id_largo>, <id_corto>, <descripcion>, <valor>, <unidad>'),
+        sección 'aseg.measures' (sólo ASEG_MEASURES_REQUERIDAS);
+      - la tabla por estructura (columnas por '# ColHeaders': StructName y Volume_mm3), sección 'aseg'.
+    Devuelve (df_measures, df_aseg), ambos con COLUMNAS_LARGO.
     """
-    REQUIRED_SHORT_IDS = {
-        "lhCortexVol",
-        "rhCortexVol",
-        "lhCerebralWhiteMatterVol",
-        "rhCerebralWhiteMatterVol",
-        "eTIV",
-    }
-
-    lines = _read_lines(path)
-    rows: List[Dict[str, object]] = []
+    measures: List[Tuple[str, str, str, float, str]] = []
+    aseg: List[Tuple[str, str, str, float, str]] = []
     found_ids = set()
-    total_lines = kept = skipped = 0
+    kept_m = skipped_m = kept_a = skipped_a = 0
+    headers: List[str] = []
+    idx_struct = idx_vol = -1
 
     for raw in lines:
-        total_lines += 1
         line = raw.strip()
-        if not line.lstrip().startswith("# Measure"):
+        if not line:
             continue
 
-        parts = [p.strip() for p in line.split(",")]
-        # Esperamos al menos: [ '# Measure ...', short_id, descripcion, valor, unidad ]
-        if len(parts) < 5:
-            logger.warning(f"[aseg.measures] Línea malformada (se saltea): {line}")
-            skipped += 1
+        if line.startswith("#"):
+            if con_measures and line.startswith("# Measure"):
+                parts = [p.strip() for p in line.split(",")]
+                # Esperamos al menos: [ '# Measure ...', short_id, descripcion, valor, unidad ]
+                if len(parts) < 5:
+                    logger.warning(f"[aseg.measures] Línea malformada (se saltea): {line}")
+                    skipped_m += 1
+                    continue
+                try:
+                    short_id = parts[1]
+                    descripcion = ", ".join(parts[2:-2]).strip()
+                    valor = float(parts[-2])
+                    unidad = parts[-1]
+                except Exception as e:
+                    logger.warning(f"[aseg.measures] No se pudo parsear (se saltea): {line} | Error: {e}")
+                    skipped_m += 1
+                    continue
+                # Guardar solo si es una de las requeridas
+                if short_id in ASEG_MEASURES_REQUERIDAS:
+                    found_ids.add(short_id)
+                    measures.append(("aseg.measures", short_id, descripcion, valor, unidad))
+                    kept_m += 1
+            elif con_aseg and line.startswith("# ColHeaders"):
+                # Ej: '# ColHeaders Index SegId NVoxels Volume_mm3 StructName'
+                headers = line[len("# ColHeaders"):].strip().split()
+                if not headers:
+                    logger.error("[aseg] Línea '# ColHeaders' sin columnas.")
+                    raise ValueError("Línea '# ColHeaders' sin columnas.")
+                try:
+                    idx_struct = headers.index("StructName")
+                    idx_vol = headers.index("Volume_mm3")
+                except ValueError:
+                    logger.error("[aseg] No se encontraron columnas requeridas: 'StructName' y 'Volume_mm3'")
+                    raise
             continue
 
+        # Filas de datos: sólo después del header
+        if not con_aseg or not headers:
+            continue
+        parts = line.split()
+        if len(parts) < len(headers):
+            logger.warning(f"[aseg] Fila corta (se saltea): {line}")
+            skipped_a += 1
+            continue
         try:
-            short_id = parts[1]
-            descripcion = ", ".join(parts[2:-2]).strip()
-            valor = float(parts[-2])
-            unidad = parts[-1]
+            struct_name = parts[idx_struct]
+            vol_mm3 = float(parts[idx_vol])
         except Exception as e:
-            logger.warning(f"[aseg.measures] No se pudo parsear (se saltea): {line} | Error: {e}")
-            skipped += 1
+            logger.warning(f"[aseg] No se pudo parsear fila (se saltea): {line} | Error: {e}")
+            skipped_a += 1
+            continue
+        if struct_name in ASEG_ESTRUCTURAS_IGNORADAS:
+            skipped_a += 1
             continue
+        aseg.append(("aseg", struct_name, struct_name, vol_mm3, "mm^3"))
+        kept_a += 1
 
-        # Guardar solo si es una de las requeridas
-        if short_id in REQUIRED_SHORT_IDS:
-            found_ids.add(short_id)
-            rows.append({
-                "seccion": "aseg.measures",
-                "id_corto": short_id,
-                "descripcion": descripcion,
-                "valor": valor,
-                "unidad": unidad
-            })
-            kept += 1
+    if con_measures:
+        # Avisar por las que faltaron (si alguna no apareció)
+        missing = ASEG_MEASURES_REQUERIDAS - found_ids
+        for m in sorted(missing):
+            logger.warning(f"[aseg.measures] Medida solicitada no encontrada en aseg.stats: {m}")
+        logger.info(f"[aseg.measures] medidas guardadas: {kept_m} | faltantes (warn): {len(missing)} | saltadas (malformadas): {skipped_m}")
+    if con_aseg:
+        if not headers:
+            logger.error("[aseg] No se encontró '# ColHeaders' en el archivo.")
+            raise ValueError("No se encontró '# ColHeaders' en el archivo.")
+        logger.info(f"[aseg] medidas guardadas: {kept_a} | saltadas: {skipped_a}")
 
-    # Avisar por las que faltaron (si alguna no apareció)
-    missing = REQUIRED_SHORT_IDS - found_ids
-    for m in sorted(missing):
-        logger.warning(f"[aseg.measures] Medida solicitada no encontrada en aseg.stats: {m}")
+    return (pd.DataFrame.from_records(measures, columns=COLUMNAS_LARGO),
+            pd.DataFrame.from_records(aseg, columns=COLUMNAS_LARGO))
 
-    logger.info(f"[aseg.measures] medidas guardadas: {kept} | faltantes (warn): {len(missing)} | saltadas (malformadas): {skipped}")
-    return pd.DataFrame(rows, columns=["seccion", "id_corto", "descripcion", "valor", "unidad"])
+
+def parse_aseg_measures(path: Path) -> pd.DataFrame:
+    """
+    Extrae *solo* las medidas globales especificadas desde 'aseg.stats',
+    en líneas '# Measure <id_largo>, <id_corto>, <descripcion>, <valor>, <unidad>'.
+
+    Sección: 'aseg.measures'
+    Columnas: seccion, id_corto, descripcion, valor, unidad
+    """
+    return _parse_aseg_lineas(_read_lines(path), con_aseg=False)[0]
 
 
 def parse_aseg_stats(path: Path) -> pd.DataFrame:
@@ -119,79 +194,15 @@ def parse_aseg_stats(path: Path) -> pd.DataFrame:
       - descripcion: igual a id_corto
     Sección: 'aseg'
     """
-    lines = _read_lines(path)
-    try:
-        header_idx, headers = _find_colheaders(lines)
-    except ValueError as e:
-        logger.error(f"[aseg] {e}")
-        raise
-
-    # Mapeo de columnas requeridas
-    try:
-        idx_struct = headers.index("StructName")
-        idx_vol = headers.index("Volume_mm3")
-    except ValueError:
-        logger.error("[aseg] No se encontraron columnas requeridas: 'StructName' y 'Volume_mm3'")
-        raise
-
-    rows: List[Dict[str, object]] = []
-    kept = skipped = 0
-
-    # Parsear filas de datos: líneas posteriores al header que no empiezan con '#'
-    for raw in lines[header_idx + 1:]:
-        line = raw.strip()
-        if (not line) or line.startswith("#"):
-            continue
-        parts = line.split()
-        if len(parts) < len(headers):
-            logger.warning(f"[aseg] Fila corta (se saltea): {line}")
-            skipped += 1
-            continue
-
-        try:
-            struct_name = parts[idx_struct]
-            vol_mm3 = float(parts[idx_vol])
-        except Exception as e:
-            logger.warning(f"[aseg] No se pudo parsear fila (se saltea): {line} | Error: {e}")
-            skipped += 1
-            continue
-            # Lista de valores a saltar
-        estructuras_a_ignorar = [
-            "Left-vessel",
-            "Left-choroid-plexus",
-            "Right-vessel",
-            "Right-choroid-plexus",
-            "5th-Ventricle",
-            "WM-hypointensities",
-            "Left-WM-hypointensities",
-            "Right-WM-hypointensities",
-            "non-WM-hypointensities",
-            "Left-non-WM-hypointensities",
-            "Right-non-WM-hypointensities",
-            "Optic-Chiasm",
-            "CC_Posterior",
-            "CC_Mid_Posterior",
-            "CC_Central",
-            "CC_Mid_Anterior",
-            "CC_Anterior",
-        ]
-
-
-        if struct_name in estructuras_a_ignorar:
-            skipped += 1
-            continue
+    return _parse_aseg_lineas(_read_lines(path), con_measures=False)[1]
 
-        rows.append({
-                "seccion": "aseg",
-                "id_corto": struct_name,
-                "descripcion": struct_name,
-                "valor": vol_mm3,
-                "unidad": "mm^3"
-            })
-        kept += 1
 
-    logger.info(f"[aseg] medidas guardadas: {kept} | saltadas: {skipped}")
-    return pd.DataFrame(rows, columns=["seccion", "id_corto", "descripcion", "valor", "unidad"])
+def parse_aseg_completo(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Lee 'aseg.stats' una sola vez y devuelve (medidas globales, tabla por estructura)
+    en un único recorrido (equivale a parse_aseg_measures + parse_aseg_stats).
+    """
+    return _parse_aseg_lineas(_read_lines(path))
 
 
 def parse_aparc_stats(path: Path, hemisphere_label: str) -> pd.DataFrame:
@@ -218,7 +229,7 @@ def parse_aparc_stats(path: Path, hemisphere_label: str) -> pd.DataFrame:
         logger.error(f"[{hemisphere_label}] No se encontraron columnas requeridas: 'StructName' y 'GrayVol'")
         raise
 
-    rows: List[Dict[str, object]] = []
+    rows: List[Tuple[str, str, str, float, str]] = []
     kept = skipped = 0
 
     for raw in lines[header_idx + 1:]:
@@ -239,20 +250,226 @@ def parse_aparc_stats(path: Path, hemisphere_label: str) -> pd.DataFrame:
             skipped += 1
             continue
 
-        rows.append({
-            "seccion": hemisphere_label,
-            "id_corto": struct_name,
-            "descripcion": struct_name,
-            "valor": grayvol,
-            "unidad": "mm^3"
-        })
+        rows.append((hemisphere_label, struct_name, struct_name, grayvol, "mm^3"))
         kept += 1
 
     logger.info(f"[{hemisphere_label}] medidas guardadas: {kept} | saltadas: {skipped}")
-    return pd.DataFrame(rows, columns=["seccion", "id_corto", "descripcion", "valor", "unidad"])
-
+    return pd.DataFrame.from_records(rows, columns=COLUMNAS_LARGO)
+
+
+# ----------------------------------------------------------------------------
+# CSV de volúmenes de SynthSeg / clinical (una fila por sujeto, una columna por estructura)
+# ----------------------------------------------------------------------------
+SECCION_CLINICAL = "clinical.subcortical"
+
+# Equivalencias SynthSeg clinical -> FreeSurfer (búsqueda case-insensitive)
+EQUIV_SYNTHSEG_FS = {k.lower(): v for k, v in {
+    "total intracranial": "eTIV",
+    "left cerebral white matter": "lhCerebralWhiteMatterVol",
+    "left cerebral cortex": "lhCortexVol",
+    "left lateral ventricle": "Left-Lateral-Ventricle",
+    "left inferior lateral ventricle": "Left-Inf-Lat-Vent",
+    "left cerebellum white matter": "Left-Cerebellum-White-Matter",
+    "left cerebellum cortex": "Left-Cerebellum-Cortex",
+    "left thalamus": "Left-Thalamus",
+    "left caudate": "Left-Caudate",
+    "left putamen": "Left-Putamen",
+    "left pallidum": "Left-Pallidum",
+    "3rd ventricle": "3rd-Ventricle",
+    "4th ventricle": "4th-Ventricle",
+    "brain-stem": "Brain-Stem",
+    "left hippocampus": "Left-Hippocampus",
+    "left amygdala": "Left-Amygdala",
+    "left accumbens area": "Left-Accumbens-area",
+    "left ventral dc": "Left-VentralDC",
+    "right cerebral white matter": "rhCerebralWhiteMatterVol",
+    "right cerebral cortex": "rhCortexVol",
+    "right lateral ventricle": "Right-Lateral-Ventricle",
+    "right inferior lateral ventricle": "Right-Inf-Lat-Vent",
+    "right cerebellum white matter": "Right-Cerebellum-White-Matter",
+    "right cerebellum cortex": "Right-Cerebellum-Cortex",
+    "right thalamus": "Right-Thalamus",
+    "right caudate": "Right-Caudate",
+    "right putamen": "Right-Putamen",
+    "right pallidum": "Right-Pallidum",
+    "right hippocampus": "Right-Hippocampus",
+    "right amygdala": "Right-Amygdala",
+    "right accumbens area": "Right-Accumbens-area",
+    "right ventral dc": "Right-VentralDC",
+}.items()}
+
+# Orden exacto de la salida clinical (lo que no esté en la lista va al final)
+ORDEN_CLINICAL_FS = [
+    "lhCortexVol",
+    "rhCortexVol",
+    "lhCerebralWhiteMatterVol",
+    "rhCerebralWhiteMatterVol",
+    "eTIV",
+    "Left-Lateral-Ventricle",
+    "Left-Inf-Lat-Vent",
+    "Left-Cerebellum-White-Matter",
+    "Left-Cerebellum-Cortex",
+    "Left-Thalamus",
+    "Left-Caudate",
+    "Left-Putamen",
+    "Left-Pallidum",
+    "3rd-Ventricle",
+    "4th-Ventricle",
+    "Brain-Stem",
+    "Left-Hippocampus",
+    "Left-Amygdala",
+    "CSF",
+    "Left-Accumbens-area",
+    "Left-VentralDC",
+    "Left-vessel",
+    "Left-choroid-plexus",
+    "Right-Lateral-Ventricle",
+    "Right-Inf-Lat-Vent",
+    "Right-Cerebellum-White-Matter",
+    "Right-Cerebellum-Cortex",
+    "Right-Thalamus",
+    "Right-Caudate",
+    "Right-Putamen",
+    "Right-Pallidum",
+    "Right-Hippocampus",
+    "Right-Amygdala",
+    "Right-Accumbens-area",
+    "Right-VentralDC",
+]
+
+# Regiones corticales de SynthSeg que no tienen par en el aparc de FS/FastSurfer
+CTX_IGNORADAS = ["frontalpole", "temporalpole", "transversetemporal", "bankssts"]
+
+EntradaCSV = Union[str, Path, Iterable[Union[str, Path]]]
+
+
+def _rutas_csv(entrada: EntradaCSV) -> Tuple[List[Path], bool]:
+    """
+    Normaliza la entrada: un CSV, una carpeta (todos sus *.csv) o una lista de CSVs.
+    Devuelve (rutas, varios); con varios=True la salida lleva la columna 'sujeto'.
+    """
+    if isinstance(entrada, (str, Path)):
+        entrada = Path(entrada)
+        if entrada.is_dir():
+            rutas = sorted(entrada.glob("*.csv"))
+            if not rutas:
+                raise FileNotFoundError(f"No hay archivos .csv en: {entrada}")
+            return rutas, True
+        return [entrada], False
+    return [Path(p) for p in entrada], True
+
+
+def _leer_synthseg_largo(entrada: EntradaCSV, etiqueta: str) -> Tuple[pd.DataFrame, bool]:
+    """
+    Lee uno o varios CSV de volúmenes (SynthSeg / clinical) y los apila en una sola tabla larga:
+      _fila (fila global = sujeto), sujeto, _col (posición de la columna), columna, col_norm, valor.
+    'sujeto' es la columna 'subject' del CSV o, si no existe, el nombre del archivo.
+    El valor ya viene convertido a número (NaN si no se pudo).
+    """
+    rutas, varios = _rutas_csv(entrada)
+    partes: List[pd.DataFrame] = []
+    filas = 0
+    for ruta in rutas:
+        try:
+            df = pd.read_csv(ruta)
+        except Exception as e:
+            logger.error(f"[{etiqueta}] No se pudo leer el CSV clínico: {ruta} ({e})")
+            raise
+        if df.empty:
+            logger.warning(f"[{etiqueta}] CSV clínico vacío: {ruta}")
+            continue
 
-def parse_clinical_csv(path_csv: Path) -> pd.DataFrame:
+        df.columns = [str(c).strip() for c in df.columns]
+        col_subject = [c for c in df.columns if c.lower() == "subject"]
+        if col_subject:
+            sujetos = df[col_subject[0]].astype(str).tolist()
+            df = df.drop(columns=col_subject)
+        elif len(df) == 1:
+            sujetos = [ruta.stem]
+        else:
+            sujetos = [f"{ruta.stem}_{i}" for i in range(len(df))]
+
+        posicion = {c: i for i, c in enumerate(df.columns)}
+        df.insert(0, "sujeto", sujetos)
+        df.insert(0, "_fila", range(filas, filas + len(df)))
+        largo = df.melt(id_vars=["_fila", "sujeto"], var_name="columna", value_name="valor")
+        largo["_col"] = largo["columna"].map(posicion)
+        partes.append(largo)
+        filas += len(df)
+
+    if not partes:
+        return pd.DataFrame(columns=["_fila", "sujeto", "_col", "columna", "col_norm", "valor"]), varios
+
+    largo = pd.concat(partes, ignore_index=True)
+    largo["col_norm"] = largo["columna"].str.lower()
+    largo["valor"] = pd.to_numeric(largo["valor"], errors="coerce")
+    return largo, varios
+
+
+def _descartar_no_numericos(largo: pd.DataFrame, etiqueta: str) -> Tuple[pd.DataFrame, int]:
+    """Saca las celdas sin valor numérico (un único warning con el conteo por columna)."""
+    nan = largo["valor"].isna()
+    n = int(nan.sum())
+    if n:
+        por_columna = largo.loc[nan, "columna"].value_counts()
+        detalle = ", ".join(f"'{c}' ({k})" for c, k in por_columna.items())
+        logger.warning(f"[{etiqueta}] {n} valores no numéricos (se saltean): {detalle}")
+    return largo[~nan], n
+
+
+def _salida_synthseg(largo: pd.DataFrame, varios: bool) -> pd.DataFrame:
+    columnas = (["sujeto"] if varios else []) + COLUMNAS_LARGO
+    return largo[columnas].reset_index(drop=True)
+
+
+def _clinical_desde_largo(largo: pd.DataFrame, varios: bool) -> pd.DataFrame:
+    """Columnas NO corticales -> seccion 'clinical.subcortical', con nombres FreeSurfer y orden ORDEN_CLINICAL_FS."""
+    es_ctx = largo["col_norm"].str.match(r"ctx-[lr]h-")
+    sel, skipped = _descartar_no_numericos(largo[~es_ctx], "clinical")
+
+    # Equivalencia a nombre FreeSurfer (si existe); si dos columnas de un sujeto caen en el
+    # mismo nombre queda la primera (en el orden de columnas del CSV)
+    sel = sel.assign(id_corto=sel["col_norm"].map(EQUIV_SYNTHSEG_FS).fillna(sel["columna"]))
+    sel = sel.sort_values(["_fila", "_col"], kind="stable")
+    duplicado = sel.duplicated(["_fila", "id_corto"])
+    if duplicado.any():
+        nombres = sorted(sel.loc[duplicado, "id_corto"].unique())
+        logger.warning(f"[clinical] Duplicados después de equivalencia (se saltean): {nombres}")
+        skipped += int(duplicado.sum())
+    sel = sel[~duplicado]
+
+    orden = {nombre: i for i, nombre in enumerate(ORDEN_CLINICAL_FS)}
+    sel = sel.assign(
+        seccion=SECCION_CLINICAL,
+        descripcion=sel["id_corto"],
+        unidad="mm^3",
+        _orden=sel["id_corto"].map(orden).fillna(len(orden)),
+    ).sort_values(["_fila", "_orden"], kind="stable")
+
+    logger.info(f"[clinical] filas guardadas: {len(sel)} | saltadas: {skipped}")
+    return _salida_synthseg(sel, varios)
+
+
+def _corticales_desde_largo(largo: pd.DataFrame, varios: bool) -> pd.DataFrame:
+    """Columnas 'ctx-lh-*' / 'ctx-rh-*' -> secciones lh.aparc / rh.aparc (sin CTX_IGNORADAS)."""
+    es_ctx = largo["col_norm"].str.match(r"ctx-[lr]h-")
+    sel, skipped = _descartar_no_numericos(largo[es_ctx], "SynthSeg")
+
+    id_corto = sel["col_norm"].str[7:]
+    ignorar = id_corto.isin(CTX_IGNORADAS)
+    skipped += int(ignorar.sum())
+    sel = sel[~ignorar].assign(
+        seccion=sel["col_norm"].str[4:6] + ".aparc",
+        id_corto=id_corto,
+        descripcion=id_corto,
+        unidad="mm^3",
+    ).sort_values(["_fila", "_col"], kind="stable")
+
+    logger.info(f"[SynthSeg] filas guardadas: {len(sel)} | saltadas: {skipped}")
+    return _salida_synthseg(sel, varios)
+
+
+def parse_clinical_csv(path_csv: EntradaCSV) -> pd.DataFrame:
     """
     Convierte el CSV clínico (SynthSeg) a formato largo:
       seccion='clinical.subcortical'
@@ -264,224 +481,23 @@ def parse_clinical_csv(path_csv: Path) -> pd.DataFrame:
     Regla: incluir TODAS las columnas NO corticales:
       - Excluir columnas que comiencen con 'ctx-lh-' o 'ctx-rh-'
       - Excluir 'subject' (si existe)
-    """
-    try:
-        df = pd.read_csv(path_csv)
-    except Exception as e:
-        logger.error(f"[clinical] No se pudo leer el CSV clínico: {path_csv} ({e})")
-        raise
-
-    if df.empty:
-        logger.warning("[clinical] CSV clínico vacío.")
-        return pd.DataFrame(columns=["seccion", "id_corto", "descripcion", "valor", "unidad"])
-
-    # Equivalencias SynthSeg clinical -> FreeSurfer (búsqueda case-insensitive)
-    _equiv_fs = {
-        "total intracranial": "eTIV",
-        "left cerebral white matter": "lhCerebralWhiteMatterVol",
-        "left cerebral cortex": "lhCortexVol",
-        "left lateral ventricle": "Left-Lateral-Ventricle",
-        "left inferior lateral ventricle": "Left-Inf-Lat-Vent",
-        "left cerebellum white matter": "Left-Cerebellum-White-Matter",
-        "left cerebellum cortex": "Left-Cerebellum-Cortex",
-        "left thalamus": "Left-Thalamus",
-        "left caudate": "Left-Caudate",
-        "left putamen": "Left-Putamen",
-        "left pallidum": "Left-Pallidum",
-        "3rd ventricle": "3rd-Ventricle",
-        "4th ventricle": "4th-Ventricle",
-        "brain-stem": "Brain-Stem",
-        "left hippocampus": "Left-Hippocampus",
-        "left amygdala": "Left-Amygdala",
-        "left accumbens area": "Left-Accumbens-area",
-        "left ventral dc": "Left-VentralDC",
-        "right cerebral white matter": "rhCerebralWhiteMatterVol",
-        "right cerebral cortex": "rhCortexVol",
-        "right lateral ventricle": "Right-Lateral-Ventricle",
-        "right inferior lateral ventricle": "Right-Inf-Lat-Vent",
-        "right cerebellum white matter": "Right-Cerebellum-White-Matter",
-        "right cerebellum cortex": "Right-Cerebellum-Cortex",
-        "right thalamus": "Right-Thalamus",
-        "right caudate": "Right-Caudate",
-        "right putamen": "Right-Putamen",
-        "right pallidum": "Right-Pallidum",
-        "right hippocampus": "Right-Hippocampus",
-        "right amygdala": "Right-Amygdala",
-        "right accumbens area": "Right-Accumbens-area",
-        "right ventral dc": "Right-VentralDC",
-    }
-    _equiv_fs = {k.lower(): v for k, v in _equiv_fs.items()}
-
-    rows: List[Dict[str, object]] = []
-    kept = skipped = 0
 
-    for idx_row, row in df.iterrows():
-        seen_ids: set[str] = set()  # para evitar duplicados tras mapeo en esta fila
-
-        for col in df.columns:
-            col_str = str(col).strip()
-            col_norm = col_str.lower()
-
-            # Exclusiones de columnas corticales y 'subject'
-            if col_norm.startswith("ctx-lh-") or col_norm.startswith("ctx-rh-"):
-                continue
-            if col_norm == "subject":
-                continue
-
-            raw_val = row[col]
-            # Intentar convertir a float
-            try:
-                val = pd.to_numeric(raw_val, errors="coerce")
-                if pd.isna(val):
-                    logger.warning(f"[clinical] Valor no numérico para columna '{col_str}' (se saltea). Fila {idx_row}")
-                    skipped += 1
-                    continue
-            except Exception as e:
-                logger.warning(f"[clinical] No se pudo convertir valor en '{col_str}' (se saltea). Error: {e}")
-                skipped += 1
-                continue
-
-            # Aplicar equivalencia a nombre FreeSurfer (si existe)
-            mapped_name = _equiv_fs.get(col_norm, col_str)
-
-            # Evitar duplicados si dos columnas mapean al mismo nombre FS
-            if mapped_name in seen_ids:
-                logger.warning(
-                    f"[clinical] Duplicado después de equivalencia: '{mapped_name}' (se saltea). Fila {idx_row}"
-                )
-                skipped += 1
-                continue
-            seen_ids.add(mapped_name)
-
-            rows.append({
-                "seccion": "clinical.subcortical",
-                "id_corto": mapped_name,
-                "descripcion": mapped_name,
-                "valor": float(val),
-                "unidad": "mm^3"
-            })
-            kept += 1
-
-    logger.info(f"[clinical] filas guardadas: {kept} | saltadas: {skipped}")
-        
-        # Lista en el orden exacto que querés en la salida
-    orden_fs = [
-        "lhCortexVol",
-        "rhCortexVol",
-        "lhCerebralWhiteMatterVol",
-        "rhCerebralWhiteMatterVol",
-        "eTIV",
-        "Left-Lateral-Ventricle",
-        "Left-Inf-Lat-Vent",
-        "Left-Cerebellum-White-Matter",
-        "Left-Cerebellum-Cortex",
-        "Left-Thalamus",
-        "Left-Caudate",
-        "Left-Putamen",
-        "Left-Pallidum",
-        "3rd-Ventricle",
-        "4th-Ventricle",
-        "Brain-Stem",
-        "Left-Hippocampus",
-        "Left-Amygdala",
-        "CSF",
-        "Left-Accumbens-area",
-        "Left-VentralDC",
-        "Left-vessel",
-        "Left-choroid-plexus",
-        "Right-Lateral-Ventricle",
-        "Right-Inf-Lat-Vent",
-        "Right-Cerebellum-White-Matter",
-        "Right-Cerebellum-Cortex",
-        "Right-Thalamus",
-        "Right-Caudate",
-        "Right-Putamen",
-        "Right-Pallidum",
-        "Right-Hippocampus",
-        "Right-Amygdala",
-        "Right-Accumbens-area",
-        "Right-VentralDC"
-    ]
-
-    df_result = pd.DataFrame(rows, columns=["seccion", "id_corto", "descripcion", "valor", "unidad"])
+    'path_csv' puede ser un CSV, una carpeta o una lista de CSVs: todos se convierten juntos
+    (melt + map + filtro sobre la tabla completa). Con varios CSVs se agrega la columna 'sujeto'.
+    """
+    largo, varios = _leer_synthseg_largo(path_csv, "clinical")
+    return _clinical_desde_largo(largo, varios)
 
-    # Reordenar según lista, dejando lo que no esté al final
-    df_result["orden_tmp"] = df_result["id_corto"].apply(lambda x: orden_fs.index(x) if x in orden_fs else len(orden_fs))
-    df_result = df_result.sort_values("orden_tmp").drop(columns="orden_tmp").reset_index(drop=True)
-    return df_result
 
-def parse_SynthSeg_csv(path_csv: Path) -> pd.DataFrame:
-    try:
-        df = pd.read_csv(path_csv)
-    except Exception as e:
-        logger.error(f"[SynthSeg] No se pudo leer el CSV clínico: {path_csv} ({e})")
-        raise
+def parse_SynthSeg_csv(path_csv: EntradaCSV) -> pd.DataFrame:
+    """
+    Columnas corticales del CSV de SynthSeg ('ctx-lh-*' / 'ctx-rh-*') a formato largo,
+    seccion lh.aparc / rh.aparc, id_corto = nombre de la región. Misma entrada que parse_clinical_csv.
+    """
+    largo, varios = _leer_synthseg_largo(path_csv, "SynthSeg")
+    return _corticales_desde_largo(largo, varios)
 
-    if df.empty:
-        logger.warning("[SynthSeg] CSV clínico vacío.")
-        return pd.DataFrame(columns=["seccion", "id_corto", "descripcion", "valor", "unidad"])
-    rows: List[Dict[str, object]] = []
-    kept = skipped = 0
 
-    for idx_row, row in df.iterrows():
-        seen_ids: set[str] = set()  # para evitar duplicados tras mapeo en esta fila
-
-        for col in df.columns:
-            col_str = str(col).strip()
-            col_norm = col_str.lower()
-
-            # Exclusiones de columnas corticales y 'subject'
-            if not (col_norm.startswith("ctx-lh-") or col_norm.startswith("ctx-rh-")):
-                continue
-            if col_norm == "subject":
-                continue
-            raw_val = row[col]
-            # Intentar convertir a float
-            try:
-                val = pd.to_numeric(raw_val, errors="coerce")
-                if pd.isna(val):
-                    logger.warning(f"[SynthSeg] Valor no numérico para columna '{col_str}' (se saltea). Fila {idx_row}")
-                    skipped += 1
-                    continue
-            except Exception as e:
-                logger.warning(f"[SynthSeg] No se pudo convertir valor en '{col_str}' (se saltea). Error: {e}")
-                skipped += 1
-                continue
-
-            estructuras_a_ignorar = [
-            "frontalpole",
-            "temporalpole",
-            "transversetemporal",
-            "bankssts"
-        ]
-
-
-            if col_norm[7:] in estructuras_a_ignorar:
-                skipped += 1
-                continue
-            if col_norm.startswith("ctx-lh-"):
-                rows.append({
-                    "seccion": "lh.aparc",
-                    "id_corto": col_norm[7:],
-                    "descripcion": col_norm[7:],
-                    "valor": float(val),
-                    "unidad": "mm^3"
-                })
-                kept += 1
-            if col_norm.startswith("ctx-rh-"):
-                rows.append({
-                    "seccion": "rh.aparc",
-                    "id_corto": col_norm[7:],
-                    "descripcion": col_norm[7:],
-                    "valor": float(val),
-                    "unidad": "mm^3"
-                })
-                kept += 1
-
-    logger.info(f"[clinical] filas guardadas: {kept} | saltadas: {skipped}")
-    df_result = pd.DataFrame(rows, columns=["seccion", "id_corto", "descripcion", "valor", "unidad"])
-    return df_result
-            
 # ============================================================================
 # NUEVO: orquestador para clinical
 # ============================================================================
@@ -490,7 +506,7 @@ def procesar_clinical(
     lh_aparc_stats_path,
     rh_aparc_stats_path,
     output_csv_path
-) -> None:
+) -> pd.DataFrame:
     """
     Genera un único CSV largo con columnas:
         seccion, id_corto, descripcion, valor, unidad
@@ -528,6 +544,7 @@ def procesar_clinical(
 
     logger.info(f"Total filas guardadas: {len(df_final)}")
     print(f"Archivo CSV generado en: {output_csv_path}")
+    return df_final
 
 # ============================================================================
 # orquestador para SynthSeg
@@ -535,7 +552,7 @@ def procesar_clinical(
 def procesar_SynthSeg(
     SythSeg_csv_path,
     output_csv_path
-) -> None:
+) -> pd.DataFrame:
     """
     Genera un único CSV largo con columnas:
         seccion, id_corto, descripcion, valor, unidad
@@ -554,9 +571,10 @@ def procesar_SynthSeg(
         logger.error(msg)
         raise FileNotFoundError(msg)
 
-    # Parsear cada entrada
-    df_seg= parse_clinical_csv(SythSeg_csv_path)
-    df_ctx= parse_SynthSeg_csv(SythSeg_csv_path)
+    # Parsear cada entrada (el CSV se lee una vez para las dos secciones)
+    largo, _ = _leer_synthseg_largo(SythSeg_csv_path, "SynthSeg")
+    df_seg = _clinical_desde_largo(largo, False)
+    df_ctx = _corticales_desde_largo(largo, False)
 
     # Concatenar en el orden solicitado
     df_final = pd.concat([df_seg, df_ctx], ignore_index=True)
@@ -570,6 +588,45 @@ def procesar_SynthSeg(
 
     logger.info(f"Total filas guardadas: {len(df_final)}")
     print(f"Archivo CSV generado en: {output_csv_path}")
+    return df_final
+
+def procesar_SynthSeg_cohorte(entrada: EntradaCSV, output_csv_path) -> pd.DataFrame:
+    """
+    Convierte de una vez todos los CSV de SynthSeg de un modelo (carpeta o lista de archivos)
+    en un único CSV largo: sujeto, seccion, id_corto, descripcion, valor, unidad.
+    Por sujeto: clinical.subcortical -> lh.aparc / rh.aparc (igual que procesar_SynthSeg).
+    """
+    output_csv_path = Path(output_csv_path)
+    if not output_csv_path.parent.exists():
+        msg = f"La carpeta de salida no existe: {output_csv_path.parent}"
+        logger.error(msg)
+        raise FileNotFoundError(msg)
+
+    rutas, _ = _rutas_csv(entrada)
+    largo, _ = _leer_synthseg_largo(rutas, "SynthSeg")
+    df_final = pd.concat(
+        [_clinical_desde_largo(largo, True), _corticales_desde_largo(largo, True)],
+        keys=[0, 1], names=["_bloque", None],
+    ).reset_index(level="_bloque")
+
+    # Agrupar por sujeto manteniendo el orden de aparición y, dentro de cada uno, clinical -> corticales
+    orden_sujeto = {s: i for i, s in enumerate(pd.unique(df_final["sujeto"]))}
+    df_final = (
+        df_final.assign(_orden=df_final["sujeto"].map(orden_sujeto))
+        .sort_values(["_orden", "_bloque"], kind="stable")
+        .drop(columns=["_orden", "_bloque"])
+        .reset_index(drop=True)
+    )
+
+    try:
+        df_final.to_csv(output_csv_path, index=False)
+    except Exception as e:
+        logger.error(f"No se pudo guardar el CSV en {output_csv_path} ({e})")
+        raise
+
+    logger.info(f"Total filas guardadas: {len(df_final)} ({len(orden_sujeto)} sujetos)")
+    print(f"Archivo CSV generado en: {output_csv_path}")
+    return df_final
 
 # ============================================================================
 # Orquestador
@@ -579,7 +636,7 @@ def procesar_todo(
     lh_aparc_stats_path,
     rh_aparc_stats_path,
     output_csv_path
-) -> None:
+) -> pd.DataFrame:
     """
     Genera un único CSV largo con columnas:
         seccion, id_corto, descripcion, valor, unidad
@@ -601,8 +658,7 @@ def procesar_todo(
         raise FileNotFoundError(msg)
 
     # Parsear cada archivo (en el orden solicitado)
-    df_aseg_measures = parse_aseg_measures(aseg_stats_path)
-    df_aseg = parse_aseg_stats(aseg_stats_path)
+    df_aseg_measures, df_aseg = parse_aseg_completo(aseg_stats_path)
     df_lh = parse_aparc_stats(lh_aparc_stats_path, "lh.aparc")
     df_rh = parse_aparc_stats(rh_aparc_stats_path, "rh.aparc")
 
@@ -621,13 +677,32 @@ def procesar_todo(
 
     logger.info(f"Total filas guardadas: {len(df_final)}")
     print(f"Archivo CSV generado en: {output_csv_path}")
+    return df_final
 
 # Leer rutas desde los archivos
 def leer_rutas(path_txt):
     with path_txt.open("r", encoding="utf-8") as archivo:
         return [Path(linea.strip()) for linea in archivo if linea.strip()]
 
-def batch_procesar_todo(txt_aseg, dir_salida, modelo: str, txt_lha=None, txt_rha=None):
+def _volumenes_a_almacen(df_final: pd.DataFrame, modelo: str, sujeto: str) -> pd.DataFrame:
+    """Filas del CSV largo de volúmenes en el formato del almacén (etiqueta = '<seccion>:<id_corto>')."""
+    df = df_final.assign(etiqueta=df_final["seccion"].astype(str) + ":" + df_final["id_corto"].astype(str))
+    return formato_largo(df, modelo=modelo, sujeto=sujeto, etiqueta="etiqueta",
+                         estructura="descripcion", metricas={"valor": "volumen_mm3"})
+
+
+def _procesar_sujeto(modelo: str, aseg, lha, rha, ruta_salida):
+    """Procesa un sujeto según el modelo (se ejecuta en un proceso del pool cuando workers > 1)."""
+    if modelo == "synthseg":
+        return procesar_SynthSeg(aseg, ruta_salida)
+    if modelo in ("FS", "fast"):
+        return procesar_todo(aseg, lha, rha, ruta_salida)
+    if modelo == "clinical":
+        return procesar_clinical(aseg, lha, rha, ruta_salida)
+    return None
+
+
+def batch_procesar_todo(txt_aseg, dir_salida, modelo: str, txt_lha=None, txt_rha=None, almacen=None, workers=1):
 
     """
     Ejecuta el procesamiento por lotes de sujetos en función del modelo especificado.
@@ -651,12 +726,22 @@ def batch_procesar_todo(txt_aseg, dir_salida, modelo: str, txt_lha=None, txt_rha
         Ruta al archivo `.txt` con paths a los archivos lha por sujeto. Requerido si el modelo no es "synthseg".
     txt_rha : str or Path, opcional
         Ruta al archivo `.txt` con paths a los archivos rha por sujeto. Requerido si el modelo no es "synthseg".
+    almacen : str or Path, opcional
+        Directorio del almacén Parquet de métricas (ver almacen_metricas). Si se indica, los volúmenes
+        de todos los sujetos se agregan con metrica='volumen_mm3' y sujeto = id_sujeto(aseg)
+        (la misma clave que DICE y HD95; p. ej. '<sujeto>/stats/aseg.stats' -> '<sujeto>').
+    workers : int, opcional
+        Sujetos en paralelo (pool de procesos). Por defecto 1 (secuencial).
 
     Comportamiento:
     --------------
     - Valida que las listas de rutas tengan la misma longitud si el modelo requiere múltiples entradas.
     - Crea el directorio de salida si no existe.
     - Genera archivos de salida con nombre `csvvol_<modelo>_<p>.csv`, donde `p` es el índice del sujeto.
+    - Genera además la tabla de la cohorte `csvvol_<modelo>_cohorte.csv` (columna `sujeto` = `p`
+      + las columnas del CSV por sujeto), escrita a medida que terminan los sujetos, en orden.
+    - Cada `aseg.stats` se lee una sola vez (medidas globales y tabla por estructura en un recorrido).
+    - Si un sujeto falla, se informa y se continúa con el resto.
     - Llama a la función correspondiente según el modelo:
         - `procesar_SynthSeg()` para "synthseg"
         - `procesar_todo()` para "FS" y "fast"
@@ -686,32 +771,43 @@ def batch_procesar_todo(txt_aseg, dir_salida, modelo: str, txt_lha=None, txt_rha
     rutas_aseg = leer_rutas(txt_aseg)
 
     if modelo == "synthseg":
-        for p, aseg in enumerate(rutas_aseg, start=1):
-            nombre_archivo = f"csvvol_{modelo}_{p}.csv"
-            ruta_salida = dir_salida / nombre_archivo
-            logging.info(f"🔄 Procesando sujeto {p}")
-            procesar_SynthSeg(aseg, ruta_salida)
-        return
-
-    # Leer rutas opcionales
-    rutas_lha = leer_rutas(Path(txt_lha)) if txt_lha else []
-    rutas_rha = leer_rutas(Path(txt_rha)) if txt_rha else []
-
-    if modelo in ("FS", "fast", "clinical"):
-        if not (len(rutas_aseg) == len(rutas_lha) == len(rutas_rha)):
-            raise ValueError("❌ Las listas de rutas no tienen la misma longitud")
-
-    for p, (aseg, lha, rha) in enumerate(zip(rutas_aseg, rutas_lha, rutas_rha), start=1):
-        nombre_archivo = f"csvvol_{modelo}_{p}.csv"
-        ruta_salida = dir_salida / nombre_archivo
-
-        if modelo in ("FS", "fast"):
-            logging.info(f"🔄 Procesando sujeto {p}")
-            procesar_todo(aseg, lha, rha, ruta_salida)
-        elif modelo == "clinical":
-            logging.info(f"🔄 Procesando sujeto {p}")
-            procesar_clinical(aseg, lha, rha, ruta_salida)
+        rutas_lha = rutas_rha = [None] * len(rutas_aseg)
+    else:
+        # Leer rutas opcionales
+        rutas_lha = leer_rutas(Path(txt_lha)) if txt_lha else []
+        rutas_rha = leer_rutas(Path(txt_rha)) if txt_rha else []
+
+        if modelo in ("FS", "fast", "clinical"):
+            if not (len(rutas_aseg) == len(rutas_lha) == len(rutas_rha)):
+                raise ValueError("❌ Las listas de rutas no tienen la misma longitud")
+
+    tareas = [
+        (modelo, aseg, lha, rha, dir_salida / f"csvvol_{modelo}_{p}.csv")
+        for p, (aseg, lha, rha) in enumerate(zip(rutas_aseg, rutas_lha, rutas_rha), start=1)
+    ]
+    logging.info(f"🔄 Procesando {len(tareas)} sujetos (workers={workers})")
+
+    # Tabla de la cohorte: se reescribe en cada corrida y se le agregan filas a medida que llegan
+    ruta_cohorte = dir_salida / f"csvvol_{modelo}_cohorte.csv"
+    pd.DataFrame(columns=["sujeto"] + COLUMNAS_LARGO).to_csv(ruta_cohorte, index=False)
+    filas_almacen: List[pd.DataFrame] = []
+    sujetos_almacen = ids_sujetos(rutas_aseg) if almacen is not None else []
+
+    for k, df_final, error in ejecutar_en_orden(_procesar_sujeto, tareas, workers=workers, reintentos=0):
+        p = k + 1
+        if error is not None:
+            logger.error(f"Sujeto {p}: error al procesar {tareas[k][1]} ({error})")
+            continue
+        if df_final is None:
+            continue
+        df_final.insert(0, "sujeto", p)
+        df_final.to_csv(ruta_cohorte, mode="a", header=False, index=False)
+        if almacen is not None:
+            filas_almacen.append(_volumenes_a_almacen(df_final, modelo, sujetos_almacen[k]))
 
+    logger.info(f"Tabla de la cohorte guardada en: {ruta_cohorte}")
+    if almacen is not None:
+        agregar_metricas(almacen, filas_almacen)
 
 if __name__ == "__main__":
     # FAST / clinical/ FreeSurfer-like (aseg + lh.aparc + rh.aparc)
@@ -724,6 +820,7 @@ if __name__ == "__main__":
         modelo="fast", 
         txt_lha="/home/mbudani/results/fastsurfer_array_results/path_fastsurfer_stats_lhaparc.txt", 
         txt_rha="/home/mbudani/results/fastsurfer_array_results/path_fastsurfer_stats_rhaparc.txt",
+        workers=workers_por_defecto(),
     )
     #free
     batch_procesar_todo(
@@ -748,3 +845,8 @@ if __name__ == "__main__":
         dir_salida="/home/mbudani/results/procesamiento/volbrain/synthseg",
         modelo="synthseg"
     )
+    # SynthSeg: toda la carpeta de CSVs del modelo en una sola llamada (tabla larga con 'sujeto')
+    # procesar_SynthSeg_cohorte(
+    #     "/home/mbudani/results/synthseg_array_results/vol",
+    #     "/home/mbudani/results/procesamiento/volbrain/synthseg/csvvol_synthseg_cohorte.csv",
+    # )